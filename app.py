@@ -12,9 +12,11 @@ logger = logging.getLogger(__name__)
 
 # Import existing handlers
 from simple_message_db import message_db
-from openai_client import get_openai_response
+from recipient_index import recipient_index
+from openai_client import get_openai_response, request_openai_response
+from llm_cache import llm_cache, prompt_version
 from gemini_client import generate_image_with_retry, GeminiQuotaError
-from content_filter import check_content_safety, sanitize_image_prompt
+from content_filter import check_content_safety, check_many_content_safety, sanitize_image_prompt
 
 # OLD: Keep legacy imports for compatibility with old endpoints
 from image_queue_manager import queue_manager
@@ -23,18 +25,28 @@ from batch_image_generator import batch_generator
 # NEW: Import smart batch management system
 from smart_batch_manager import smart_batch_manager, BatchStatus
 from sequential_batch_processor import sequential_processor
-from PIL import Image, ImageOps
-from io import BytesIO
+from image_processing import image_processor
+from async_bridge import run_async
+from telegram_broadcaster import telegram_broadcaster
+from mini_app_feed import mini_app_feed
+from app_common import start_async_clients, make_dashboard_events, event_stream_response, chat_clear_status
+
 import threading
 import time
 import asyncio
 import requests
 import base64
 from config import BOT_TOKEN, GENERATED_IMAGES_FOLDER, NEW_BOT_TOKEN
+from config import MINI_APP_CLEANUP_INTERVAL, MINI_APP_LONG_POLL_TIMEOUT, MINI_APP_MESSAGE_TTL
 
 # Импортируем менеджер промтов
 from prompt_manager import get_current_base_prompt, update_base_prompt, get_prompt_info
 
+start_async_clients()
+
+# Последнее админское сообщение для Mini App хранится в памяти процесса
+mini_app_feed.seed(message_db.get_latest_message('admin'))
+
 def auto_generation_worker():
     """
     Новый фоновый процесс для последовательной обработки батчей
@@ -64,15 +76,9 @@ def auto_generation_worker():
                 if created_batches:
                     logger.info(f"✅ Создано {len(created_batches)} батчей")
                     
-                    # Последовательно обрабатываем все батчи
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    
-                    try:
-                        result = loop.run_until_complete(sequential_processor.process_all_batches())
-                        logger.info(f"🎉 Обработка завершена: {result['processed']} успешно, {result['failed']} ошибок")
-                    finally:
-                        loop.close()
+                    # Обрабатываем все батчи в общем фоновом event loop
+                    result = run_async(sequential_processor.process_all_batches())
+                    logger.info(f"🎉 Обработка завершена: {result['processed']} успешно, {result['failed']} ошибок")
             
             # Очищаем старые завершенные батчи (старше 1 часа)
             smart_batch_manager.clear_completed_batches(older_than_hours=1)
@@ -111,27 +117,31 @@ def send_telegram_message(user_id, message):
         logger.error(f"Исключение при отправке сообщения пользователю {user_id}: {e}")
         return False
 
+def mini_app_button_markup(button_text="🎬 Открыть Mini App", web_app_url=None):
+    """Клавиатура с кнопкой для перехода в Mini App"""
+    # Если URL не указан, используем дефолтный
+    if not web_app_url:
+        web_app_url = "https://t.me/neyro_bot/app"  # Замените на ваш реальный URL Mini App
+    
+    return {
+        'inline_keyboard': [[
+            {
+                'text': button_text,
+                'web_app': {'url': web_app_url}
+            }
+        ]]
+    }
+
 def send_telegram_notification_with_button(user_id, notification_text, button_text="🎬 Открыть Mini App", web_app_url=None):
     """Отправляет уведомление с кнопкой для перехода в Mini App"""
     try:
         url = f"https://api.telegram.org/bot{NEW_BOT_TOKEN}/sendMessage"
         
-        # Если URL не указан, используем дефолтный
-        if not web_app_url:
-            web_app_url = "https://t.me/neyro_bot/app"  # Замените на ваш реальный URL Mini App
-        
         data = {
             'chat_id': user_id,
             'text': notification_text,
             'parse_mode': 'Markdown',
-            'reply_markup': {
-                'inline_keyboard': [[
-                    {
-                        'text': button_text,
-                        'web_app': {'url': web_app_url}
-                    }
-                ]]
-            }
+            'reply_markup': mini_app_button_markup(button_text, web_app_url)
         }
         
         response = requests.post(url, data=json.dumps(data), headers={'Content-Type': 'application/json'}, timeout=10)
@@ -302,10 +312,7 @@ def api_message():
     
     # Безопасный вызов async функции
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        ai_response = loop.run_until_complete(get_openai_response(message, conversation_history))
-        loop.close()
+        ai_response = run_async(get_openai_response(message, conversation_history))
     except RuntimeError as e:
         logger.error(f"Ошибка event loop в api_message: {e}")
         from mock_responses import get_friendly_response
@@ -357,9 +364,8 @@ def admin_stats():
 @app.route('/api/admin/messages', methods=['GET'])
 def admin_messages():
     message_db.load_messages()
-    # Показываем только сообщения от Mini App (исключаем админские и бот)
-    all_user_msgs = message_db.get_user_messages_only(200)  # Увеличиваем лимит до 200 сообщений
-    msgs = [msg for msg in all_user_msgs if msg.get('source') == 'mini_app'][-50:]  # Показываем последние 50 сообщений
+    # Показываем только сообщения от Mini App (исключаем админские и бот), последние 50
+    msgs = message_db.get_messages_by_source(['mini_app'], limit=50)
     response = jsonify(success=True, messages=msgs, count=len(msgs), timestamp=int(time.time()*1000))
     response.headers.add('Access-Control-Allow-Origin', '*')
     return response
@@ -370,7 +376,7 @@ def admin_export():
     message_db.load_messages()
     stats = message_db.get_stats()
     recent = message_db.get_messages(60)
-    export_data = {'export_info':{'timestamp':int(time.time()*1000),'export_time': time.strftime('%Y-%m-%d %H:%M:%S'),'total_messages': len(message_db.messages)}, 'statistics': stats, 'recent_messages': recent}
+    export_data = {'export_info':{'timestamp':int(time.time()*1000),'export_time': time.strftime('%Y-%m-%d %H:%M:%S'),'total_messages': message_db.count_messages()}, 'statistics': stats, 'recent_messages': recent}
     response = jsonify(success=True, data=export_data, timestamp=int(time.time()*1000))
     response.headers.add('Access-Control-Allow-Origin', '*')
     return response
@@ -383,6 +389,20 @@ def admin_reset():
     response.headers.add('Access-Control-Allow-Origin', '*')
     return response
 
+# Шаблон промпта микса для /api/admin/mixed-text (его текст входит в версию ключа кэша LLM)
+ADMIN_MIX_PROMPT = """Создай краткий усредненный промпт (максимум 100 символов) из этих сообщений пользователей:
+
+Сообщения: {messages}
+
+ТРЕБОВАНИЯ:
+- Максимум 100 символов
+- Объедини ключевые слова и образы
+- Используй только самые важные элементы
+- Пиши на русском языке
+- Создай единый краткий образ
+
+Пример: "Море, шторм, корабль, приключения" """
+
 # Admin mixed-text endpoint
 @app.route('/api/admin/mixed-text', methods=['POST'])
 def admin_mixed_text():
@@ -396,8 +416,7 @@ def admin_mixed_text():
     else:
         # Фильтруем сообщения перед обработкой
         filtered_texts = []
-        for text in texts:
-            is_safe, _ = check_content_safety(text)
+        for text, (is_safe, _) in zip(texts, check_many_content_safety(texts)):
             if is_safe:
                 filtered_texts.append(text)
             else:
@@ -413,33 +432,21 @@ def admin_mixed_text():
                 mixed = single_text[:97] + "..." if len(single_text) > 100 else single_text
             else:
                 # Для множественных сообщений создаем краткий усредненный промпт
-                prompt = f"""Создай краткий усредненный промпт (максимум 100 символов) из этих сообщений пользователей:
-
-Сообщения: {'; '.join(filtered_texts)}
-
-ТРЕБОВАНИЯ:
-- Максимум 100 символов
-- Объедини ключевые слова и образы
-- Используй только самые важные элементы
-- Пиши на русском языке
-- Создай единый краткий образ
-
-Пример: "Море, шторм, корабль, приключения" """
+                prompt = ADMIN_MIX_PROMPT.format(messages='; '.join(filtered_texts))
+                
+                async def request_mixed_text():
+                    text = await request_openai_response(prompt)
+                    # Принудительно ограничиваем до 100 символов
+                    return text[:97] + "..." if len(text) > 100 else text
                 
                 # Используем синхронный подход для вызова async функции
                 try:
-                    # Создаем новый event loop для этого вызова
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    mixed = loop.run_until_complete(get_openai_response(prompt))
-                    loop.close()
-                    
-                    # Принудительно ограничиваем до 100 символов
-                    if len(mixed) > 100:
-                        mixed = mixed[:97] + "..."
-                        
-                except RuntimeError as e:
-                    logger.error(f"Ошибка event loop: {e}")
+                    # Повторный набор сообщений берется из кэша без запроса к LLM
+                    mixed = run_async(llm_cache.get_or_create(
+                        'admin_mix', filtered_texts, prompt_version(ADMIN_MIX_PROMPT), request_mixed_text
+                    ))
+                except Exception as e:
+                    logger.error(f"Ошибка получения миксированного текста: {e}")
                     # Fallback: простое объединение ключевых слов
                     mixed = " ".join(filtered_texts[:3])  # Берем первые 3 сообщения
                     if len(mixed) > 100:
@@ -567,19 +574,13 @@ def smart_batches_create():
 def smart_batches_process_next():
     """Обрабатывает следующий батч"""
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        success = run_async(sequential_processor.process_next_batch())
         
-        try:
-            success = loop.run_until_complete(sequential_processor.process_next_batch())
-            
-            response = jsonify(
-                success=success,
-                message='Батч обработан успешно' if success else 'Нет доступных батчей',
-                timestamp=int(time.time() * 1000)
-            )
-        finally:
-            loop.close()
+        response = jsonify(
+            success=success,
+            message='Батч обработан успешно' if success else 'Нет доступных батчей',
+            timestamp=int(time.time() * 1000)
+        )
         
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
@@ -614,6 +615,19 @@ def smart_batches_current_mixed_text():
         logger.error(f"Ошибка получения миксированного текста: {e}")
         return jsonify(success=False, error=str(e)), 500
 
+def _batch_image_info(batch: dict) -> dict:
+    """Карточка изображения завершенного батча для админ-панели"""
+    image_path = batch['image_path']
+    return {
+        'batch_id': batch['id'],
+        'mixed_text': batch.get('mixed_text', ''),
+        'image_url': f"/static/generated_images/{os.path.basename(image_path)}",
+        'image_path': image_path,
+        'completed_at': batch.get('completed_at') or 0,
+        'processing_time': batch.get('processing_time') or 0,
+        'message_count': batch.get('message_count') or 0
+    }
+
 @app.route('/api/admin/smart-batches/images', methods=['GET'])
 def smart_batches_images():
     """Получить список сгенерированных изображений"""
@@ -625,21 +639,10 @@ def smart_batches_images():
         # Защищаемся от None значений в completed_at
         completed_batches.sort(key=lambda x: x.get('completed_at') or 0, reverse=True)
         
-        images_data = []
-        for batch in completed_batches:
-            image_path = batch.get('image_path')
-            if image_path and os.path.exists(image_path):
-                # Создаем URL для изображения
-                image_url = f"/static/generated_images/{os.path.basename(image_path)}"
-                images_data.append({
-                    'batch_id': batch['id'],
-                    'mixed_text': batch.get('mixed_text', ''),
-                    'image_url': image_url,
-                    'image_path': image_path,
-                    'completed_at': batch.get('completed_at') or 0,
-                    'processing_time': batch.get('processing_time') or 0,
-                    'message_count': batch.get('message_count') or 0
-                })
+        images_data = [
+            _batch_image_info(batch) for batch in completed_batches
+            if batch['image_path'] and os.path.exists(batch['image_path'])
+        ]
         
         # Если нет изображений из батчей, получаем все изображения из папки
         if not images_data and os.path.exists(GENERATED_IMAGES_FOLDER):
@@ -677,6 +680,18 @@ def smart_batches_images():
             'timestamp': int(time.time() * 1000)
         }), 500
 
+# Источники сообщений и лимит ленты админ-панели (как в /api/admin/messages)
+ADMIN_MESSAGE_SOURCES = ('mini_app',)
+ADMIN_MESSAGE_LIMIT = 50
+
+_admin_dashboard_events = make_dashboard_events(ADMIN_MESSAGE_SOURCES, ADMIN_MESSAGE_LIMIT, _batch_image_info)
+
+@app.route('/api/admin/events', methods=['GET'])
+@require_admin_auth
+def admin_events():
+    """Поток событий админ-панели (Server-Sent Events) вместо периодического опроса"""
+    return event_stream_response(_admin_dashboard_events)
+
 # ============================================================================
 
 @app.route('/static/generated_images/<filename>')
@@ -693,11 +708,11 @@ def admin_latest_track():
     """Возвращает последний трек-сообщение"""
     try:
         message_db.load_messages()
-        # Фильтруем только админские сообщения треков
-        admin_msgs = [m for m in message_db.messages if m.get('source')=='admin']
-        if not admin_msgs:
+        # Берем только последнее админское сообщение трека
+        latest = message_db.get_latest_message('admin')
+        if not latest:
             return jsonify(success=True, message='', timestamp=int(time.time()*1000))
-        last = admin_msgs[-1]['message']
+        last = latest['message']
         resp = jsonify(success=True, message=last, timestamp=int(time.time()*1000))
         resp.headers.add('Access-Control-Allow-Origin', '*')
         return resp
@@ -717,6 +732,8 @@ def admin_generate_image():
         if not msgs:
             return jsonify(success=False, error='Нет сообщений для генерации', timestamp=int(time.time()*1000)), 400
         prompt = ' '.join(msgs)
+    # use_cache=false - новый вариант изображения вместо кэшированного для того же промпта
+    use_cache = data.get('use_cache', True) is not False
     
     # Проверяем безопасность контента
     is_safe, reason = check_content_safety(prompt)
@@ -733,10 +750,7 @@ def admin_generate_image():
     try:
         # Используем безопасный вызов async функции
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            image_b64 = loop.run_until_complete(generate_image_with_retry(clean_prompt))
-            loop.close()
+            image_b64 = run_async(generate_image_with_retry(clean_prompt, use_cache=use_cache))
         except RuntimeError as e:
             logger.error(f"Ошибка event loop в генерации изображения: {e}")
             raise Exception(f"Ошибка генерации: {e}")
@@ -746,9 +760,8 @@ def admin_generate_image():
         folder = os.getenv('GENERATED_IMAGES_FOLDER','generated_images')
         os.makedirs(folder, exist_ok=True)
         path = os.path.join(folder, filename)
-        with Image.open(BytesIO(img_data)) as img:
-            img = ImageOps.fit(img, (1920,1280), Image.Resampling.LANCZOS)
-            img.save(path)
+        # Обрезка под 1920x1280 выполняется в пуле процессов, а не в потоке запроса
+        run_async(image_processor.fit_and_save(img_data, path))
         resp = jsonify(success=True, filename=filename, filepath=f'/generated_images/{filename}', original_prompt=prompt, clean_prompt=clean_prompt, timestamp=int(time.time()*1000))
     except GeminiQuotaError as e:
         resp = jsonify(success=False, error=f'Квота истекла: {e}', timestamp=int(time.time()*1000))
@@ -808,10 +821,7 @@ def admin_generate_content():
         
         # Выполняем асинхронную генерацию безопасно
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            generated_content = loop.run_until_complete(get_openai_response(prompt))
-            loop.close()
+            generated_content = run_async(get_openai_response(prompt))
         except RuntimeError as e:
             logger.error(f"Ошибка event loop в генерации контента: {e}")
             generated_content = f"Ошибка генерации контента: {e}"
@@ -861,16 +871,10 @@ def admin_clear_all_chats():
     try:
         logger.info("Запрос на очистку всей истории чатов")
         
-        # ВАЖНО: Получаем список пользователей ДО очистки базы данных
-        message_db.load_messages()
-        mini_app_users = set()
-        all_messages = message_db.messages
-        
-        for msg in all_messages:
-            if msg.get('source') == 'mini_app' and msg.get('user_id') is not None:
-                mini_app_users.add(msg['user_id'])
+        # Получатели берутся из индекса, который очистка сообщений не затрагивает
+        mini_app_users = recipient_index.get_user_ids(source='mini_app')
         
-        logger.info(f"Найдено {len(mini_app_users)} пользователей Mini App для уведомления: {list(mini_app_users)}")
+        logger.info(f"Найдено {len(mini_app_users)} пользователей Mini App для уведомления")
         
         # Теперь очищаем все сообщения
         message_db.clear_all_messages()
@@ -890,43 +894,26 @@ def admin_clear_all_chats():
         
         logger.info("Вся история чатов успешно очищена")
         
-        # Устанавливаем timestamp очистки чата
-        global chat_clear_timestamp
-        chat_clear_timestamp = int(time.time() * 1000)
+        # Новая эпоха чата: все клиенты Mini App узнают об очистке
+        mini_app_feed.clear_chat()
         
-        # Отправляем специальное сообщение всем пользователям для очистки их чата
+        # Уведомляем пользователей фоновой рассылкой: ответ не ждет отправки
+        broadcast_job_id = None
         try:
-            clear_chat_message = "🔄 История чата была очищена администратором. Ваш чат будет автоматически обновлен."
-            
-            # Отправляем сообщение каждому пользователю через Telegram Bot
-            sent_count = 0
-            for user_id in mini_app_users:
-                try:
-                    # Если user_id = 0, это локальная разработка - пропускаем отправку через Telegram
-                    if user_id == 0:
-                        logger.info(f"Пропускаем отправку через Telegram для user_id = 0 (локальная разработка)")
-                        sent_count += 1  # Считаем как успешную отправку
-                        continue
-                    
-                    # Отправляем уведомление с кнопкой вместо полного сообщения
-                    clear_notification_text = "🔄 **История чата была очищена администратором**\n\nНажмите кнопку ниже, чтобы открыть Mini App с чистым чатом."
-                    success = send_telegram_notification_with_button(user_id, clear_notification_text, "🔄 Открыть Mini App")
-                    if success:
-                        sent_count += 1
-                        logger.info(f"✅ Уведомление об очистке отправлено пользователю {user_id}")
-                    else:
-                        logger.warning(f"⚠️ Не удалось отправить уведомление об очистке пользователю {user_id}")
-                except Exception as e:
-                    logger.error(f"Ошибка отправки сообщения очистки пользователю {user_id}: {e}")
-            
-            logger.info(f"Отправлено {sent_count} сообщений об очистке чата из {len(mini_app_users)} пользователей")
-            
+            # Отправляем уведомление с кнопкой вместо полного сообщения
+            clear_notification_text = "🔄 **История чата была очищена администратором**\n\nНажмите кнопку ниже, чтобы открыть Mini App с чистым чатом."
+            broadcast_job_id = telegram_broadcaster.start_broadcast(
+                NEW_BOT_TOKEN, mini_app_users, clear_notification_text,
+                reply_markup=mini_app_button_markup("🔄 Открыть Mini App"),
+                name='clear_all_chats'
+            )
         except Exception as e:
-            logger.warning(f"Не удалось отправить сообщения об очистке чата: {e}")
+            logger.warning(f"Не удалось запустить рассылку об очистке чата: {e}")
         
         return jsonify({
             "success": True,
             "message": "Вся история чатов успешно очищена",
+            "broadcast_job_id": broadcast_job_id,
             "timestamp": int(time.time() * 1000)
         })
         
@@ -940,95 +927,57 @@ def admin_clear_all_chats():
 
 @app.route('/api/mini-app/latest-message', methods=['GET'])
 def get_latest_message():
-    """Получает последнее сообщение для отображения в mini_app"""
+    """
+    Получает последнее сообщение администратора для отображения в mini_app
+    
+    Ответ берется из памяти (mini_app_feed), без чтения и записи базы. С параметрами
+    ?after=<seq>&wait=<секунды> запрос ждет (long-poll), пока не появится сообщение
+    с номером больше after или не будет очищен чат (chat_epoch в ответе); клиент
+    передает в after значение seq из прошлого ответа.
+    """
     try:
-        # Получаем последнее сообщение от админа
-        message_db.load_messages()
-        admin_messages = [msg for msg in message_db.messages if msg.get('source') == 'admin']
+        after = request.args.get('after', type=int)
+        wait = min(request.args.get('wait', default=0.0, type=float), MINI_APP_LONG_POLL_TIMEOUT)
         
-        # Автоматически очищаем старые админские сообщения (старше 5 минут)
-        current_time = time.time()
-        old_admin_messages = [msg for msg in admin_messages if current_time - msg.get('timestamp', 0) > 300]
-        
-        if old_admin_messages:
-            logger.info(f"🧹 Автоматически очищаем {len(old_admin_messages)} старых админских сообщений")
-            message_db.messages = [msg for msg in message_db.messages if not (msg.get('source') == 'admin' and current_time - msg.get('timestamp', 0) > 300)]
-            message_db.save_messages()
-            # Перезагружаем сообщения после очистки
-            message_db.load_messages()
-            admin_messages = [msg for msg in message_db.messages if msg.get('source') == 'admin']
-        
-        logger.info(f"🔍 Поиск сообщений от админа: найдено {len(admin_messages)} сообщений")
-        logger.info(f"🔍 Все сообщения в БД: {len(message_db.messages)}")
-        
-        # Логируем все источники сообщений для отладки
-        sources = [msg.get('source', 'unknown') for msg in message_db.messages]
-        logger.info(f"🔍 Источники сообщений: {set(sources)}")
-        
-        if admin_messages:
-            # Сортируем сообщения по времени и берем самое новое
-            latest_message = max(admin_messages, key=lambda x: x.get('timestamp', 0))
-            logger.info(f"✅ Найдено последнее сообщение от админа: {latest_message.get('message', '')[:50]}...")
-            
-            # Проверяем, не было ли недавно отправлено новое сообщение
-            global last_admin_message_time
-            message_time = latest_message.get('timestamp', 0)
-            is_recent = (time.time() - message_time) < 30  # Сообщение отправлено менее 30 секунд назад
-            
-            # Дополнительная проверка: если есть несколько одинаковых сообщений, берем только одно
-            message_content = latest_message.get('message', '').strip()
-            if message_content:
-                # Проверяем, есть ли дублирующиеся сообщения с тем же содержимым
-                duplicate_messages = [
-                    msg for msg in admin_messages 
-                    if msg.get('message', '').strip() == message_content and msg.get('timestamp', 0) != message_time
-                ]
-                
-                if duplicate_messages:
-                    logger.info(f"🔍 Найдено {len(duplicate_messages)} дублирующихся сообщений с тем же содержимым")
-                    # Очищаем дублирующиеся сообщения
-                    message_db.messages = [msg for msg in message_db.messages if not (
-                        msg.get('source') == 'admin' and 
-                        msg.get('message', '').strip() == message_content and 
-                        msg.get('timestamp', 0) != message_time
-                    )]
-                    message_db.save_messages()
-                    logger.info("🧹 Дублирующиеся админские сообщения очищены")
-            
-            return jsonify({
-                "success": True,
-                "message": latest_message.get('message', ''),
-                "timestamp": latest_message.get('timestamp', 0),
-                "is_recent": is_recent,
-                "last_admin_time": last_admin_message_time
-            })
+        if after is not None and wait > 0:
+            feed = mini_app_feed.wait(after, wait)
         else:
-            logger.info("❌ Сообщения от админа не найдены")
-            return jsonify({
-                "success": True,
-                "message": "",
-                "timestamp": 0,
-                "is_recent": False,
-                "last_admin_time": last_admin_message_time
-            })
+            feed = mini_app_feed.snapshot()
+        
+        return jsonify({
+            "success": True,
+            "seq": feed['seq'],
+            "message": feed['message'],
+            "timestamp": feed['timestamp'],
+            "chat_epoch": feed['chat_epoch'],
+            # Сообщение отправлено менее 30 секунд назад
+            "is_recent": bool(feed['message']) and (time.time() - feed['timestamp']) < 30,
+            "last_admin_time": last_admin_message_time
+        })
     except Exception as e:
         logger.error(f"Ошибка получения последнего сообщения: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+def admin_message_cleanup_worker():
+    """Фоновая очистка устаревших админских сообщений (вынесена из обработчика Mini App)"""
+    while True:
+        time.sleep(MINI_APP_CLEANUP_INTERVAL)
+        try:
+            removed = message_db.delete_messages('admin', before=time.time() - MINI_APP_MESSAGE_TTL)
+            if removed:
+                logger.info(f"🧹 Автоматически очищено {removed} старых админских сообщений")
+        except Exception as e:
+            logger.error(f"❌ Ошибка фоновой очистки админских сообщений: {e}")
+
 def clear_old_admin_messages():
     """Очищает старые админские сообщения из БД"""
     try:
         message_db.load_messages()
-        admin_messages = [msg for msg in message_db.messages if msg.get('source') == 'admin']
         
-        if len(admin_messages) > 0:
-            logger.info(f"🧹 Очищаем {len(admin_messages)} старых админских сообщений")
-            
-            # Удаляем все админские сообщения
-            message_db.messages = [msg for msg in message_db.messages if msg.get('source') != 'admin']
-            message_db.save_messages()
-            
-            logger.info("✅ Старые админские сообщения очищены")
+        # Удаляем все админские сообщения
+        removed = message_db.delete_messages('admin')
+        if removed:
+            logger.info(f"✅ Очищено {removed} старых админских сообщений")
     except Exception as e:
         logger.error(f"❌ Ошибка очистки старых админских сообщений: {e}")
 
@@ -1090,49 +1039,22 @@ P.S. Ответы анонимны."""
         logger.info(f"Отправка концертного сообщения ({message_type}) всем пользователям...")
         logger.info(f"Сообщение: {message[:200].replace(chr(10), ' ')}")
         
-        sent_count = 0
-        failed_count = 0
+        mini_app_users = []
+        broadcast_job_id = None
         
-        # Получаем список всех пользователей из базы данных
+        # Получаем пользователей Mini App из индекса получателей
         try:
-            message_db.load_messages()
-            # Получаем уникальных пользователей из Mini App
-            mini_app_users = set()
-            all_messages = message_db.messages
-            logger.info(f"Всего сообщений в БД: {len(all_messages)}")
-            
-            for msg in all_messages:
-                logger.info(f"Сообщение: source={msg.get('source')}, user_id={msg.get('user_id')}")
-                if msg.get('source') == 'mini_app' and msg.get('user_id') is not None:
-                    # Включаем пользователей с user_id = 0 для локальной разработки
-                    mini_app_users.add(msg['user_id'])
+            mini_app_users = recipient_index.get_user_ids(source='mini_app')
             
             logger.info(f"Найдено {len(mini_app_users)} пользователей Mini App для отправки сообщения")
-            logger.info(f"ID пользователей: {list(mini_app_users)}")
-            
-            # Отправляем сообщение каждому пользователю через Telegram Bot
-            for user_id in mini_app_users:
-                try:
-                    logger.info(f"Отправка сообщения пользователю {user_id}")
-                    
-                    # Если user_id = 0, это локальная разработка - пропускаем отправку
-                    if user_id == 0:
-                        logger.info(f"Пропускаем отправку для user_id = 0 (локальная разработка)")
-                        sent_count += 1  # Считаем как успешную отправку
-                        continue
-                    
-                    # Отправляем уведомление с кнопкой вместо полного сообщения
-                    notification_text = "🎬 **У вас новое сообщение в Mini App!**\n\nНажмите кнопку ниже, чтобы открыть чат и увидеть новое сообщение от администратора."
-                    success = send_telegram_notification_with_button(user_id, notification_text)
-                    if success:
-                        sent_count += 1
-                    else:
-                        failed_count += 1
-                except Exception as e:
-                    logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
-                    failed_count += 1
             
-            logger.info(f"Отправлено сообщений: {sent_count}, ошибок: {failed_count}")
+            # Рассылаем уведомление с кнопкой в фоне; прогресс - по broadcast_job_id
+            notification_text = "🎬 **У вас новое сообщение в Mini App!**\n\nНажмите кнопку ниже, чтобы открыть чат и увидеть новое сообщение от администратора."
+            broadcast_job_id = telegram_broadcaster.start_broadcast(
+                NEW_BOT_TOKEN, mini_app_users, notification_text,
+                reply_markup=mini_app_button_markup(),
+                name=f'concert_{message_type}'
+            )
             
         except Exception as e:
             logger.error(f"Ошибка при отправке концертного сообщения: {e}")
@@ -1145,10 +1067,8 @@ P.S. Ответы анонимны."""
             message_db.load_messages()
             current_time = time.time()
             recent_admin_messages = [
-                msg for msg in message_db.messages 
-                if (msg.get('source') == 'admin' and 
-                    current_time - msg.get('timestamp', 0) < 30 and
-                    msg.get('message', '').strip() == message.strip())
+                msg for msg in message_db.get_messages_by_source(['admin'], limit=None, since=current_time - 30)
+                if msg.get('message', '').strip() == message.strip()
             ]
             
             if recent_admin_messages:
@@ -1165,6 +1085,9 @@ P.S. Ответы анонимны."""
                 )
                 logger.info("✅ Админское сообщение успешно сохранено в БД")
                 
+                # Будим клиентов Mini App, ожидающих новое сообщение
+                mini_app_feed.publish_admin_message(message)
+                
                 # Устанавливаем флаг для немедленной доставки
                 global last_admin_message_time
                 last_admin_message_time = time.time()
@@ -1175,9 +1098,8 @@ P.S. Ответы анонимны."""
         
         return jsonify({
             "success": True, 
-            "message": f"Сообщение типа '{message_type}' отправлено {sent_count} пользователям",
-            "sent_count": sent_count,
-            "failed_count": failed_count,
+            "message": f"Сообщение типа '{message_type}' отправляется {len(mini_app_users)} пользователям",
+            "broadcast_job_id": broadcast_job_id,
             "total_users": len(mini_app_users)
         })
         
@@ -1185,32 +1107,26 @@ P.S. Ответы анонимны."""
         logger.exception("Ошибка отправки концертного сообщения")
         return jsonify({"success": False, "message": f"Server error: {str(e)}"        }), 500
 
-# Глобальная переменная для отслеживания статуса очистки чата
-chat_clear_timestamp = None
+@app.route('/api/admin/broadcasts/<job_id>', methods=['GET'])
+@require_admin_auth
+def admin_broadcast_status(job_id):
+    """Прогресс фоновой рассылки Telegram"""
+    job = telegram_broadcaster.get_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Рассылка не найдена"}), 404
+    return jsonify({"success": True, "job": job})
 
 # Глобальная переменная для отслеживания времени последнего админского сообщения
 last_admin_message_time = 0
 
 @app.route('/api/check-chat-clear-status', methods=['GET'])
 def check_chat_clear_status():
-    """Проверяет, была ли очищена история чата"""
-    global chat_clear_timestamp
-    
-    # Если есть timestamp очистки, возвращаем его и сбрасываем
-    if chat_clear_timestamp is not None:
-        timestamp = chat_clear_timestamp
-        chat_clear_timestamp = None  # Сбрасываем после получения
-        return jsonify({
-            "success": True,
-            "chat_cleared": True,
-            "clear_timestamp": timestamp
-        })
-    
-    return jsonify({
-        "success": True,
-        "chat_cleared": False,
-        "clear_timestamp": None
-    })
+    """
+    Проверяет, была ли очищена история чата
+
+    Ответ по ?epoch и ?wait (long-poll) - см. app_common.chat_clear_status
+    """
+    return jsonify(chat_clear_status(request.args))
 
 @app.route('/api/admin/update-base-prompt', methods=['POST'])
 def admin_update_base_prompt():
@@ -1275,39 +1191,32 @@ def generate_film_description():
         
         # Генерируем описание через OpenAI
         from openai_client import get_openai_response
-        import asyncio
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        description = run_async(get_openai_response(description_prompt))
+        if not description:
+            description = technical_prompt  # Fallback
         
-        try:
-            description = loop.run_until_complete(get_openai_response(description_prompt))
-            if not description:
-                description = technical_prompt  # Fallback
-            
-            # Проверяем, что описание завершено
-            description = description.strip()
-            
-            # Если описание слишком длинное, пытаемся найти последнее завершенное предложение
-            if len(description) > 200:
-                last_sentence_end = max(
-                    description.rfind('.'),
-                    description.rfind('!'),
-                    description.rfind('?')
-                )
-                
-                if last_sentence_end > 30:  # Если есть завершенное предложение
-                    description = description[:last_sentence_end + 1]
-                else:
-                    # Если нет завершенных предложений, обрезаем аккуратно
-                    description = description[:197] + '...'
+        # Проверяем, что описание завершено
+        description = description.strip()
+        
+        # Если описание слишком длинное, пытаемся найти последнее завершенное предложение
+        if len(description) > 200:
+            last_sentence_end = max(
+                description.rfind('.'),
+                description.rfind('!'),
+                description.rfind('?')
+            )
             
-            return jsonify({
-                "success": True,
-                "description": description
-            })
-        finally:
-            loop.close()
+            if last_sentence_end > 30:  # Если есть завершенное предложение
+                description = description[:last_sentence_end + 1]
+            else:
+                # Если нет завершенных предложений, обрезаем аккуратно
+                description = description[:197] + '...'
+        
+        return jsonify({
+            "success": True,
+            "description": description
+        })
         
     except Exception as e:
         logger.error(f"Ошибка генерации описания фильма: {e}")
@@ -1405,6 +1314,8 @@ def generate_custom_image():
     try:
         data = request.get_json()
         custom_prompt = data.get('custom_prompt', '').strip()
+        # use_cache=false - новый вариант изображения вместо кэшированного для того же промпта
+        use_cache = data.get('use_cache', True) is not False
         
         if not custom_prompt:
             return jsonify({"success": False, "message": "Промт не предоставлен"}), 400
@@ -1421,22 +1332,13 @@ def generate_custom_image():
         # Генерируем изображение через Gemini API
         from gemini_client import generate_image_with_retry
         
-        # Создаем event loop для async функции
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            image_b64 = loop.run_until_complete(generate_image_with_retry(full_prompt))
-        finally:
-            loop.close()
+        # Выполняем async функцию в общем фоновом event loop
+        image_b64 = run_async(generate_image_with_retry(full_prompt, use_cache=use_cache))
         
         # Сохраняем изображение
         import base64
         import uuid
         import time
-        from PIL import Image
-        from io import BytesIO
         
         # Декодируем base64
         image_data = base64.b64decode(image_b64)
@@ -1449,14 +1351,8 @@ def generate_custom_image():
         filename = f"custom_image_{timestamp}_{uuid.uuid4().hex[:8]}.png"
         filepath = os.path.join(GENERATED_IMAGES_FOLDER, filename)
         
-        # Обрабатываем и сохраняем изображение
-        with Image.open(BytesIO(image_data)) as img:
-            # Изменяем размер на 1920x1280 если нужно
-            if img.size != (1920, 1280):
-                img = img.resize((1920, 1280), Image.Resampling.LANCZOS)
-            
-            # Сохраняем изображение
-            img.save(filepath, 'PNG', quality=95)
+        # Растягиваем до 1920x1280 без обрезки (как раньше) в пуле процессов
+        run_async(image_processor.fit_and_save(image_data, filepath, mode='stretch'))
         
         # Создаем URL для доступа к изображению
         image_url = f"/generated_images/{filename}"
@@ -1486,5 +1382,9 @@ if __name__ == '__main__':
     auto_thread.start()
     logger.info("🚀 Фоновый поток автоматической генерации запущен")
     
+    # Очистка устаревших админских сообщений вне обработчиков запросов
+    cleanup_thread = threading.Thread(target=admin_message_cleanup_worker, daemon=True)
+    cleanup_thread.start()
+    
     port = int(os.getenv('PORT', 8000))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -18,7 +18,9 @@ logger = logging.getLogger(__name__)
 
 # Import existing handlers
 from simple_message_db import message_db
-from openai_client import get_openai_response
+from recipient_index import recipient_index
+from openai_client import get_openai_response, request_openai_response
+from llm_cache import llm_cache, prompt_version
 from gemini_client import generate_image_with_retry, GeminiQuotaError
 from content_filter import check_content_safety, sanitize_image_prompt
 
@@ -29,7 +31,14 @@ from batch_image_generator import batch_generator
 # NEW: Import smart batch management system
 from smart_batch_manager import smart_batch_manager, BatchStatus
 from sequential_batch_processor import sequential_processor
-from PIL import Image, ImageOps
+from state_service import is_shared
+from PIL import Image
+from image_processing import image_processor, IMAGE_SIZE
+from async_bridge import run_async
+from telegram_broadcaster import telegram_broadcaster
+from mini_app_feed import mini_app_feed
+from app_common import start_async_clients, make_dashboard_events, event_stream_response, chat_clear_status
+
 from io import BytesIO
 import threading
 import time
@@ -41,9 +50,11 @@ from config import BOT_TOKEN, GENERATED_IMAGES_FOLDER, NEW_BOT_TOKEN
 # Импортируем менеджер промтов
 from prompt_manager import get_current_base_prompt, update_base_prompt, get_prompt_info
 
-def _process_and_compress_image(image_path: str) -> str:
+start_async_clients()
+
+async def _process_and_compress_image(image_path: str) -> str:
     """
-    Обрабатывает и сжимает изображение (как в умной системе батчей)
+    Обрабатывает и сжимает изображение в пуле процессов (как в умной системе батчей)
     
     Args:
         image_path: Путь к исходному изображению
@@ -52,33 +63,22 @@ def _process_and_compress_image(image_path: str) -> str:
         str: Путь к обработанному изображению
     """
     try:
-        # Параметры обработки (как в умной системе батчей)
-        IMAGE_SIZE = (1920, 1280)
+        # Создаем новое имя файла с суффиксом _processed
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        processed_filename = f"{base_name}_processed.png"
+        processed_path = os.path.join(GENERATED_IMAGES_FOLDER, processed_filename)
         
-        with Image.open(image_path) as img:
-            # Конвертируем в RGB если необходимо
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Изменяем размер с сохранением пропорций и обрезкой
-            img = ImageOps.fit(img, IMAGE_SIZE, Image.Resampling.LANCZOS)
-            
-            # Создаем новое имя файла с суффиксом _processed
-            base_name = os.path.splitext(os.path.basename(image_path))[0]
-            processed_filename = f"{base_name}_processed.png"
-            processed_path = os.path.join(GENERATED_IMAGES_FOLDER, processed_filename)
-            
-            # Сохраняем как PNG с оптимизацией
-            img.save(processed_path, 'PNG', optimize=True)
-            
-            logger.info(f"🖼️ Изображение обработано: {IMAGE_SIZE[0]}x{IMAGE_SIZE[1]} -> {processed_filename}")
-            
-            # Удаляем оригинальное изображение
-            if os.path.exists(image_path) and image_path != processed_path:
-                os.remove(image_path)
-                logger.info(f"🗑️ Оригинальное изображение удалено: {os.path.basename(image_path)}")
-            
-            return processed_path
+        # Обрезка под 1920x1280 и сохранение PNG с оптимизацией (как в умной системе батчей)
+        width, height = await image_processor.fit_and_save(image_path, processed_path, IMAGE_SIZE)
+        
+        logger.info(f"🖼️ Изображение обработано: {width}x{height} -> {processed_filename}")
+        
+        # Удаляем оригинальное изображение
+        if os.path.exists(image_path) and image_path != processed_path:
+            os.remove(image_path)
+            logger.info(f"🗑️ Оригинальное изображение удалено: {os.path.basename(image_path)}")
+        
+        return processed_path
             
     except Exception as e:
         logger.error(f"❌ Ошибка обработки изображения: {e}")
@@ -102,8 +102,9 @@ def auto_generation_worker():
     
     while True:
         try:
-            # Перезагружаем данные из файла (синхронизация с ботом)
-            smart_batch_manager.reload()
+            # Без сервиса общего состояния синхронизируемся с ботом через файл
+            if not is_shared(smart_batch_manager):
+                smart_batch_manager.reload()
             
             # Сначала создаем батчи из накопленных сообщений
             created_batches = smart_batch_manager.create_batches()
@@ -119,11 +120,13 @@ def auto_generation_worker():
             
             logger.info(f"🔄 Обрабатываем батч {next_batch.id} с {next_batch.message_count} сообщениями")
             
-            # Обрабатываем батч через sequential_processor (асинхронно)
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(sequential_processor.process_next_batch())
-            loop.close()
+            # Обрабатываем батч через sequential_processor в общем фоновом event loop;
+            # в параллельном режиме забираем сразу все ожидающие батчи
+            if sequential_processor.workers > 1:
+                stats = run_async(sequential_processor.process_all_batches())
+                result = stats['processed'] > 0
+            else:
+                result = run_async(sequential_processor.process_next_batch())
             
             if result:
                 logger.info(f"✅ Батч успешно обработан")
@@ -149,7 +152,6 @@ CORS(app)
 
 # Глобальные переменные для уведомлений
 last_admin_message_time = 0
-chat_clear_timestamp = None
 
 # Старая функция удалена - используется новая send_telegram_message ниже
 
@@ -288,10 +290,9 @@ def admin_stats():
 def admin_messages():
     try:
         message_db.load_messages()
-        all_messages = message_db.messages
         
-        # Фильтруем только сообщения пользователей (исключаем admin и bot)
-        user_messages = [msg for msg in all_messages if msg.get('source') in ['telegram', 'mini_app']]
+        # Только сообщения пользователей (исключаем admin и bot)
+        user_messages = message_db.get_messages_by_source(['telegram', 'mini_app'], limit=None)
         
         return jsonify({
             'success': True,
@@ -307,7 +308,7 @@ def admin_messages():
 @app.route('/api/admin/export', methods=['GET'])
 def admin_export():
     message_db.load_messages()
-    all_messages = message_db.messages
+    all_messages = message_db.get_all_messages()
     return jsonify(all_messages)
 
 @app.route('/api/admin/reset', methods=['POST'])
@@ -315,29 +316,37 @@ def admin_reset():
     message_db.reset_stats()
     return jsonify({'success': True, 'message': 'Stats reset successfully'})
 
+# Шаблон промпта микса для /api/admin/mixed-text (его текст входит в версию ключа кэша LLM)
+ADMIN_MIX_PROMPT = """
+Создай краткий миксированный текст на основе этих сообщений пользователей:
+
+{messages}
+
+Требования:
+- Объедини ключевые идеи в один связный текст
+- Сохрани эмоциональную окраску
+- Сделай текст интересным и креативным
+- Максимум 200 символов
+- На русском языке
+        """
+
 @app.route('/api/admin/mixed-text', methods=['POST'])
 def admin_mixed_text():
     # Accept empty request body
     data = request.get_json(force=True) or {}
     
     try:
-        # Получаем все сообщения
+        # Берем последние 10 сообщений пользователей (исключаем админские и бот)
         message_db.load_messages()
-        all_messages = message_db.messages
-        
-        # Фильтруем только сообщения пользователей (исключаем админские и бот)
-        user_messages = [msg for msg in all_messages if msg.get('source') in ['telegram', 'mini_app']]
+        recent_messages = message_db.get_messages_by_source(['telegram', 'mini_app'], limit=10)
         
-        if not user_messages:
+        if not recent_messages:
             return jsonify({
                 'success': False,
                 'error': 'No user messages found',
                 'mixed_text': 'Нет сообщений пользователей для обработки'
             })
         
-        # Берем последние 10 сообщений
-        recent_messages = user_messages[-10:]
-        
         # Создаем текст для миксирования
         messages_text = []
         for msg in recent_messages:
@@ -348,25 +357,14 @@ def admin_mixed_text():
         combined_text = "\n".join(messages_text)
         
         # Создаем промпт для миксирования
-        mix_prompt = f"""
-Создай краткий миксированный текст на основе этих сообщений пользователей:
-
-{combined_text}
-
-Требования:
-- Объедини ключевые идеи в один связный текст
-- Сохрани эмоциональную окраску
-- Сделай текст интересным и креативным
-- Максимум 200 символов
-- На русском языке
-        """
+        mix_prompt = ADMIN_MIX_PROMPT.format(messages=combined_text)
         
-        # Получаем миксированный текст от OpenAI
+        # Получаем миксированный текст от OpenAI (повторный набор сообщений - из кэша)
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            mixed_text = loop.run_until_complete(get_openai_response(mix_prompt))
-            loop.close()
+            mixed_text = run_async(llm_cache.get_or_create(
+                'admin_mix_named', messages_text, prompt_version(ADMIN_MIX_PROMPT),
+                lambda: request_openai_response(mix_prompt)
+            ))
         except Exception as e:
             logger.error(f"Ошибка получения миксированного текста: {e}")
             mixed_text = "Ошибка генерации миксированного текста"
@@ -515,6 +513,19 @@ def smart_batches_current_mixed_text():
             'error': str(e)
         })
 
+def _batch_image_info(batch: dict) -> dict:
+    """Карточка изображения завершенного батча для админ-панели"""
+    image_path = batch['image_path']
+    return {
+        'batch_id': batch.get('id', ''),
+        'mixed_text': batch.get('mixed_text') or 'Текст не сгенерирован',
+        'image_url': f"/generated_images/{os.path.basename(image_path)}",
+        'image_path': image_path,
+        'completed_at': batch.get('completed_at', 0) * 1000 if batch.get('completed_at') else 0,
+        'processing_time': batch.get('processing_time', 0),
+        'message_count': batch.get('message_count', 0)
+    }
+
 @app.route('/api/admin/smart-batches/images', methods=['GET'])
 def smart_batches_images():
     """Получить список сгенерированных изображений"""
@@ -522,22 +533,10 @@ def smart_batches_images():
         # Получаем все завершенные батчи с изображениями
         # get_all_batches_info() возвращает список словарей, а не объектов
         completed_batches = [batch for batch in smart_batch_manager.get_all_batches_info() if batch.get('status') == 'completed']
-        images_data = []
-        
-        for batch in completed_batches:
-            image_path = batch.get('image_path')
-            if image_path and os.path.exists(image_path):
-                filename = os.path.basename(image_path)
-                image_url = f"/generated_images/{filename}"
-                images_data.append({
-                    'batch_id': batch.get('id', ''),
-                    'mixed_text': batch.get('mixed_text') or 'Текст не сгенерирован',
-                    'image_url': image_url,
-                    'image_path': image_path,
-                    'completed_at': batch.get('completed_at', 0) * 1000 if batch.get('completed_at') else 0,
-                    'processing_time': batch.get('processing_time', 0),
-                    'message_count': batch.get('message_count', 0)
-                })
+        images_data = [
+            _batch_image_info(batch) for batch in completed_batches
+            if batch.get('image_path') and os.path.exists(batch['image_path'])
+        ]
         
         # Сортируем по времени завершения (новые сначала)
         images_data.sort(key=lambda x: x.get('completed_at', 0), reverse=True)
@@ -574,6 +573,18 @@ def smart_batches_images():
             'error': str(e)
         })
 
+# Источники сообщений и лимит ленты админ-панели (как в /api/admin/messages)
+ADMIN_MESSAGE_SOURCES = ('telegram', 'mini_app')
+ADMIN_MESSAGE_LIMIT = None
+
+_admin_dashboard_events = make_dashboard_events(ADMIN_MESSAGE_SOURCES, ADMIN_MESSAGE_LIMIT, _batch_image_info)
+
+@app.route('/api/admin/events', methods=['GET'])
+@require_admin_auth
+def admin_events():
+    """Поток событий админ-панели (Server-Sent Events) вместо периодического опроса"""
+    return event_stream_response(_admin_dashboard_events)
+
 # Admin message management
 @app.route('/api/admin/clear-messages', methods=['POST'])
 def admin_clear_messages():
@@ -595,6 +606,9 @@ def admin_clear_messages():
 def admin_clear_all_chats():
     """Очищает всю историю чатов пользователей (сообщения, батчи, изображения)"""
     try:
+        # Получатели берутся из индекса, который очистка сообщений не затрагивает
+        telegram_users = recipient_index.get_user_ids(source='telegram')
+        
         # Очищаем базу сообщений
         message_db.reset_stats()
         
@@ -607,34 +621,18 @@ def admin_clear_all_chats():
             shutil.rmtree(GENERATED_IMAGES_FOLDER)
             os.makedirs(GENERATED_IMAGES_FOLDER, exist_ok=True)
         
-        # Устанавливаем глобальный флаг очистки чатов
-        global chat_clear_timestamp
-        chat_clear_timestamp = time.time()
+        # Новая эпоха чата: все клиенты Mini App узнают об очистке
+        mini_app_feed.clear_chat()
         
-        # Отправляем уведомления всем пользователям Telegram
+        # Уведомляем пользователей Telegram фоновой рассылкой
+        broadcast_job_id = None
         try:
-            message_db.load_messages()
-            all_messages = message_db.messages
-            
-            # Получаем уникальных пользователей из Telegram
-            telegram_users = set()
-            for msg in all_messages:
-                if msg.get('source') == 'telegram' and msg.get('user_id') is not None:
-                    telegram_users.add(msg['user_id'])
-            
             logger.info(f"Найдено {len(telegram_users)} пользователей Telegram для уведомления")
             
-            sent_count = 0
-            for user_id in telegram_users:
-                try:
-                    clear_notification_text = "🔄 **История чата была очищена администратором**\n\nНачните новый диалог с ботом!"
-                    success = send_telegram_message(user_id, clear_notification_text)
-                    if success:
-                        sent_count += 1
-                except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
-            
-            logger.info(f"Отправлено {sent_count} сообщений об очистке чата из {len(telegram_users)} пользователей")
+            clear_notification_text = "🔄 **История чата была очищена администратором**\n\nНачните новый диалог с ботом!"
+            broadcast_job_id = telegram_broadcaster.start_broadcast(
+                BOT_TOKEN, telegram_users, clear_notification_text, name='clear_all_chats'
+            )
             
         except Exception as e:
             logger.error(f"Ошибка отправки уведомлений об очистке: {e}")
@@ -642,7 +640,8 @@ def admin_clear_all_chats():
         return jsonify({
             'success': True,
             'message': 'Вся история чатов очищена',
-            'notifications_sent': sent_count if 'sent_count' in locals() else 0
+            'broadcast_job_id': broadcast_job_id,
+            'total_users': len(telegram_users)
         })
         
     except Exception as e:
@@ -652,26 +651,23 @@ def admin_clear_all_chats():
             'error': str(e)
         })
 
+@app.route('/api/admin/broadcasts/<job_id>', methods=['GET'])
+@require_admin_auth
+def admin_broadcast_status(job_id):
+    """Прогресс фоновой рассылки Telegram"""
+    job = telegram_broadcaster.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Рассылка не найдена'}), 404
+    return jsonify({'success': True, 'job': job})
+
 @app.route('/api/check-chat-clear-status', methods=['GET'])
 def check_chat_clear_status():
-    """Проверяет, была ли очищена история чата"""
-    global chat_clear_timestamp
-    
-    # Если есть timestamp очистки, возвращаем его и сбрасываем
-    if chat_clear_timestamp is not None:
-        timestamp = chat_clear_timestamp
-        chat_clear_timestamp = None  # Сбрасываем после получения
-        return jsonify({
-            "success": True,
-            "chat_cleared": True,
-            "clear_timestamp": timestamp
-        })
-    
-    return jsonify({
-        "success": True,
-        "chat_cleared": False,
-        "clear_timestamp": None
-    })
+    """
+    Проверяет, была ли очищена история чата
+
+    Ответ по ?epoch и ?wait (long-poll) - см. app_common.chat_clear_status
+    """
+    return jsonify(chat_clear_status(request.args))
 
 # Admin concert message system
 @app.route('/api/admin/send-concert-message', methods=['POST'])
@@ -714,55 +710,19 @@ def admin_send_concert_message():
         
         # Отправляем сообщение всем пользователям Telegram
         try:
-            # Загружаем реестр пользователей
-            telegram_users = set()
-            
-            # Сначала пытаемся загрузить из user_registry.json
-            registry_file = 'user_registry.json'
-            if os.path.exists(registry_file):
-                try:
-                    with open(registry_file, 'r', encoding='utf-8') as f:
-                        registry = json.load(f)
-                        for user_data in registry.get('users', []):
-                            telegram_users.add(user_data['user_id'])
-                    logger.info(f"📊 Загружено {len(telegram_users)} пользователей из реестра")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка чтения реестра пользователей: {e}")
-            
-            # Если нет пользователей в реестре, пытаемся найти в базе сообщений
-            if not telegram_users:
-                logger.warning("⚠️ Реестр пользователей пуст, ищем в базе сообщений...")
-                message_db.load_messages()
-                all_messages = message_db.messages
-                
-                # Ищем всех пользователей (не только с source='telegram')
-                for msg in all_messages:
-                    if msg.get('user_id') is not None and msg.get('user_id') != 0:
-                        telegram_users.add(msg['user_id'])
-                
-                logger.info(f"📊 Найдено {len(telegram_users)} пользователей в базе сообщений")
-            
-            logger.info(f"👥 ID пользователей для отправки: {list(telegram_users)}")
+            # Пользователи Telegram из индекса получателей (как прежний user_registry.json)
+            telegram_users = recipient_index.get_user_ids(source='telegram')
+            logger.info(f"📊 Найдено {len(telegram_users)} получателей в индексе")
             
-            sent_count = 0
-            for user_id in telegram_users:
-                try:
-                    # Отправляем простое сообщение без кнопки
-                    success = send_telegram_message(user_id, message)
-                    if success:
-                        sent_count += 1
-                        logger.info(f"✅ Сообщение отправлено пользователю {user_id}")
-                    else:
-                        logger.warning(f"⚠️ Не удалось отправить сообщение пользователю {user_id}")
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
-            
-            logger.info(f"Отправлено {sent_count} сообщений из {len(telegram_users)} пользователей")
+            # Отправляем простое сообщение без кнопки фоновой рассылкой
+            broadcast_job_id = telegram_broadcaster.start_broadcast(
+                BOT_TOKEN, telegram_users, message, name='concert_message'
+            )
             
             return jsonify({
                 'success': True,
-                'message': f'Сообщение отправлено {sent_count} пользователям',
+                'message': f'Сообщение отправляется {len(telegram_users)} пользователям',
+                'broadcast_job_id': broadcast_job_id,
                 'total_users': len(telegram_users)
             })
             
@@ -846,10 +806,7 @@ def generate_film_info():
         
         # Получаем описание от OpenAI
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            film_description = loop.run_until_complete(get_openai_response(film_info_prompt))
-            loop.close()
+            film_description = run_async(get_openai_response(film_info_prompt))
             
             # Обрезаем до 250 символов
             if len(film_description) > 250:
@@ -916,10 +873,7 @@ def generate_film_description():
         
         # Получаем описание от OpenAI
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            film_description = loop.run_until_complete(get_openai_response(film_prompt))
-            loop.close()
+            film_description = run_async(get_openai_response(film_prompt))
             
             # Обрезаем до 250 символов на сервере
             if len(film_description) > 250:
@@ -996,7 +950,7 @@ def test_user_id():
     try:
         # Получаем последние сообщения
         message_db.load_messages()
-        all_messages = message_db.messages
+        all_messages = message_db.get_all_messages()
         
         # Ищем пользователей
         users = []
@@ -1053,6 +1007,8 @@ def generate_custom_image():
         custom_prompt = data.get('custom_prompt', '').strip()
         if not custom_prompt:
             return jsonify({'success': False, 'error': 'Custom prompt is required'}), 400
+        # use_cache=false - новый вариант изображения вместо кэшированного для того же промпта
+        use_cache = data.get('use_cache', True) is not False
         
         # Получаем базовый промт
         base_prompt = get_current_base_prompt()
@@ -1068,10 +1024,7 @@ def generate_custom_image():
             os.makedirs(GENERATED_IMAGES_FOLDER, exist_ok=True)
             
             # Генерируем изображение (асинхронная функция)
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            image_base64 = loop.run_until_complete(generate_image_with_retry(full_prompt))
-            loop.close()
+            image_base64 = run_async(generate_image_with_retry(full_prompt, use_cache=use_cache))
             
             logger.info(f"🖼️ Получена base64-строка изображения: {len(image_base64) if image_base64 else 0} символов")
             
@@ -1098,7 +1051,7 @@ def generate_custom_image():
             
             if image_path and os.path.exists(image_path):
                 # Обрабатываем изображение с помощью PIL (как в умной системе батчей)
-                processed_image_path = _process_and_compress_image(image_path)
+                processed_image_path = run_async(_process_and_compress_image(image_path))
                 
                 filename = os.path.basename(processed_image_path)
                 image_url = f"/generated_images/{filename}"
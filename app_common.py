@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Общие части Flask-приложений app.py и app_admin_only.py
+
+Запуск HTTP-клиентов в фоновом event loop (async_bridge), поток событий
+админ-панели (Server-Sent Events) и ответ о статусе очистки чата для
+Mini App одинаковы в обоих приложениях. Маршруты остаются в приложениях
+(у каждого своя проверка авторизации и свои источники сообщений), а здесь -
+их реализация.
+"""
+
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from flask import Response, request
+
+from async_bridge import async_bridge
+from config import MINI_APP_LONG_POLL_TIMEOUT
+from event_bus import iter_sse
+from gemini_client import gemini_client
+from http_pool import http_pool
+from mini_app_feed import mini_app_feed
+from sequential_batch_processor import sequential_processor
+from smart_batch_manager import smart_batch_manager
+
+
+def start_async_clients():
+    """HTTP-клиенты живут в общем фоновом loop: создаем заранее, закрываем при выходе"""
+    async_bridge.submit(gemini_client.startup())
+    async_bridge.on_shutdown(http_pool.aclose)
+
+
+def make_dashboard_events(message_sources: Tuple[str, ...], message_limit: Optional[int],
+                          image_info: Callable[[Dict[str, Any]], Dict[str, Any]]
+                          ) -> Callable[[List[Dict[str, Any]]], Iterator[Tuple[str, Any]]]:
+    """
+    Создает преобразование событий шины в события админ-панели (admin_mini_app.js)
+
+    Args:
+        message_sources: Источники сообщений ленты панели (как в /api/admin/messages)
+        message_limit: Лимит ленты сообщений панели (None - без ограничения)
+        image_info: Карточка изображения завершенного батча
+
+    Returns:
+        Callable: Функция для iter_sse
+    """
+    def dashboard_events(events: List[Dict[str, Any]]) -> Iterator[Tuple[str, Any]]:
+        batches_changed = False
+        reset = False
+        for event in events:
+            data = event['data']
+            if event['type'] == 'message':
+                if data.get('source') in message_sources:
+                    yield 'audience_message', {'message': data, 'limit': message_limit}
+            elif event['type'] == 'batches':
+                batches_changed = True
+                if data['batches']:
+                    yield 'batches', {'batches': data['batches']}
+                for batch in data['batches']:
+                    if batch['status'] == 'completed' and batch.get('image_path') and os.path.exists(batch['image_path']):
+                        yield 'image', image_info(batch)
+            elif event['type'] in ('messages_cleared', 'batches_cleared'):
+                reset = True
+
+        if reset:
+            # Панель перезагружает все данные одним набором запросов
+            yield 'reset', {}
+        elif batches_changed:
+            yield 'stats', {
+                'batch_stats': smart_batch_manager.get_statistics(),
+                'processor_stats': sequential_processor.get_stats()
+            }
+
+    return dashboard_events
+
+
+def event_stream_response(transform: Callable[[List[Dict[str, Any]]], Iterable[Tuple[str, Any]]]) -> Response:
+    """
+    Ответ text/event-stream для текущего запроса (продолжение с Last-Event-ID или ?since)
+
+    Args:
+        transform: Преобразование событий шины (см. make_dashboard_events)
+
+    Returns:
+        Response: Потоковый ответ Flask
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since', '')
+    after_seq = int(last_event_id) if last_event_id.isdigit() else None
+
+    response = Response(iter_sse(after_seq, transform), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Без буферизации в nginx
+    return response
+
+
+def chat_clear_status(args: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Статус очистки истории чата для /api/check-chat-clear-status
+
+    Клиент передает ?epoch=<chat_epoch из прошлого ответа>; chat_cleared = true, если
+    с тех пор была очистка. Ответ из памяти за O(1) и одинаков для всех клиентов.
+    С ?wait=<секунды> запрос ждет очистку (long-poll). Клиенты без epoch (текущий
+    Mini App) получают прежний одноразовый сигнал: chat_cleared = true в первом
+    ответе после очистки, а также текущую эпоху как точку отсчета.
+
+    Args:
+        args: Параметры запроса (request.args)
+
+    Returns:
+        dict: Тело ответа
+    """
+    epoch = args.get('epoch', type=int)
+    wait = min(args.get('wait', default=0.0, type=float), MINI_APP_LONG_POLL_TIMEOUT)
+
+    if epoch is not None and wait > 0:
+        feed = mini_app_feed.wait_for_chat_clear(epoch, wait)
+    else:
+        feed = mini_app_feed.snapshot()
+
+    chat_epoch = feed['chat_epoch']
+    if epoch is not None:
+        clear_timestamp = chat_epoch if chat_epoch > epoch else None
+    else:
+        clear_timestamp = mini_app_feed.claim_chat_clear()
+    return {
+        "success": True,
+        "chat_cleared": clear_timestamp is not None,
+        "chat_epoch": chat_epoch,
+        "clear_timestamp": clear_timestamp
+    }
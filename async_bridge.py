@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Мост между синхронным кодом Flask и единым фоновым event loop
+
+Вместо asyncio.new_event_loop() на каждый запрос все маршруты и фоновые
+потоки отправляют корутины в один долгоживущий loop, работающий в
+отдельном потоке (asyncio.run_coroutine_threadsafe). Это убирает затраты
+на создание loop и позволяет асинхронным клиентам переиспользовать
+соединения между запросами.
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBridge:
+    """Фоновый поток с event loop, запускается при первом обращении"""
+
+    def __init__(self, name: str = "async-bridge"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Корутины освобождения ресурсов loop (например, закрытие HTTP-клиентов)
+        self._shutdown_hooks: List[Callable[[], Awaitable]] = []
+        atexit.register(self.stop)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Event loop моста (запускает поток при необходимости)"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run_loop, args=(self._loop,),
+                                                name=self.name, daemon=True)
+                self._thread.start()
+                logger.info(f"🔁 Фоновый event loop запущен ({self.name})")
+            return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def submit(self, coro: Awaitable) -> Future:
+        """
+        Запускает корутину в фоновом loop без ожидания результата
+
+        Args:
+            coro: Корутина
+
+        Returns:
+            Future: concurrent.futures.Future с результатом корутины
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """
+        Выполняет корутину в фоновом loop и ждет результат в текущем потоке
+
+        Args:
+            coro: Корутина
+            timeout: Максимальное время ожидания в секундах (None - без ограничения)
+
+        Returns:
+            Результат корутины (исключения пробрасываются вызывающему)
+        """
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("run() нельзя вызывать из потока фонового loop - используйте await")
+
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def on_shutdown(self, hook: Callable[[], Awaitable]):
+        """
+        Регистрирует корутину, выполняемую в loop перед его остановкой
+
+        Args:
+            hook: Функция без аргументов, возвращающая корутину
+        """
+        self._shutdown_hooks.append(hook)
+
+    def stop(self, timeout: float = 5.0):
+        """Выполняет хуки остановки и останавливает фоновый loop"""
+        with self._lock:
+            loop = self._loop
+            self._loop = None
+            self._thread = None
+        if loop is None or loop.is_closed():
+            return
+
+        for hook in self._shutdown_hooks:
+            try:
+                asyncio.run_coroutine_threadsafe(hook(), loop).result(timeout)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка хука остановки event loop: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+# Глобальный экземпляр моста
+async_bridge = AsyncBridge()
+
+
+def run_async(coro: Awaitable, timeout: Optional[float] = None) -> Any:
+    """
+    Выполняет корутину в общем фоновом event loop (для синхронного кода Flask)
+
+    Args:
+        coro: Корутина
+        timeout: Максимальное время ожидания в секундах
+
+    Returns:
+        Результат корутины
+    """
+    return async_bridge.run(coro, timeout)
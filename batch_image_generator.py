@@ -8,12 +8,11 @@ import base64
 import uuid
 import os
 from typing import List, Dict, Optional
-from PIL import Image, ImageOps
-from io import BytesIO
 from image_queue_manager import queue_manager, Batch
 from openai_client import get_openai_response
 from config import GEMINI_API_KEY, GEMINI_URL, GENERATED_IMAGES_FOLDER
 from gemini_client import generate_image_with_retry, GeminiQuotaError
+from image_processing import image_processor
 
 # Импортируем функцию для получения текущего базового промта
 try:
@@ -201,17 +200,9 @@ class BatchImageGenerator:
         image_data = base64.b64decode(image_b64)
         
         try:
-            with Image.open(BytesIO(image_data)) as img:
-                # Конвертируем в RGB если нужно
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Изменяем размер изображения с сохранением пропорций и обрезкой по центру
-                img = ImageOps.fit(img, (1920, 1280), Image.Resampling.LANCZOS)
-                
-                # Сохраняем как PNG
-                img.save(filepath, 'PNG')
-                print(f"✅ Изображение изменено до размера 1920x1280 и сохранено: {filename}")
+            # Обрезка под 1920x1280 и сохранение PNG выполняются в пуле процессов
+            await image_processor.fit_and_save(image_data, filepath)
+            print(f"✅ Изображение изменено до размера 1920x1280 и сохранено: {filename}")
         except Exception as e:
             # Если PIL не может обработать, сохраняем как есть
             print(f"⚠️ Не удалось изменить размер, сохраняем оригинал: {e}")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Политика разбиения сообщений на батчи
+
+Раньше SmartBatchManager всегда делал 10 пропорциональных батчей при 10+
+сообщениях, иначе - по батчу на сообщение. Три сообщения стоили трех
+вызовов LLM и трех генераций Gemini, а 2000 сообщений давали батчи по 200
+сообщений, которые не помещаются в промпт микса. Стратегии регистрируются
+по имени (BATCHING_STRATEGY):
+
+- "proportional_10" - прежнее правило без изменений;
+- "adaptive" - число батчей выбирается по текущему запасу квоты Gemini
+  (quota_manager, общий для процессов), целевой задержке изображения
+  (BATCH_TARGET_LATENCY) и бюджету токенов промпта микса
+  (BATCH_PROMPT_TOKEN_BUDGET).
+"""
+
+import logging
+import math
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from config import BATCH_MIN_MESSAGES, BATCH_PROMPT_TOKEN_BUDGET, BATCH_TARGET_LATENCY, BATCHING_STRATEGY
+from quota_manager import quota_manager
+
+if TYPE_CHECKING:
+    from smart_batch_manager import Message
+
+logger = logging.getLogger(__name__)
+
+# Стратегия: сообщения -> группы сообщений (по группе на батч, порядок сохраняется)
+Strategy = Callable[[List["Message"]], List[List["Message"]]]
+
+# Разделитель сообщений в промпте микса (см. SequentialBatchProcessor._create_mixed_text)
+PROMPT_SEPARATOR = "; "
+# Символов на токен - как в quota_manager.estimate_tokens
+CHARS_PER_TOKEN = 4
+
+
+def split_evenly(messages: List["Message"], count: int) -> List[List["Message"]]:
+    """
+    Делит сообщения на count последовательных групп почти равного размера
+
+    Args:
+        messages: Сообщения
+        count: Число групп (остаток добавляется к первым группам)
+
+    Returns:
+        list: Группы сообщений
+    """
+    size, remainder = divmod(len(messages), count)
+    groups = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < remainder else 0)
+        groups.append(messages[start:end])
+        start = end
+    return groups
+
+
+def prompt_length(messages: List["Message"]) -> int:
+    """Длина списка сообщений в промпте микса (в символах)"""
+    return sum(len(msg.content) for msg in messages) + len(PROMPT_SEPARATOR) * max(0, len(messages) - 1)
+
+
+def proportional_10(messages: List["Message"]) -> List[List["Message"]]:
+    """Прежняя стратегия: 10 пропорциональных батчей при 10+ сообщениях, иначе по 1 сообщению"""
+    total_messages = len(messages)
+    if total_messages >= 10:
+        logger.info(f"📊 Создание 10 пропорциональных батчей "
+                    f"(размер: {total_messages // 10}, остаток: {total_messages % 10})")
+        return split_evenly(messages, 10)
+
+    logger.info(f"📊 Создание {total_messages} батчей по 1 сообщению")
+    return [[message] for message in messages]
+
+
+class BatchingPolicy:
+    """Выбор стратегии батчинга и адаптивное разбиение по квоте, задержке и бюджету промпта"""
+
+    def __init__(self, strategy: str = BATCHING_STRATEGY, target_latency: float = BATCH_TARGET_LATENCY,
+                 prompt_token_budget: int = BATCH_PROMPT_TOKEN_BUDGET, min_messages: int = BATCH_MIN_MESSAGES):
+        self.target_latency = target_latency
+        self.prompt_token_budget = prompt_token_budget
+        self.min_messages = max(1, min_messages)
+        self.strategies: Dict[str, Strategy] = {
+            'proportional_10': proportional_10,
+            'adaptive': self.adaptive
+        }
+        self.strategy = strategy
+        if strategy not in self.strategies:
+            logger.warning(f"⚠️ Неизвестная стратегия батчинга '{strategy}', используется proportional_10")
+            self.strategy = 'proportional_10'
+
+    def register_strategy(self, name: str, strategy: Strategy):
+        """
+        Регистрирует стратегию батчинга
+
+        Args:
+            name: Имя стратегии (значение BATCHING_STRATEGY)
+            strategy: Функция: сообщения -> группы сообщений
+        """
+        self.strategies[name] = strategy
+
+    def create_groups(self, messages: List["Message"], strategy: Optional[str] = None) -> List[List["Message"]]:
+        """
+        Разбивает сообщения на группы - по группе на батч
+
+        Args:
+            messages: Сообщения (прошедшие фильтр контента)
+            strategy: Имя стратегии (по умолчанию - выбранная в конфигурации)
+
+        Returns:
+            list: Непустые группы сообщений в исходном порядке
+        """
+        if not messages:
+            return []
+        groups = self.strategies[strategy or self.strategy](messages)
+        return [group for group in groups if group]
+
+    def quota_capacity(self) -> int:
+        """
+        Сколько изображений Gemini успеет сгенерировать за целевую задержку
+
+        Свободные запросы текущей минуты плюс запросы, которые квота
+        восполнит за BATCH_TARGET_LATENCY секунд; пауза после 429 сокращает
+        это окно. Не больше остатка дневной квоты и не меньше 1.
+
+        Returns:
+            int: Число батчей, укладывающихся в квоту
+        """
+        limits = quota_manager.limits
+        try:
+            usage = quota_manager.get_usage_stats()
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения квоты Gemini: {e}")
+            return max(1, limits.requests_per_minute)
+
+        cooldown = usage['cooldown_remaining']
+        minute_headroom = 0 if cooldown > 0 else max(0, limits.requests_per_minute - usage['requests_per_minute'])
+        refill_window = max(0.0, self.target_latency - cooldown)
+        refill = math.floor(limits.requests_per_minute * refill_window / limits.minute_reset_seconds)
+        day_headroom = max(0, limits.requests_per_day - usage['requests_per_day'])
+
+        return max(1, min(day_headroom, minute_headroom + refill))
+
+    def split_by_budget(self, group: List["Message"]) -> List[List["Message"]]:
+        """
+        Делит группу, чей промпт микса превышает бюджет токенов
+
+        Args:
+            group: Группа сообщений
+
+        Returns:
+            list: Группы, каждая в пределах бюджета (длинное сообщение - отдельной группой)
+        """
+        max_chars = self.prompt_token_budget * CHARS_PER_TOKEN
+        if prompt_length(group) <= max_chars:
+            return [group]
+
+        groups = []
+        current: List["Message"] = []
+        current_length = 0
+        for message in group:
+            added = len(message.content) + (len(PROMPT_SEPARATOR) if current else 0)
+            if current and current_length + added > max_chars:
+                groups.append(current)
+                current, current_length = [], 0
+                added = len(message.content)
+            current.append(message)
+            current_length += added
+        groups.append(current)
+        return groups
+
+    def adaptive(self, messages: List["Message"]) -> List[List["Message"]]:
+        """
+        Адаптивная стратегия
+
+        Батчей не больше, чем квота Gemini обслужит за целевую задержку, и
+        не меньше BATCH_MIN_MESSAGES сообщений в батче (несколько ответов
+        смешиваются в одно изображение вместо отдельного вызова на каждый).
+        Если промпт микса не помещается в бюджет токенов, батчей больше:
+        бюджет - жесткое ограничение, квота влияет только на ожидание.
+
+        Args:
+            messages: Сообщения
+
+        Returns:
+            list: Группы сообщений
+        """
+        total_messages = len(messages)
+        capacity = self.quota_capacity()
+        max_chars = self.prompt_token_budget * CHARS_PER_TOKEN
+
+        by_quota = min(capacity, max(1, total_messages // self.min_messages))
+        by_budget = math.ceil(prompt_length(messages) / max_chars)
+        count = min(total_messages, max(by_quota, by_budget))
+
+        groups = [part for group in split_evenly(messages, count) for part in self.split_by_budget(group)]
+
+        logger.info(f"📊 Адаптивный батчинг: {total_messages} сообщений -> {len(groups)} батчей "
+                    f"(квота: {capacity}, по бюджету промпта: {by_budget})")
+        if len(groups) > capacity:
+            logger.warning(f"⚠️ Батчей ({len(groups)}) больше, чем квота Gemini обслужит "
+                           f"за {self.target_latency:.0f} с ({capacity})")
+        return groups
+
+
+# Глобальный экземпляр политики батчинга
+batching_policy = BatchingPolicy()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк фильтра контента
+
+Сравнивает проверку одним проходом (ContentFilter.is_safe_content) с прежним
+алгоритмом - отдельный поиск по каждому запрещенному слову и паттерну - на
+типичных сообщениях чата и проверяет, что вердикты режима подстрок
+совпадают. Отдельно замеряется режим морфологии (слова против словоформ) и
+выводится, сколько вердиктов в нем изменилось. Так же сравнивается очистка
+промптов (sanitize_prompt) с прежними K заменами.
+
+Запуск: python benchmark_content_filter.py [число_повторов]
+"""
+
+import logging
+import random
+import re
+import sys
+import time
+
+from content_filter import ContentFilter
+
+# Типичные ответы зрителей и админские промпты
+SAMPLE_MESSAGES = [
+    "море",
+    "корабль в шторм",
+    "Спасибо за концерт, было очень красиво!",
+    "Звездные войны",
+    "Гарри Поттер и философский камень",
+    "Хочу увидеть летающий город над облаками",
+    "Титаник, айсберг и музыка оркестра",
+    "кровь и война в фильме про историю",
+    "Властелин колец: битва за Средиземье",
+    "это было тупой фильм",
+    "Интерстеллар — черная дыра и время",
+    "pirates of the caribbean, ship in a storm",
+    "рыцарь на драконе над замком",
+    "музей искусства ночью",
+    "лекция про войну 1812 года",
+    "Создай художественное изображение: закат над морем, киберпанк, неон",
+    "fuck this weather",
+    "голый король из сказки",
+    "Матрица, зеленый код, Нео",
+    "Космос, планеты и оркестр на Луне",
+]
+
+
+def legacy_is_safe_content(content_filter: ContentFilter, text: str) -> tuple[bool, str]:
+    """Прежний алгоритм: поиск по каждому слову и паттерну, повторный поиск исключений"""
+    if not text or not isinstance(text, str):
+        return True, ""
+
+    text_lower = text.lower()
+
+    for word in content_filter.forbidden_words:
+        if word in text_lower:
+            if not any(exception in text_lower for exception in content_filter.exceptions):
+                return False, f"Обнаружено запрещенное слово: {word}"
+
+    for pattern in content_filter.forbidden_patterns:
+        if re.search(pattern, text_lower):
+            if not any(context in text_lower for context in content_filter.cultural_contexts):
+                return False, f"Обнаружен запрещенный контент: {pattern}"
+
+    return True, ""
+
+
+def legacy_sanitize_prompt(content_filter: ContentFilter, prompt: str) -> str:
+    """Прежняя очистка: нижний регистр и str.replace по каждой замене"""
+    sanitized = prompt.lower()
+    for bad_word, replacement in content_filter.replacements.items():
+        sanitized = sanitized.replace(bad_word, replacement)
+    return sanitized
+
+
+def build_corpus(size: int, seed: int = 42) -> list:
+    """Сообщения чата: образцы и их склейки (как в батчах и миксах)"""
+    rng = random.Random(seed)
+    corpus = list(SAMPLE_MESSAGES)
+    while len(corpus) < size:
+        corpus.append(' '.join(rng.sample(SAMPLE_MESSAGES, rng.randint(2, 6))))
+    return corpus
+
+
+def measure(func, corpus: list, repeat: int) -> float:
+    """Среднее время проверки одного сообщения в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            func(text)
+    return (time.perf_counter() - start) / (repeat * len(corpus)) * 1e6
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    # Предупреждения фильтра о блокировке не должны влиять на замер
+    logging.getLogger('content_filter').setLevel(logging.ERROR)
+
+    content_filter = ContentFilter(morphology=False)
+    morphology_filter = ContentFilter(morphology=True)
+    corpus = build_corpus(500)
+
+    mismatches = [
+        text for text in corpus
+        if content_filter.is_safe_content(text) != legacy_is_safe_content(content_filter, text)
+    ]
+
+    legacy_time = measure(lambda text: legacy_is_safe_content(content_filter, text), corpus, repeat)
+    single_pass_time = measure(content_filter.is_safe_content, corpus, repeat)
+    blocked = sum(1 for text in corpus if not content_filter.is_safe_content(text)[0])
+
+    morphology_time = measure(morphology_filter.is_safe_content, corpus, repeat)
+    changed = [
+        text for text in SAMPLE_MESSAGES
+        if morphology_filter.is_safe_content(text)[0] != content_filter.is_safe_content(text)[0]
+    ]
+
+    # Новая очистка сохраняет регистр - сравниваем в нижнем регистре
+    mismatches += [
+        text for text in corpus
+        if content_filter.sanitize_prompt(text).lower() != legacy_sanitize_prompt(content_filter, text)
+    ]
+    legacy_sanitize_time = measure(lambda text: legacy_sanitize_prompt(content_filter, text), corpus, repeat)
+    sanitize_time = measure(content_filter.sanitize_prompt, corpus, repeat)
+
+    print("📊 Бенчмарк фильтра контента")
+    print("=" * 50)
+    print(f"Сообщений: {len(corpus)} (заблокировано {blocked}), повторов: {repeat}")
+    print(f"Прежний алгоритм:  {legacy_time:8.2f} мкс/сообщение")
+    print(f"Один проход:       {single_pass_time:8.2f} мкс/сообщение")
+    print(f"Ускорение:         {legacy_time / single_pass_time:8.2f}x")
+    print(f"Морфология:        {morphology_time:8.2f} мкс/сообщение")
+    print(f"Морфология меняет вердикт у {len(changed)} из {len(SAMPLE_MESSAGES)} образцов: {changed}")
+    print(f"Очистка, прежняя:  {legacy_sanitize_time:8.2f} мкс/сообщение")
+    print(f"Очистка, один проход: {sanitize_time:5.2f} мкс/сообщение")
+    if mismatches:
+        print(f"❌ Вердикты расходятся на {len(mismatches)} сообщениях, например: {mismatches[0]!r}")
+        sys.exit(1)
+    print("✅ Вердикты и результаты очистки совпадают")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import asyncio
 import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_CONCURRENT_UPDATES
 from openai_client import get_openai_response, test_openai_connection
 from message_collector import message_collector
 from simple_message_db import message_db  # Добавляем для сохранения в файл
@@ -271,7 +271,8 @@ def main() -> None:
         print("⚠️ Проблемы с подключением к OpenAI. Бот будет работать с ограниченным функционалом.")
     
     # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Апдейты обрабатываются параллельно: ожидание ответа OpenAI не задерживает других пользователей
+    application = Application.builder().token(BOT_TOKEN).concurrent_updates(BOT_CONCURRENT_UPDATES).build()
     
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", start))
@@ -12,6 +12,8 @@ NEW_BOT_TOKEN = os.getenv("NEW_BOT_TOKEN", "8394487624:AAEUTsqaRtXsCBW2B3mqeu8Ha
 
 # OpenAI API
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
+# Максимум одновременных запросов к OpenAI (в каждом event loop)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
 
 # Message Collection Settings
 MESSAGE_COLLECTION_INTERVAL = 15  # секунд
@@ -19,19 +21,110 @@ MAX_MESSAGES_PER_BATCH = 100
 
 # Настройки бота
 BOT_USERNAME = "neyro_bot"
+# Сколько апдейтов Telegram бот обрабатывает одновременно
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
 ADMIN_IDS = []  # Добавьте ID администраторов
 
-# Настройки базы данных (если понадобится)
-DATABASE_URL = "sqlite:///bot.db"
+# Настройки базы данных (используется хранилищем сообщений "sqlite")
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bot.db")
+
+# Хранилище сообщений: "json" (перезапись messages.json, по умолчанию), "journal" (append-only
+# журнал поверх messages.json) или "sqlite" (индексированные запросы; при первом запуске
+# переносит сообщения из messages.json)
+MESSAGE_DB_BACKEND = os.getenv("MESSAGE_DB_BACKEND", "json")
+# Через сколько записей журнал сворачивается в снимок messages.json
+MESSAGE_DB_COMPACT_EVERY = int(os.getenv("MESSAGE_DB_COMPACT_EVERY", "1000"))
+
+# Индекс получателей рассылок (user_id -> источники и время последней активности)
+RECIPIENT_INDEX_FILE = os.getenv("RECIPIENT_INDEX_FILE", "recipients.json")
+# Повторная активность пользователя пишется в журнал не чаще раза в N секунд
+RECIPIENT_INDEX_TOUCH_INTERVAL = float(os.getenv("RECIPIENT_INDEX_TOUCH_INTERVAL", "60"))
+RECIPIENT_INDEX_COMPACT_EVERY = int(os.getenv("RECIPIENT_INDEX_COMPACT_EVERY", "500"))
+
+# Push-обновления админ-панели (Server-Sent Events, /api/admin/events)
+# Сколько последних событий хранит шина для переподключившихся клиентов
+EVENT_BUS_CAPACITY = int(os.getenv("EVENT_BUS_CAPACITY", "1000"))
+# Интервал пинга открытого соединения при отсутствии событий (секунды)
+EVENT_STREAM_HEARTBEAT = float(os.getenv("EVENT_STREAM_HEARTBEAT", "15"))
+
+# Доставка сообщений администратора в Mini App (/api/mini-app/latest-message)
+# Сколько секунд сообщение показывается клиентам и хранится в базе
+MINI_APP_MESSAGE_TTL = float(os.getenv("MINI_APP_MESSAGE_TTL", "300"))
+# Максимальное ожидание long-poll запроса (?after=<seq>&wait=<секунды>)
+MINI_APP_LONG_POLL_TIMEOUT = float(os.getenv("MINI_APP_LONG_POLL_TIMEOUT", "25"))
+# Период фоновой очистки устаревших админских сообщений
+MINI_APP_CLEANUP_INTERVAL = float(os.getenv("MINI_APP_CLEANUP_INTERVAL", "60"))
+
+# Кэш ответов LLM для миксированных текстов (ключ - нормализованный набор сообщений + версия промпта)
+LLM_CACHE_FILE = os.getenv("LLM_CACHE_FILE", "llm_cache.json")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+# Время жизни записи в секундах
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+# Через сколько записей журнал кэша сворачивается в снимок
+LLM_CACHE_COMPACT_EVERY = int(os.getenv("LLM_CACHE_COMPACT_EVERY", "200"))
+
+# Через сколько событий журнал SmartBatchManager сворачивается в снимок smart_batch_data.json
+SMART_BATCH_SNAPSHOT_EVERY = int(os.getenv("SMART_BATCH_SNAPSHOT_EVERY", "200"))
+
+# Разбиение сообщений на батчи: "adaptive" - по квоте Gemini, задержке и бюджету промпта,
+# "proportional_10" - прежнее правило (10 батчей при 10+ сообщениях, иначе по 1 сообщению)
+BATCHING_STRATEGY = os.getenv("BATCHING_STRATEGY", "adaptive")
+# Целевая задержка изображения в секундах: батчей не больше, чем квота Gemini обслужит за это время
+BATCH_TARGET_LATENCY = float(os.getenv("BATCH_TARGET_LATENCY", "60"))
+# Бюджет токенов сообщений в промпте микса (~4 символа на токен)
+BATCH_PROMPT_TOKEN_BUDGET = int(os.getenv("BATCH_PROMPT_TOKEN_BUDGET", "500"))
+# Минимум сообщений в батче при достаточной квоте (адаптивная стратегия)
+BATCH_MIN_MESSAGES = int(os.getenv("BATCH_MIN_MESSAGES", "3"))
+
+# Размер LRU-кэша вердиктов фильтра контента (повторяющиеся ответы зрителей)
+CONTENT_FILTER_CACHE_SIZE = int(os.getenv("CONTENT_FILTER_CACHE_SIZE", "10000"))
+# Фильтр контента сравнивает слова текста со словоформами и корнями запрещенных слов
+# (нецензурная лексика - по-прежнему подстрокой); false - поиск подстрок для всех слов
+CONTENT_FILTER_MORPHOLOGY = os.getenv("CONTENT_FILTER_MORPHOLOGY", "true").lower() == "true"
+
+# Конвейер обработки батчей (SequentialBatchProcessor.process_all_batches): mix -> generate -> save
+# Сколько батчей одновременно находится в конвейере (1 - строго последовательно, как раньше;
+# больше 1 - параллельная обработка, учитывайте квоту Gemini 15 запросов в минуту)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "1"))
+# Число обработчиков этапов: вызовы LLM (микс текста) и генерации изображений
+BATCH_MIX_CONCURRENCY = int(os.getenv("BATCH_MIX_CONCURRENCY", "1"))
+BATCH_IMAGE_CONCURRENCY = int(os.getenv("BATCH_IMAGE_CONCURRENCY", "1"))
+# Порядок готовых изображений: "created" - в порядке создания батчей, "completion" - по готовности
+BATCH_RESULT_ORDER = os.getenv("BATCH_RESULT_ORDER", "created")
+
+# Процессов в пуле постобработки изображений (0 - по числу ядер, но не больше 4)
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", "0"))
+
+# Пул HTTP-соединений долгоживущих клиентов (http_pool.py)
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "20"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "10"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "60"))
+
+# Массовые рассылки Telegram: сообщений в секунду (лимит Telegram ~30) и число воркеров
+TELEGRAM_BROADCAST_RATE = float(os.getenv("TELEGRAM_BROADCAST_RATE", "25"))
+TELEGRAM_BROADCAST_WORKERS = int(os.getenv("TELEGRAM_BROADCAST_WORKERS", "8"))
+
+# Unix-сокет сервиса общего состояния (run_system.py) для бота и админ-панели
+STATE_SERVICE_SOCKET = os.getenv("STATE_SERVICE_SOCKET", "neuroevent_state.sock")
 
 # Gemini API для генерации изображений
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "YOUR_GEMINI_API_KEY_HERE")
 GEMINI_MODEL = "gemini-2.5-flash-image"
 GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
+# База учета квоты Gemini (SQLite), общая для бота и админ-панелей
+QUOTA_DB_FILE = os.getenv("QUOTA_DB_FILE", "gemini_quota.db")
+# Максимум одновременных соединений с Gemini API
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "10"))
 
 # Папка для сохранения сгенерированных изображений
 GENERATED_IMAGES_FOLDER = "generated_images"
 
+# Дисковый кэш изображений Gemini (ключ - хэш модели и оптимизированного промпта)
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+# Максимальный размер папки кэша в байтах (при превышении удаляются давно не использованные)
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
 # Включение постоянной генерации изображений
 ENABLE_IMAGE_GENERATION = True
 IMAGE_GENERATION_MESSAGE = "🎨 Генерация изображений активна! Ваши идеи превращаются в визуальные образы."
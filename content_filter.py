@@ -1,23 +1,62 @@
 #!/usr/bin/env python3
 """
 Фильтр контента для генерации изображений
+
+Запрещенные слова, паттерны, исключения и культурные контексты один раз
+компилируются в общий автомат поиска (регулярное выражение по префиксному
+дереву слов): текст проверяется за один проход вместо отдельного поиска по
+каждому слову и паттерну. В режиме морфологии (CONTENT_FILTER_MORPHOLOGY,
+по умолчанию включен) текст разбивается на слова, и каждое слово ищется в
+хэш-таблице словоформ и корней ключевых слов (morphology.py): находятся
+склоненные и производные формы и не срабатывают подстроки внутри невинных
+слов. Нецензурная лексика и в этом режиме ищется подстрокой ("хуйня",
+"bullshit"). Вердикты для повторяющихся сообщений берутся из LRU-кэша
+(check_many).
 """
 
 import re
 import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from config import CONTENT_FILTER_CACHE_SIZE, CONTENT_FILTER_MORPHOLOGY
+from morphology import MIN_FORM_LENGTH, inflections, normalize_token, roots, tokenize
 
 logger = logging.getLogger(__name__)
 
+# Паттерн-список слов: \b(слово|слово|...)\b
+_WORD_LIST_PATTERN_RE = re.compile(r'^\\b\(([^\\()\[\]{}.*+?^$]+)\)\\b$')
+
+
+def _is_word_boundary(text: str, start: int, end: int) -> bool:
+    """Совпадение text[start:end] - целое слово (как \\b...\\b в re)"""
+    def is_word_char(char):
+        return char.isalnum() or char == '_'
+    return (start == 0 or not is_word_char(text[start - 1])) and (end == len(text) or not is_word_char(text[end]))
+
+
 class ContentFilter:
     """Фильтр некультурного контента"""
     
-    def __init__(self):
-        # Список запрещенных слов и фраз
-        self.forbidden_words = [
-            # Нецензурная лексика
+    def __init__(self, cache_size: int = CONTENT_FILTER_CACHE_SIZE, morphology: bool = CONTENT_FILTER_MORPHOLOGY):
+        # True - сравнение слов текста со словоформами, False - поиск подстрок
+        self.morphology = morphology
+        
+        # LRU-кэш вердиктов: нормализованный текст -> (is_safe, reason)
+        self.cache_size = cache_size
+        self._verdicts: "OrderedDict[str, Tuple[bool, str]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_stats = {'hits': 0, 'misses': 0}
+        
+        # Нецензурная лексика (в режиме морфологии тоже ищется подстрокой)
+        self.obscene_words = [
             'гавно', 'ссанина', 'говно', 'дерьмо', 'пизда', 'хуй', 'блядь', 'сука', 'ебать',
-            'fuck', 'shit', 'damn', 'bitch', 'asshole', 'crap', 'piss', 'dick', 'cock',
-            
+            'fuck', 'shit', 'damn', 'bitch', 'asshole', 'crap', 'piss', 'dick', 'cock'
+        ]
+        
+        # Список запрещенных слов и фраз (включает нецензурную лексику)
+        self.forbidden_words = self.obscene_words + [
             # Оскорбления
             'идиот', 'дурак', 'тупой', 'дебил', 'кретин', 'мудак', 'сволочь', 'подонок',
             'idiot', 'stupid', 'dumb', 'moron', 'bastard', 'scum', 'loser',
@@ -58,6 +97,244 @@ class ContentFilter:
             'history', 'historical', 'book', 'movie', 'art', 'museum',
             'medicine', 'medical', 'treatment', 'doctor', 'hospital'
         ]
+        
+        # Культурные контексты, в которых запрещенные паттерны допустимы (включают исключения)
+        self.cultural_contexts = self.exceptions + [
+            'образование', 'учебник', 'лекция', 'курс',
+            'education', 'textbook', 'lecture', 'course'
+        ]
+        
+        # Устойчивые фразы (названия фильмов и книг), слова которых не проверяются в режиме морфологии
+        self.allowed_phrases = [
+            'звездные войны', 'война и мир', 'война миров', 'войны клонов',
+            'star wars', 'war and peace', 'war of the worlds'
+        ]
+        
+        # Нейтральные замены для очистки промптов
+        self.replacements = {
+            'гавно': 'отходы',
+            'говно': 'отходы', 
+            'дерьмо': 'отходы',
+            'пизда': 'женский орган',
+            'хуй': 'мужской орган',
+            'блядь': 'женщина',
+            'сука': 'собака',
+            'ебать': 'заниматься',
+            'fuck': 'engage',
+            'shit': 'waste',
+            'damn': 'darn',
+            'bitch': 'woman',
+            'asshole': 'person',
+            'crap': 'waste',
+            'piss': 'urine',
+            'dick': 'penis',
+            'cock': 'rooster'
+        }
+        
+        self.compile()
+    
+    def compile(self):
+        """
+        Компилирует списки фильтра в один автомат поиска
+        
+        Вызывается в конструкторе; после изменения списков нужно вызвать снова.
+        Запрещенные слова, исключения, культурные контексты и слова из
+        паттернов вида \\b(слово|слово)\\b собираются в префиксное дерево,
+        из которого строится регулярное выражение: каждая ветка начинается с
+        первой буквы ключевого слова (re быстро пропускает остальные позиции),
+        а продолжение проверяется без поглощения текста, поэтому
+        перекрывающиеся вхождения не теряются. Паттерны другого вида
+        проверяются отдельно через re.search. В режиме морфологии строятся
+        индексы словоформа -> записи и корень -> записи (см. _compile_morphology),
+        а дерево - только из нецензурной лексики. Замены для sanitize_prompt
+        собираются в одно выражение (длинные слова первыми).
+        """
+        # Ключевое слово -> [(категория, индекс в списке, проверять границы слова)]
+        keywords: Dict[str, List[Tuple[str, int, bool]]] = {}
+        
+        def add(keyword, category, index, whole_word=False):
+            keywords.setdefault(keyword, []).append((category, index, whole_word))
+        
+        for i, word in enumerate(self.forbidden_words):
+            add(word, 'word', i)
+        for word in self.exceptions:
+            add(word, 'exception', 0)
+        for word in self.cultural_contexts:
+            if word not in self.exceptions:
+                add(word, 'context', 0)
+        
+        self._extra_patterns = []
+        for i, pattern in enumerate(self.forbidden_patterns):
+            match = _WORD_LIST_PATTERN_RE.match(pattern)
+            if match:
+                for word in match.group(1).split('|'):
+                    add(word, 'pattern', i, True)
+            else:
+                self._extra_patterns.append((i, re.compile(pattern)))
+        
+        if self.morphology:
+            self._compile_morphology(keywords)
+            # Производные и составные слова с нецензурным корнем ("хуйня", "dickhead") - подстрокой
+            obscene = set(self.obscene_words)
+            self._compile_substring_matcher({
+                keyword: [entry for entry in entries if entry[0] == 'word']
+                for keyword, entries in keywords.items() if keyword in obscene
+            })
+        else:
+            self._compile_substring_matcher(keywords)
+        
+        # Списки изменились - прежние вердикты недействительны
+        with self._cache_lock:
+            self._verdicts.clear()
+        
+        replaced_words = '|'.join(map(re.escape, sorted(self.replacements, key=len, reverse=True)))
+        self._replacer = re.compile(replaced_words) if replaced_words else None
+        self._replacer_ignorecase = re.compile(replaced_words, re.IGNORECASE) if replaced_words else None
+    
+    def _compile_morphology(self, keywords: Dict[str, List[Tuple[str, int, bool]]]):
+        """
+        Индексы режима морфологии
+        
+        Запрещенное слово в начальной форме - категория 'word' (запрет снимают
+        только исключения), его другие словоформы и слова с его корнем -
+        категория 'form': как и паттерны, они допустимы в культурном контексте
+        ("лекция про войну"). Словоформы нецензурной лексики - всегда 'word'.
+        Слова из паттернов \\b(слово|слово)\\b совпадают только целиком, как в
+        режиме подстрок. Исключения и культурные контексты совпадают во всех
+        словоформах ("в музее", "про историю").
+        """
+        obscene = set(self.obscene_words)
+        
+        # Словоформа -> записи всех ключевых слов, у которых она есть
+        self._form_index: Dict[str, List[Tuple[str, int]]] = {}
+        # Корень -> записи запрещенных слов (слово текста начинается с корня)
+        self._root_index: Dict[str, List[Tuple[str, int]]] = {}
+        for keyword, entries in keywords.items():
+            lemma = normalize_token(keyword)
+            for category, index, _ in entries:
+                forms = {lemma} if category == 'pattern' else inflections(keyword)
+                for form in forms:
+                    soft = category == 'word' and form != lemma and keyword not in obscene
+                    self._form_index.setdefault(form, []).append(('form' if soft else category, index))
+                if category == 'word' and keyword not in obscene:
+                    for root in roots(keyword):
+                        self._root_index.setdefault(root, []).append(('form', index))
+        # Первые буквы корней: большинство слов текста отсекается одной проверкой
+        self._root_heads = {root[:MIN_FORM_LENGTH] for root in self._root_index}
+        
+        # Первое слово фразы -> фразы целиком (кортежи слов)
+        self._allowed_phrases: Dict[str, List[Tuple[str, ...]]] = {}
+        for phrase in self.allowed_phrases:
+            words = tuple(tokenize(phrase))
+            if words:
+                self._allowed_phrases.setdefault(words[0], []).append(words)
+    
+    def _without_allowed_phrases(self, tokens: List[str]) -> List[str]:
+        """Слова текста без входящих в устойчивые фразы (allowed_phrases)"""
+        if not self._allowed_phrases:
+            return tokens
+        
+        result = []
+        position = 0
+        while position < len(tokens):
+            for phrase in self._allowed_phrases.get(tokens[position], ()):
+                if tuple(tokens[position:position + len(phrase)]) == phrase:
+                    position += len(phrase)
+                    break
+            else:
+                result.append(tokens[position])
+                position += 1
+        return result
+    
+    def _compile_substring_matcher(self, keywords: Dict[str, List[Tuple[str, int, bool]]]):
+        """Регулярное выражение по префиксному дереву ключевых слов (режим подстрок)"""
+        trie: Dict[str, Any] = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = True
+        
+        def subtree_regex(node):
+            branches = [re.escape(char) + subtree_regex(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ''
+            body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+            return f'(?:{body})?' if '' in node else body
+        
+        # Ветка на каждую первую букву: буква поглощается, продолжение захватывается в группу c<N>
+        branches = [
+            f'{re.escape(char)}(?=(?P<c{i}>{subtree_regex(child)}))'
+            for i, (char, child) in enumerate(sorted(trie.items()))
+        ]
+        self._matcher = re.compile('|'.join(branches)) if branches else None
+        
+        # Жадный поиск находит самое длинное слово в позиции; короче него в той же позиции
+        # могут начинаться только его префиксы - их записи собираются заранее
+        self._keyword_entries = {
+            keyword: [
+                (category, index, len(prefix), whole_word)
+                for prefix in (keyword[:end] for end in range(1, len(keyword) + 1))
+                for category, index, whole_word in keywords.get(prefix, ())
+            ]
+            for keyword in keywords
+        }
+    
+    def _scan(self, text_lower: str) -> dict:
+        """
+        Один проход по тексту
+        
+        Returns:
+            dict: word - первое по списку запрещенное слово (или None),
+                  form - первое по списку запрещенное слово, найденное по словоформе
+                         или корню (режим морфологии, или None),
+                  pattern - первый по списку сработавший паттерн (или None),
+                  exception / context - найдено ли исключение / культурный контекст
+        """
+        word_index = form_index = pattern_index = None
+        found = set()
+        
+        def hit(category, index):
+            nonlocal word_index, form_index, pattern_index
+            if category == 'word':
+                word_index = index if word_index is None else min(word_index, index)
+            elif category == 'form':
+                form_index = index if form_index is None else min(form_index, index)
+            elif category == 'pattern':
+                pattern_index = index if pattern_index is None else min(pattern_index, index)
+            else:
+                found.add(category)
+        
+        if self.morphology:
+            # Каждое слово - проверка по хэш-таблице словоформ и по его началам в таблице корней
+            for token in set(self._without_allowed_phrases(tokenize(text_lower))):
+                for category, index in self._form_index.get(token, ()):
+                    hit(category, index)
+                if token[:MIN_FORM_LENGTH] in self._root_heads:
+                    for end in range(MIN_FORM_LENGTH, len(token) + 1):
+                        for category, index in self._root_index.get(token[:end], ()):
+                            hit(category, index)
+        
+        # В режиме морфологии автомат содержит только нецензурную лексику
+        if self._matcher is not None:
+            for match in self._matcher.finditer(text_lower):
+                start = match.start()
+                keyword = match.group() + match.group(match.lastgroup)
+                for category, index, length, whole_word in self._keyword_entries[keyword]:
+                    if not whole_word or _is_word_boundary(text_lower, start, start + length):
+                        hit(category, index)
+        
+        for index, pattern in self._extra_patterns:
+            if (pattern_index is None or index < pattern_index) and pattern.search(text_lower):
+                pattern_index = index
+        
+        return {
+            'word': self.forbidden_words[word_index] if word_index is not None else None,
+            'form': self.forbidden_words[form_index] if form_index is not None else None,
+            'pattern': self.forbidden_patterns[pattern_index] if pattern_index is not None else None,
+            'exception': 'exception' in found,
+            'context': bool(found)
+        }
     
     def is_safe_content(self, text: str) -> tuple[bool, str]:
         """
@@ -72,48 +349,76 @@ class ContentFilter:
         if not text or not isinstance(text, str):
             return True, ""
         
-        text_lower = text.lower()
+        scan = self._scan(text.lower())
         
-        # Проверка на запрещенные слова
-        for word in self.forbidden_words:
-            if word in text_lower:
-                # Проверяем, не является ли это исключением
-                if not self._is_exception(text_lower, word):
-                    logger.warning(f"Запрещенное слово обнаружено: {word}")
-                    return False, f"Обнаружено запрещенное слово: {word}"
+        # Проверка на запрещенные слова (исключение в тексте снимает запрет)
+        if scan['word'] and not scan['exception']:
+            logger.warning(f"Запрещенное слово обнаружено: {scan['word']}")
+            return False, f"Обнаружено запрещенное слово: {scan['word']}"
         
-        # Проверка на запрещенные паттерны
-        for pattern in self.forbidden_patterns:
-            if re.search(pattern, text_lower):
-                # Проверяем контекст
-                if not self._is_cultural_context(text_lower, pattern):
-                    logger.warning(f"Запрещенный паттерн обнаружен: {pattern}")
-                    return False, f"Обнаружен запрещенный контент: {pattern}"
+        # Проверка на запрещенные паттерны (допустимы в культурном контексте)
+        if scan['pattern'] and not scan['context']:
+            logger.warning(f"Запрещенный паттерн обнаружен: {scan['pattern']}")
+            return False, f"Обнаружен запрещенный контент: {scan['pattern']}"
+        
+        # Словоформы и производные запрещенных слов (допустимы в культурном контексте)
+        if scan['form'] and not scan['context']:
+            logger.warning(f"Форма запрещенного слова обнаружена: {scan['form']}")
+            return False, f"Обнаружено запрещенное слово: {scan['form']}"
         
         return True, ""
     
-    def _is_exception(self, text: str, word: str) -> bool:
-        """Проверяет, является ли слово исключением в культурном контексте"""
-        for exception in self.exceptions:
-            if exception in text:
-                return True
-        return False
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Ключ кэша вердиктов: нижний регистр и схлопнутые пробелы"""
+        return ' '.join(text.lower().split())
     
-    def _is_cultural_context(self, text: str, pattern: str) -> bool:
-        """Проверяет, находится ли запрещенный паттерн в культурном контексте"""
-        cultural_contexts = [
-            'история', 'исторический', 'книга', 'фильм', 'искусство', 'музей',
-            'медицина', 'медицинский', 'медицинская', 'медицинские', 'лечение', 'врач', 'больница',
-            'образование', 'учебник', 'лекция', 'курс',
-            'history', 'historical', 'book', 'movie', 'art', 'museum',
-            'medicine', 'medical', 'treatment', 'doctor', 'hospital',
-            'education', 'textbook', 'lecture', 'course'
-        ]
+    def check_many(self, texts: List[str]) -> List[Tuple[bool, str]]:
+        """
+        Проверяет пачку сообщений, повторяющиеся тексты - из кэша вердиктов
         
-        for context in cultural_contexts:
-            if context in text:
-                return True
-        return False
+        Вердикт вычисляется по нормализованному тексту (см. normalize_text).
+        
+        Args:
+            texts: Тексты для проверки
+            
+        Returns:
+            list: (is_safe, reason) для каждого текста в том же порядке
+        """
+        verdicts = []
+        for text in texts:
+            if not text or not isinstance(text, str):
+                verdicts.append((True, ""))
+                continue
+            
+            key = self.normalize_text(text)
+            with self._cache_lock:
+                verdict = self._verdicts.get(key)
+                if verdict is not None:
+                    self._verdicts.move_to_end(key)
+                    self.cache_stats['hits'] += 1
+            
+            if verdict is None:
+                verdict = self.is_safe_content(key)
+                with self._cache_lock:
+                    self.cache_stats['misses'] += 1
+                    self._verdicts[key] = verdict
+                    if len(self._verdicts) > self.cache_size:
+                        self._verdicts.popitem(last=False)
+            
+            verdicts.append(verdict)
+        return verdicts
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Метрики кэша вердиктов"""
+        with self._cache_lock:
+            lookups = self.cache_stats['hits'] + self.cache_stats['misses']
+            return {
+                **self.cache_stats,
+                'hit_rate': self.cache_stats['hits'] / lookups if lookups else 0.0,
+                'entries': len(self._verdicts),
+                'max_entries': self.cache_size
+            }
     
     def sanitize_prompt(self, prompt: str) -> str:
         """
@@ -128,32 +433,53 @@ class ContentFilter:
         if not prompt:
             return prompt
         
-        # Заменяем запрещенные слова на нейтральные
-        replacements = {
-            'гавно': 'отходы',
-            'говно': 'отходы', 
-            'дерьмо': 'отходы',
-            'пизда': 'женский орган',
-            'хуй': 'мужской орган',
-            'блядь': 'женщина',
-            'сука': 'собака',
-            'ебать': 'заниматься',
-            'fuck': 'engage',
-            'shit': 'waste',
-            'damn': 'darn',
-            'bitch': 'woman',
-            'asshole': 'person',
-            'crap': 'waste',
-            'piss': 'urine',
-            'dick': 'penis',
-            'cock': 'rooster'
-        }
+        if self._replacer is None:
+            return prompt
+        
+        # Ищем запрещенные слова за один проход по тексту в нижнем регистре (без IGNORECASE -
+        # так быстрее) и заменяем их в исходном тексте, сохраняя регистр остального текста
+        lowered = prompt.lower()
+        if len(lowered) != len(prompt):
+            # Редкие символы меняют длину при смене регистра - позиции не совпадут
+            return self._replacer_ignorecase.sub(self._replace_match, prompt)
         
-        sanitized = prompt.lower()
-        for bad_word, replacement in replacements.items():
-            sanitized = sanitized.replace(bad_word, replacement)
+        parts = []
+        position = 0
+        for match in self._replacer.finditer(lowered):
+            start, end = match.span()
+            parts.append(prompt[position:start])
+            parts.append(self._match_case(prompt[start:end], self.replacements[match.group()]))
+            position = end
         
-        return sanitized
+        if not parts:
+            return prompt
+        parts.append(prompt[position:])
+        return ''.join(parts)
+    
+    def sanitize_many(self, prompts: List[str]) -> List[str]:
+        """
+        Очищает список промптов (например, сообщения батча)
+        
+        Args:
+            prompts: Исходные промпты
+            
+        Returns:
+            list: Очищенные промпты в том же порядке
+        """
+        return [self.sanitize_prompt(prompt) for prompt in prompts]
+    
+    def _replace_match(self, match: re.Match) -> str:
+        word = match.group()
+        return self._match_case(word, self.replacements.get(word.lower(), word))
+    
+    @staticmethod
+    def _match_case(word: str, replacement: str) -> str:
+        """Замена с регистром как у исходного слова (СЛОВО, Слово, слово)"""
+        if len(word) > 1 and word.isupper():
+            return replacement.upper()
+        if word[0].isupper():
+            return replacement[:1].upper() + replacement[1:]
+        return replacement
 
 # Глобальный экземпляр фильтра
 content_filter = ContentFilter()
@@ -168,7 +494,19 @@ def check_content_safety(text: str) -> tuple[bool, str]:
     Returns:
         tuple: (is_safe, reason) - безопасен ли контент и причина блокировки
     """
-    return content_filter.is_safe_content(text)
+    return content_filter.check_many([text])[0]
+
+def check_many_content_safety(texts: List[str]) -> List[Tuple[bool, str]]:
+    """
+    Проверяет безопасность пачки сообщений (с кэшем вердиктов)
+    
+    Args:
+        texts: Тексты для проверки
+        
+    Returns:
+        list: (is_safe, reason) для каждого текста в том же порядке
+    """
+    return content_filter.check_many(texts)
 
 def sanitize_image_prompt(prompt: str) -> str:
     """
@@ -181,3 +519,15 @@ def sanitize_image_prompt(prompt: str) -> str:
         str: Очищенный промпт
     """
     return content_filter.sanitize_prompt(prompt)
+
+def sanitize_image_prompts(prompts: List[str]) -> List[str]:
+    """
+    Очищает список промптов для генерации изображений
+    
+    Args:
+        prompts: Исходные промпты
+        
+    Returns:
+        list: Очищенные промпты в том же порядке
+    """
+    return content_filter.sanitize_many(prompts)
@@ -9,10 +9,11 @@ import asyncio
 import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_CONCURRENT_UPDATES
 from openai_client import get_openai_response, test_openai_connection, get_quick_response
 from message_collector import message_collector
 from simple_message_db import message_db
+from recipient_index import recipient_index
 from question_system import question_system
 from smart_batch_manager import smart_batch_manager
 from mock_responses import get_friendly_response
@@ -63,39 +64,8 @@ def get_user_state(user_id):
 
 # Функция для сохранения пользователя в реестр
 def save_user_to_registry(user_id, username, first_name):
-    """Сохраняет пользователя в реестр для рассылок"""
-    import json
-    import os
-    
-    registry_file = 'user_registry.json'
-    
-    try:
-        # Загружаем существующий реестр
-        if os.path.exists(registry_file):
-            with open(registry_file, 'r', encoding='utf-8') as f:
-                registry = json.load(f)
-        else:
-            registry = {'users': []}
-        
-        # Проверяем, есть ли уже такой пользователь
-        existing_user = next((u for u in registry['users'] if u['user_id'] == user_id), None)
-        
-        if not existing_user:
-            # Добавляем нового пользователя
-            registry['users'].append({
-                'user_id': user_id,
-                'username': username or f'user_{user_id}',
-                'first_name': first_name or 'User',
-                'registered_at': time.time()
-            })
-            
-            # Сохраняем реестр
-            with open(registry_file, 'w', encoding='utf-8') as f:
-                json.dump(registry, f, ensure_ascii=False, indent=2)
-            
-            logger.info(f"✅ Пользователь {user_id} добавлен в реестр")
-    except Exception as e:
-        logger.error(f"❌ Ошибка сохранения пользователя в реестр: {e}")
+    """Сохраняет пользователя в индекс получателей рассылок"""
+    recipient_index.touch(user_id, username or f'user_{user_id}', first_name or 'User', source='telegram')
 
 # Обработчик команды /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -268,10 +238,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     else:
         try:
             message_db.load_messages()
-            for m in reversed(message_db.messages):
-                if m.get('source') == 'admin' and ('📽️' in m.get('message','') or '🎬' in m.get('message','')):
-                    context_question = m.get('message')
-                    break
+            # Поиск по всем сообщениям администратора, а не только по последним
+            latest_question = message_db.find_latest_message('admin', ['📽️', '🎬'])
+            if latest_question:
+                context_question = latest_question.get('message')
         except Exception as e:
             logger.warning(f"⚠️ Ошибка получения контекста: {e}")
 
@@ -319,7 +289,8 @@ def main() -> None:
         print("⚠️ Проблемы с подключением к OpenAI. Бот будет работать с ограниченным функционалом.")
     
     # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Апдейты обрабатываются параллельно: ожидание ответа OpenAI не задерживает других пользователей
+    application = Application.builder().token(BOT_TOKEN).concurrent_updates(BOT_CONCURRENT_UPDATES).build()
     
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", start))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Шина событий для push-обновлений админ-панели
+
+SmartBatchManager и база сообщений публикуют события (изменения батчей,
+новые сообщения, очистка) в кольцевой буфер с возрастающим номером seq.
+Эндпоинт /api/admin/events (Server-Sent Events) ждет новых событий через
+get_events() и отправляет их панели по одному долгоживущему соединению
+вместо периодического опроса нескольких эндпоинтов.
+
+При запуске через run_system.py шина - общий объект сервиса состояния,
+поэтому события процесса бота доходят до админ-панели.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import EVENT_BUS_CAPACITY, EVENT_STREAM_HEARTBEAT
+from state_service import get_shared_object
+
+logger = logging.getLogger(__name__)
+
+
+class EventBus:
+    """
+    Кольцевой буфер событий с ожиданием новых записей
+
+    Все методы потокобезопасны (threading.Condition), get_events() может
+    блокировать вызывающий поток до появления события или таймаута.
+    """
+
+    def __init__(self, capacity: int = EVENT_BUS_CAPACITY):
+        self._events: deque = deque(maxlen=capacity)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def publish(self, event_type: str, data: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Публикует событие
+
+        Args:
+            event_type: Тип события ('message', 'batches', ...)
+            data: Данные события (JSON-сериализуемые)
+
+        Returns:
+            int: Номер события (seq)
+        """
+        with self._cond:
+            self._seq += 1
+            self._events.append({'seq': self._seq, 'type': event_type, 'data': data or {}, 'time': time.time()})
+            self._cond.notify_all()
+            return self._seq
+
+    def latest_seq(self) -> int:
+        """Номер последнего опубликованного события"""
+        with self._cond:
+            return self._seq
+
+    def get_events(self, after_seq: int, timeout: float = 0.0) -> Dict[str, Any]:
+        """
+        События с номером больше after_seq (с ожиданием, если их еще нет)
+
+        Args:
+            after_seq: Номер последнего полученного события
+            timeout: Сколько секунд ждать новых событий
+
+        Returns:
+            dict: seq - номер последнего события, events - список событий,
+                  reset - события после after_seq уже вытеснены из буфера
+                  (или шина перезапущена) и клиенту нужна полная перезагрузка
+        """
+        with self._cond:
+            if self._seq == after_seq and timeout > 0:
+                self._cond.wait_for(lambda: self._seq != after_seq, timeout)
+
+            oldest_seq = self._events[0]['seq'] if self._events else self._seq + 1
+            reset = after_seq > self._seq or after_seq < oldest_seq - 1
+            events = [event for event in self._events if event['seq'] > after_seq] if not reset else []
+            return {'seq': self._seq, 'events': events, 'reset': reset}
+
+
+def format_sse(event_type: str, data: Any, event_id: Optional[int] = None) -> str:
+    """Форматирует событие Server-Sent Events"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def iter_sse(after_seq: Optional[int],
+             transform: Callable[[List[Dict[str, Any]]], Iterable[Tuple[str, Any]]],
+             heartbeat: float = EVENT_STREAM_HEARTBEAT) -> Iterator[str]:
+    """
+    Бесконечный поток Server-Sent Events из шины
+
+    Args:
+        after_seq: Номер последнего события, полученного клиентом (Last-Event-ID);
+                   None - только новые события
+        transform: Преобразует события шины в пары (тип события панели, данные)
+        heartbeat: Интервал комментария-пинга при отсутствии событий (секунды)
+
+    Yields:
+        str: Фрагменты потока text/event-stream
+    """
+    if after_seq is None:
+        after_seq = event_bus.latest_seq()
+    yield f"retry: 3000\nid: {after_seq}\n\n"
+
+    while True:
+        result = event_bus.get_events(after_seq, timeout=heartbeat)
+        seq = result['seq']
+
+        if result['reset']:
+            yield format_sse('reset', {'seq': seq}, seq)
+        elif result['events']:
+            for event_type, data in transform(result['events']):
+                yield format_sse(event_type, data, seq)
+        else:
+            # Пинг держит соединение открытым и обнаруживает отключившихся клиентов
+            yield ": ping\n\n"
+
+        after_seq = seq
+
+
+# Глобальный экземпляр: общий объект сервиса состояния (run_system.py) или локальный
+event_bus = get_shared_object('event_bus')
+if event_bus is None:
+    event_bus = EventBus()
@@ -8,8 +8,11 @@ import asyncio
 import json
 import logging
 from typing import Optional, Dict, Any
-from config import GEMINI_API_KEY, GEMINI_URL, ENABLE_IMAGE_GENERATION, IMAGE_GENERATION_MESSAGE
+from config import GEMINI_API_KEY, GEMINI_MODEL, GEMINI_URL, ENABLE_IMAGE_GENERATION, IMAGE_GENERATION_MESSAGE, GEMINI_MAX_CONNECTIONS
 from quota_manager import quota_manager, optimize_prompt, estimate_tokens
+from http_pool import http_pool, pool_limits
+from image_cache import image_cache
+from single_flight import single_flight
 
 logger = logging.getLogger(__name__)
 
@@ -20,21 +23,53 @@ class GeminiQuotaError(Exception):
         self.retry_after = retry_after
 
 class GeminiClient:
-    """Клиент для работы с Gemini API с обработкой ошибок квоты"""
+    """
+    Клиент для работы с Gemini API с обработкой ошибок квоты
+    
+    HTTP-клиент долгоживущий: соединения (keep-alive, HTTP/2) переиспользуются
+    между генерациями и повторными попытками. startup() заранее создает клиент,
+    aclose() закрывает соединения. Результаты кэшируются на диске (image_cache)
+    по модели и оптимизированному промпту.
+    """
     
-    def __init__(self, api_key: str = None, max_retries: int = 3, base_delay: float = 1.0):
+    CLIENT_NAME = 'gemini'
+    
+    def __init__(self, api_key: str = None, max_retries: int = 3, base_delay: float = 1.0,
+                 max_connections: int = GEMINI_MAX_CONNECTIONS):
         self.api_key = api_key or GEMINI_API_KEY
         self.max_retries = max_retries
         self.base_delay = base_delay
         self.url = GEMINI_URL
+        self.max_connections = max_connections
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Долгоживущий HTTP-клиент Gemini для текущего event loop"""
+        return http_pool.get(
+            self.CLIENT_NAME,
+            limits=pool_limits(self.max_connections),
+            timeout=30
+        )
+    
+    async def startup(self):
+        """Создает HTTP-клиент заранее (вызывается при старте приложения)"""
+        self._get_client()
+    
+    async def aclose(self):
+        """Закрывает HTTP-клиент и его соединения"""
+        await http_pool.aclose(self.CLIENT_NAME)
         
-    async def generate_image(self, prompt: str, retry_count: int = 0) -> str:
+    async def generate_image(self, prompt: str, retry_count: int = 0, use_cache: bool = True) -> str:
         """
         Генерирует изображение с обработкой ошибок квоты
         
+        Одновременные запросы с тем же промптом ждут один общий вызов API
+        (single_flight); при use_cache=False запрос всегда отдельный.
+        
         Args:
             prompt: Текст для генерации изображения
             retry_count: Текущее количество попыток
+            use_cache: Брать изображение из кэша при совпадении промпта
+                       (False - всегда новое изображение, результат все равно кэшируется)
             
         Returns:
             str: Base64 строка изображения
@@ -43,16 +78,43 @@ class GeminiClient:
             GeminiQuotaError: При превышении квоты
             Exception: При других ошибках
         """
+        # Оптимизируем промпт для экономии токенов
+        optimized_prompt = optimize_prompt(prompt)
+        cache_key = image_cache.make_key(GEMINI_MODEL, optimized_prompt)
+        
+        if retry_count == 0 and use_cache:
+            # Повторный промпт - изображение из кэша, без запроса и расхода квоты
+            cached = image_cache.get(cache_key)
+            if cached:
+                logger.info("💾 Изображение взято из кэша")
+                return cached
+            
+            return await single_flight.do(
+                f"gemini:{cache_key}",
+                lambda: self._request_image(optimized_prompt, cache_key, retry_count)
+            )
+        
+        return await self._request_image(optimized_prompt, cache_key, retry_count)
+    
+    async def _request_image(self, optimized_prompt: str, cache_key: str, retry_count: int = 0) -> str:
+        """
+        Запрос изображения к Gemini API с повторными попытками при ошибке квоты
+        
+        Args:
+            optimized_prompt: Оптимизированный промпт
+            cache_key: Ключ кэша изображений для промпта
+            retry_count: Текущее количество попыток
+            
+        Returns:
+            str: Base64 строка изображения
+        """
         if retry_count >= self.max_retries:
             raise Exception(f"Превышено максимальное количество попыток ({self.max_retries})")
         
-        # Оптимизируем промпт для экономии токенов
-        optimized_prompt = optimize_prompt(prompt)
         estimated_tokens = estimate_tokens(optimized_prompt)
         
-        # Проверяем квоту перед запросом
-        if retry_count == 0:  # Только при первой попытке
-            await quota_manager.wait_if_needed(estimated_tokens)
+        # Ждем свободной квоты и учитываем запрос (общий учет всех процессов)
+        await quota_manager.wait_if_needed(estimated_tokens)
         
         # Формируем запрос к Gemini API
         payload = {
@@ -71,35 +133,36 @@ class GeminiClient:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(self.url, headers=headers, json=payload, timeout=30)
+            client = self._get_client()
+            resp = await client.post(self.url, headers=headers, json=payload)
+            
+            # Проверяем статус ответа
+            if resp.status_code == 429:
+                # Обрабатываем ошибку квоты
+                error_data = resp.json()
+                retry_after = self._extract_retry_after(error_data)
                 
-                # Проверяем статус ответа
-                if resp.status_code == 429:
-                    # Обрабатываем ошибку квоты
-                    error_data = resp.json()
-                    retry_after = self._extract_retry_after(error_data)
-                    
-                    logger.warning(f"Превышена квота Gemini API. Попытка {retry_count + 1}/{self.max_retries}")
-                    logger.warning(f"Ошибка: {error_data}")
-                    
-                    if retry_count < self.max_retries - 1:
-                        # Ждем перед повторной попыткой
-                        delay = retry_after or (self.base_delay * (2 ** retry_count))
-                        logger.info(f"Ожидание {delay} секунд перед повторной попыткой...")
-                        await asyncio.sleep(delay)
-                        
-                        # Рекурсивно вызываем функцию с увеличенным счетчиком
-                        return await self.generate_image(prompt, retry_count + 1)
-                    else:
-                        raise GeminiQuotaError(
-                            f"Превышена квота Gemini API после {self.max_retries} попыток",
-                            retry_after
-                        )
+                logger.warning(f"Превышена квота Gemini API. Попытка {retry_count + 1}/{self.max_retries}")
+                logger.warning(f"Ошибка: {error_data}")
                 
-                resp.raise_for_status()
-                resp_json = resp.json()
+                # Пауза для всех процессов: повторная попытка дождется ее в wait_if_needed
+                delay = retry_after or (self.base_delay * (2 ** retry_count))
+                quota_manager.record_rate_limit(delay)
                 
+                if retry_count < self.max_retries - 1:
+                    logger.info(f"Ожидание {delay} секунд перед повторной попыткой...")
+                    
+                    # Рекурсивно вызываем функцию с увеличенным счетчиком
+                    return await self._request_image(optimized_prompt, cache_key, retry_count + 1)
+                else:
+                    raise GeminiQuotaError(
+                        f"Превышена квота Gemini API после {self.max_retries} попыток",
+                        retry_after
+                    )
+            
+            resp.raise_for_status()
+            resp_json = resp.json()
+            
         except httpx.HTTPStatusError as e:
             if e.response.status_code == 429:
                 # Дополнительная обработка 429 ошибки
@@ -138,8 +201,7 @@ class GeminiClient:
             logger.error(f"Не удалось найти изображение в ответе API: {resp_json}")
             raise Exception("Не удалось получить изображение из API")
         
-        # Записываем использование API
-        quota_manager.record_request(estimated_tokens)
+        image_cache.put(cache_key, image_b64)
         
         logger.info(f"Изображение успешно сгенерировано (попытка {retry_count + 1})")
         return image_b64
@@ -179,12 +241,13 @@ class GeminiClient:
 # Глобальный экземпляр клиента
 gemini_client = GeminiClient()
 
-async def generate_image_with_retry(prompt: str) -> str:
+async def generate_image_with_retry(prompt: str, use_cache: bool = True) -> str:
     """
     Удобная функция для генерации изображения с повторными попытками
     
     Args:
         prompt: Текст для генерации изображения
+        use_cache: Брать изображение из кэша при совпадении промпта
         
     Returns:
         str: Base64 строка изображения или сообщение об ошибке
@@ -192,7 +255,7 @@ async def generate_image_with_retry(prompt: str) -> str:
     if not ENABLE_IMAGE_GENERATION:
         raise Exception(IMAGE_GENERATION_MESSAGE)
     
-    return await gemini_client.generate_image(prompt)
+    return await gemini_client.generate_image(prompt, use_cache=use_cache)
 
 def test_gemini_connection() -> bool:
     """
@@ -202,15 +265,10 @@ def test_gemini_connection() -> bool:
         bool: True если подключение успешно, False иначе
     """
     try:
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        from async_bridge import run_async
         
-        result = loop.run_until_complete(
-            generate_image_with_retry("Test image generation")
-        )
+        result = run_async(generate_image_with_retry("Test image generation", use_cache=False))
         
-        loop.close()
         logger.info("Gemini API connection test successful")
         return True
     except Exception as e:
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Долгоживущие HTTP-клиенты с пулом соединений
+
+httpx.AsyncClient держит пул keep-alive соединений (и HTTP/2, если
+установлен пакет h2), поэтому повторные запросы к одному API не тратят
+время на TCP и TLS рукопожатия. Соединения клиента привязаны к event loop,
+в котором они открыты, поэтому клиенты хранятся отдельно для каждого loop:
+общий фоновый loop Flask (async_bridge) и loop Telegram-бота получают
+свои экземпляры.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import threading
+import weakref
+from typing import Dict, Optional
+
+import httpx
+
+from config import HTTP_POOL_MAX_CONNECTIONS, HTTP_POOL_MAX_KEEPALIVE, HTTP_POOL_KEEPALIVE_EXPIRY
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 в httpx требует пакет h2 (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+def pool_limits(max_connections: int = HTTP_POOL_MAX_CONNECTIONS) -> httpx.Limits:
+    """Лимиты пула соединений по умолчанию"""
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=min(HTTP_POOL_MAX_KEEPALIVE, max_connections),
+        keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY
+    )
+
+
+class AsyncClientPool:
+    """Именованные httpx.AsyncClient, по одному на event loop"""
+
+    def __init__(self):
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, name: str, **client_kwargs) -> httpx.AsyncClient:
+        """
+        Возвращает клиент текущего event loop, создавая его при первом обращении
+
+        Args:
+            name: Имя клиента (например, 'gemini')
+            **client_kwargs: Параметры httpx.AsyncClient для создания клиента
+
+        Returns:
+            httpx.AsyncClient: Долгоживущий клиент
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.setdefault(loop, {})
+            client = clients.get(name)
+            if client is None or client.is_closed:
+                client_kwargs.setdefault('limits', pool_limits())
+                client_kwargs.setdefault('http2', HTTP2_AVAILABLE)
+                client = httpx.AsyncClient(**client_kwargs)
+                clients[name] = client
+                logger.info(f"🔌 HTTP-клиент '{name}' создан (HTTP/2: {client_kwargs['http2']})")
+            return client
+
+    async def aclose(self, name: Optional[str] = None):
+        """
+        Закрывает клиенты текущего event loop
+
+        Args:
+            name: Имя клиента; None - все клиенты loop
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.get(loop, {})
+            names = [name] if name is not None else list(clients)
+            to_close = [clients.pop(n) for n in names if n in clients]
+
+        for client in to_close:
+            await client.aclose()
+        if to_close:
+            logger.info(f"🔌 Закрыто HTTP-клиентов: {len(to_close)}")
+
+
+# Глобальный пул клиентов
+http_pool = AsyncClientPool()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Дисковый кэш изображений Gemini
+
+Одинаковые итоговые промпты (тот же миксированный текст и тот же базовый
+промпт) раньше каждый раз отправлялись в Gemini и расходовали квоту
+(15 запросов в минуту). Кэш адресуется содержимым: имя файла - SHA-256
+от модели и оптимизированного промпта, в файле хранится base64-строка
+изображения. Размер папки ограничен IMAGE_CACHE_MAX_BYTES, при
+превышении удаляются давно не использованные файлы (LRU по времени
+изменения, которое обновляется при каждом попадании). Папка общая для
+процессов бота и админ-панели.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from config import IMAGE_CACHE_DIR, IMAGE_CACHE_ENABLED, IMAGE_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """Content-addressed кэш base64-изображений на диске с LRU-вытеснением по размеру"""
+
+    SUFFIX = '.b64'
+
+    def __init__(self, cache_dir: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+                 enabled: bool = IMAGE_CACHE_ENABLED):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        if self.enabled:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._total_bytes = sum(size for _, _, size in self._scan())
+            except Exception as e:
+                logger.error(f"❌ Ошибка инициализации кэша изображений: {e}")
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        """Ключ кэша: SHA-256 от модели и оптимизированного промпта"""
+        return hashlib.sha256(f"{model}\n{prompt}".encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def _scan(self):
+        """Файлы кэша: (путь, время последнего использования, размер)"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(self.SUFFIX):
+                    stat = entry.stat()
+                    entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Изображение из кэша
+
+        Args:
+            key: Ключ (см. make_key)
+
+        Returns:
+            Optional[str]: Base64 строка изображения или None при промахе
+        """
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='ascii') as f:
+                image_b64 = f.read()
+            # Отмечаем использование для LRU
+            os.utime(path)
+        except FileNotFoundError:
+            image_b64 = None
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения кэша изображений: {e}")
+            image_b64 = None
+
+        with self._lock:
+            self.stats['hits' if image_b64 else 'misses'] += 1
+        return image_b64 or None
+
+    def put(self, key: str, image_b64: str):
+        """
+        Сохраняет изображение в кэш (атомарно: временный файл + переименование)
+
+        Args:
+            key: Ключ (см. make_key)
+            image_b64: Base64 строка изображения
+        """
+        if not self.enabled or not image_b64:
+            return
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='ascii') as f:
+                f.write(image_b64)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи в кэш изображений: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self.stats['stores'] += 1
+            self._total_bytes += len(image_b64)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Удаляет давно не использованные файлы, пока размер кэша не уложится в лимит"""
+        try:
+            # Пересчитываем по диску: файлы могли добавить или удалить другие процессы
+            entries = sorted(self._scan(), key=lambda entry: entry[1])
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения папки кэша изображений: {e}")
+            return
+
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.stats['evictions'] += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"❌ Ошибка удаления из кэша изображений: {e}")
+                continue
+            total -= size
+
+        self._total_bytes = total
+        logger.info(f"🧹 Кэш изображений сокращен до {total} байт")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики кэша: попадания, промахи, доля попаданий, размер"""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'enabled': self.enabled
+            }
+
+
+# Глобальный экземпляр кэша
+image_cache = ImageCache()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Сервис постобработки изображений в пуле процессов
+
+Подгонка под 1920x1280 (ImageOps.fit + LANCZOS) и сохранение PNG с
+optimize=True нагружают CPU на сотни миллисекунд. Работа выполняется в
+ProcessPoolExecutor, поэтому не блокирует event loop конвейера батчей и
+потоки Flask и масштабируется по ядрам.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+from config import IMAGE_PROCESS_WORKERS
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SIZE = (1920, 1280)
+
+# Режимы подгонки: "fit" - с сохранением пропорций и обрезкой, "stretch" - растягивание
+RESIZE_MODES = ('fit', 'stretch')
+
+
+def _fit_and_save(source: Union[bytes, str], filepath: str, size: Tuple[int, int],
+                  mode: str = 'fit') -> Tuple[int, int]:
+    """
+    Подгоняет изображение под размер и сохраняет как PNG (выполняется в процессе пула)
+
+    Args:
+        source: Данные изображения или путь к файлу
+        filepath: Путь для сохранения
+        size: Итоговый размер (ширина, высота)
+        mode: "fit" - обрезка с сохранением пропорций, "stretch" - растягивание без обрезки
+
+    Returns:
+        tuple: Размер сохраненного изображения
+    """
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as img:
+        if mode == 'stretch':
+            # Растягиваем под размер целиком, без обрезки
+            if img.size != size:
+                img = img.resize(size, Image.Resampling.LANCZOS)
+        else:
+            # Конвертируем в RGB если необходимо
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+
+            # Изменяем размер с сохранением пропорций и обрезкой
+            img = ImageOps.fit(img, size, Image.Resampling.LANCZOS)
+
+        # Сохраняем как PNG с оптимизацией
+        img.save(filepath, 'PNG', optimize=True)
+        return img.size
+
+
+class ImageProcessingService:
+    """
+    Пул процессов для обработки изображений
+
+    Пул создается при первом обращении. Используется контекст multiprocessing
+    по умолчанию (fork в Linux): spawn заново выполнил бы главный скрипт, а
+    app.py / app_admin_only.py запускают фоновые потоки при импорте. Функция
+    процесса пула не использует logging и другие блокировки родителя.
+    """
+
+    def __init__(self, max_workers: int = IMAGE_PROCESS_WORKERS):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                logger.info(f"🖼️ Пул обработки изображений запущен ({self.max_workers} процессов)")
+            return self._executor
+
+    async def fit_and_save(self, source: Union[bytes, str], filepath: str,
+                           size: Tuple[int, int] = IMAGE_SIZE, mode: str = 'fit') -> Tuple[int, int]:
+        """
+        Подгоняет изображение под размер и сохраняет PNG в пуле процессов
+
+        Args:
+            source: Данные изображения (bytes) или путь к исходному файлу
+            filepath: Путь для сохранения
+            size: Итоговый размер (по умолчанию 1920x1280)
+            mode: Режим подгонки из RESIZE_MODES (по умолчанию "fit" - с обрезкой)
+
+        Returns:
+            tuple: Размер сохраненного изображения (ширина, высота)
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), _fit_and_save, source, filepath, size, mode)
+        except BrokenProcessPool:
+            # Процесс пула упал - следующий вызов создаст новый пул
+            logger.error("❌ Пул обработки изображений поврежден, будет пересоздан")
+            with self._lock:
+                self._executor = None
+            raise
+
+    def shutdown(self):
+        """Останавливает процессы пула"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+# Глобальный экземпляр сервиса
+image_processor = ImageProcessingService()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Журнальное хранилище: JSON-снимок + append-only журнал (JSON Lines)
+
+Каждая запись добавляется в конец журнала одной строкой, поэтому стоимость
+записи не зависит от объема накопленных данных. Периодически журнал
+компактируется в снимок. Снимок и журнал связаны номером поколения, что
+делает восстановление после сбоя безопасным на любом шаге компактирования.
+"""
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class JournalStore:
+    """
+    Снимок + журнал с межпроцессной блокировкой
+
+    Формат:
+    - снимок: обычный JSON-объект с дополнительным полем 'generation'
+    - журнал: первая строка {"op": "header", "generation": N}, далее записи
+
+    Журнал применяется поверх снимка только если их поколения совпадают.
+    Компактирование сначала атомарно заменяет снимок (поколение N+1), затем
+    атомарно заменяет журнал пустым журналом поколения N+1. Если процесс упал
+    между этими шагами, старый журнал (поколение N) просто игнорируется.
+    Недописанная последняя строка журнала (без перевода строки) не читается.
+    """
+
+    def __init__(self, snapshot_file: str, journal_file: Optional[str] = None,
+                 lock_file: Optional[str] = None, fsync_appends: bool = False):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file or f"{snapshot_file}.journal"
+        self.lock_file = lock_file or f"{snapshot_file}.lock"
+        self.fsync_appends = fsync_appends
+
+        self.generation = 0
+        self.records_since_compaction = 0
+
+        # Позиция чтения журнала: inode файла и смещение в байтах
+        self._journal_ino: Optional[int] = None
+        self._offset = 0
+        self._journal_stale = False
+        self._loaded = False
+
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_fd = None
+
+    @contextmanager
+    def locked(self):
+        """Эксклюзивная блокировка (потоки + процессы), допускает вложенность"""
+        with self._thread_lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                self._lock_fd = open(self.lock_file, 'a')
+                fcntl.flock(self._lock_fd.fileno(), fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_fd is not None:
+                    fcntl.flock(self._lock_fd.fileno(), fcntl.LOCK_UN)
+                    self._lock_fd.close()
+                    self._lock_fd = None
+
+    def load(self) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Полностью загружает снимок и применимые записи журнала
+
+        Returns:
+            tuple: (данные снимка или None, записи журнала по порядку)
+        """
+        with self.locked():
+            snapshot = self._read_snapshot()
+            self.generation = (snapshot or {}).get('generation', 0)
+            self._journal_ino = None
+            self._offset = 0
+            self.records_since_compaction = 0
+            self._loaded = True
+
+            if not os.path.exists(self.journal_file):
+                return snapshot, []
+
+            self._journal_stale = False
+            records = self._read_tail() or []
+            if self._journal_stale:
+                # Новые записи не должны попасть в журнал устаревшего поколения
+                self._write_journal_header()
+                self._journal_stale = False
+            return snapshot, records
+
+    def read_new(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Читает записи, добавленные в журнал после последнего чтения
+
+        Returns:
+            list: Новые записи; None если журнал был заменен (нужна полная загрузка)
+        """
+        with self._thread_lock:
+            if not self._loaded:
+                return None
+
+            try:
+                stat = os.stat(self.journal_file)
+            except FileNotFoundError:
+                return [] if self._journal_ino is None else None
+
+            if self._journal_ino is None:
+                # Журнала не было при последней загрузке
+                return None if stat.st_size > 0 else []
+            if stat.st_ino != self._journal_ino or stat.st_size < self._offset:
+                return None
+            if stat.st_size == self._offset:
+                return []
+
+            return self._read_tail()
+
+    def append(self, record: Dict[str, Any]):
+        """Добавляет запись в конец журнала"""
+        with self.locked():
+            if not os.path.exists(self.journal_file):
+                self._write_journal_header()
+
+            line = json.dumps(record, ensure_ascii=False) + '\n'
+            with open(self.journal_file, 'ab+') as f:
+                # Если предыдущий писатель упал посреди строки - начинаем с новой
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        line = '\n' + line
+                f.write(line.encode('utf-8'))
+                f.flush()
+                if self.fsync_appends:
+                    os.fsync(f.fileno())
+                stat = os.fstat(f.fileno())
+
+            self._journal_ino = stat.st_ino
+            self._offset = stat.st_size
+            self.records_since_compaction += 1
+
+    def compact(self, snapshot: Dict[str, Any]):
+        """
+        Записывает новый снимок и начинает пустой журнал следующего поколения
+
+        Args:
+            snapshot: Полное состояние для сохранения в снимок
+        """
+        with self.locked():
+            new_generation = self.generation + 1
+            data = dict(snapshot)
+            data['generation'] = new_generation
+
+            self._atomic_write(
+                self.snapshot_file,
+                json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+            )
+            self.generation = new_generation
+            self._write_journal_header()
+            self.records_since_compaction = 0
+
+    def _read_snapshot(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.snapshot_file):
+            return None
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения снимка {self.snapshot_file}: {e}")
+            return None
+
+    def _read_tail(self) -> Optional[List[Dict[str, Any]]]:
+        """Читает полные строки журнала начиная с текущего смещения"""
+        with open(self.journal_file, 'rb') as f:
+            ino = os.fstat(f.fileno()).st_ino
+            if self._journal_ino is not None and ino != self._journal_ino:
+                return None
+            f.seek(self._offset)
+            chunk = f.read()
+
+        # Недописанный хвост (без '\n') оставляем до следующего чтения
+        complete_end = chunk.rfind(b'\n') + 1
+        start_offset = self._offset
+        self._journal_ino = ino
+        self._offset = start_offset + complete_end
+
+        records = []
+        for raw_line in chunk[:complete_end].splitlines():
+            if not raw_line.strip():
+                continue
+            try:
+                record = json.loads(raw_line.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                logger.warning(f"⚠️ Пропущена поврежденная запись журнала {self.journal_file}: {e}")
+                continue
+
+            if record.get('op') == 'header':
+                if record.get('generation', 0) != self.generation:
+                    # Журнал от другого поколения снимка - уже учтен в снимке
+                    logger.info(f"📂 Журнал {self.journal_file} устарел, пропускаем")
+                    self._journal_stale = True
+                    return []
+                continue
+
+            records.append(record)
+
+        self.records_since_compaction += len(records)
+        return records
+
+    def _write_journal_header(self):
+        header = json.dumps({'op': 'header', 'generation': self.generation}) + '\n'
+        self._atomic_write(self.journal_file, header.encode('utf-8'))
+        stat = os.stat(self.journal_file)
+        self._journal_ino = stat.st_ino
+        self._offset = stat.st_size
+
+    @staticmethod
+    def _atomic_write(path: str, payload: bytes):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
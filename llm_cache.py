@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Кэш результатов LLM для миксированных текстов
+
+Одинаковые наборы сообщений (особенно батчи из одного короткого ответа
+вроде "море" или "корабль") раз за разом отправлялись в OpenAI. Кэш хранит
+результат по ключу из нормализованного набора сообщений и версии шаблона
+промпта: повторный запрос возвращается без обращения к LLM. Вытеснение -
+LRU (LLM_CACHE_MAX_ENTRIES) и TTL (LLM_CACHE_TTL). Записи сохраняются
+через JournalStore (снимок llm_cache.json + журнал) и переживают
+перезапуск; процессы бота и админ-панели видят записи друг друга.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from config import LLM_CACHE_COMPACT_EVERY, LLM_CACHE_FILE, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL
+from journal_store import JournalStore
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD_RE = re.compile(r'[^\w]+')
+
+
+def normalize_message(text: str) -> str:
+    """Нормализует сообщение для ключа кэша: регистр, ё/е, пунктуация, пробелы"""
+    text = (text or '').lower().replace('ё', 'е')
+    return _NON_WORD_RE.sub(' ', text).strip()
+
+
+def prompt_version(*parts: Any) -> str:
+    """Версия шаблона промпта: короткий хэш шаблона и его параметров"""
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()[:12]
+
+
+class LLMCache:
+    """LRU + TTL кэш ответов LLM с сохранением в JournalStore"""
+
+    def __init__(self, cache_file: str = LLM_CACHE_FILE, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 ttl: float = LLM_CACHE_TTL, compact_every: int = LLM_CACHE_COMPACT_EVERY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.compact_every = compact_every
+        # key -> {'value': str, 'created_at': float}; порядок - от давно использованных к недавним
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._store = JournalStore(cache_file)
+        self._lock = threading.RLock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+        try:
+            self._full_load()
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки кэша LLM: {e}")
+
+    def _full_load(self):
+        snapshot, records = self._store.load()
+        self._entries.clear()
+        for key, value, created_at in (snapshot or {}).get('entries', []):
+            self._entries[key] = {'value': value, 'created_at': created_at}
+        self._apply_records(records)
+
+    def _apply_records(self, records: List[Dict[str, Any]]):
+        for record in records:
+            if record.get('op') == 'put':
+                self._insert(record['key'], record['value'], record['created_at'])
+
+    def _refresh(self):
+        """Подтягивает записи, добавленные другими процессами"""
+        records = self._store.read_new()
+        if records is None:
+            self._full_load()
+        else:
+            self._apply_records(records)
+
+    def _insert(self, key: str, value: str, created_at: float):
+        self._entries[key] = {'value': value, 'created_at': created_at}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    @staticmethod
+    def make_key(kind: str, messages: Iterable[str], template_version: str) -> Optional[str]:
+        """
+        Ключ кэша: тип запроса, версия шаблона и нормализованный набор сообщений
+
+        Returns:
+            str: Хэш ключа или None, если после нормализации сообщений не осталось
+        """
+        normalized = sorted({normalize_message(msg) for msg in messages} - {''})
+        if not normalized:
+            return None
+        payload = json.dumps([kind, template_version, normalized], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Значение из кэша (None - промах или запись устарела)"""
+        with self._lock:
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения журнала кэша LLM: {e}")
+
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry['created_at'] > self.ttl:
+                del self._entries[key]
+                self.stats['expired'] += 1
+                entry = None
+
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry['value']
+
+    def put(self, key: str, value: str):
+        """Сохраняет значение в кэш и в журнал"""
+        created_at = time.time()
+        with self._lock:
+            try:
+                with self._store.locked():
+                    self._refresh()
+                    self._store.append({'op': 'put', 'key': key, 'value': value, 'created_at': created_at})
+                    self._insert(key, value, created_at)
+                    self.stats['stores'] += 1
+
+                    if self._store.records_since_compaction >= self.compact_every:
+                        self._compact()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи в кэш LLM: {e}")
+                self._insert(key, value, created_at)
+
+    def _compact(self):
+        """Сворачивает журнал в снимок, отбрасывая устаревшие записи"""
+        cutoff = time.time() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry['created_at'] < cutoff]:
+            del self._entries[key]
+        self._store.compact({
+            'entries': [[key, entry['value'], entry['created_at']] for key, entry in self._entries.items()]
+        })
+
+    async def get_or_create(self, kind: str, messages: Iterable[str], template_version: str,
+                            factory: Callable[[], Awaitable[str]]) -> str:
+        """
+        Возвращает результат из кэша или вызывает LLM и сохраняет ответ
+
+        Args:
+            kind: Тип запроса (например, 'batch_mix')
+            messages: Сообщения, из которых строится промпт
+            template_version: Версия шаблона промпта (см. prompt_version)
+            factory: Корутина-функция запроса к LLM; исключения не кэшируются
+
+        Returns:
+            str: Результат LLM
+        """
+        key = self.make_key(kind, messages, template_version)
+        if key is None:
+            return await factory()
+
+        cached = self.get(key)
+        if cached is not None:
+            logger.info(f"💾 Кэш LLM: попадание ({kind})")
+            return cached
+
+        value = await factory()
+        if value:
+            self.put(key, value)
+        return value
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики кэша: попадания, промахи, доля попаданий, размер"""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl
+            }
+
+    def clear(self):
+        """Очищает кэш"""
+        with self._lock:
+            self._entries.clear()
+            self._store.compact({'entries': []})
+
+
+# Глобальный экземпляр кэша
+llm_cache = LLMCache()
@@ -7,11 +7,15 @@ import time
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
 from dataclasses import dataclass
-from openai_client import get_openai_response
+from openai_client import request_openai_response
+from llm_cache import llm_cache, prompt_version
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Шаблон промпта микса (его текст входит в версию ключа кэша LLM)
+COLLECTOR_MIX_PROMPT = "Создай одно предложение, объединяющее смысл всех этих сообщений пользователей: {messages}"
+
 @dataclass
 class UserMessage:
     """Структура сообщения пользователя"""
@@ -99,9 +103,12 @@ class MessageCollector:
             combined_text = combined_text[:2000] + "..."
         
         try:
-            # Отправляем в LLM для создания миксированного текста
-            prompt = f"Создай одно предложение, объединяющее смысл всех этих сообщений пользователей: {combined_text}"
-            mixed_text = await get_openai_response(prompt)
+            # Отправляем в LLM для создания миксированного текста (повторный набор - из кэша)
+            prompt = COLLECTOR_MIX_PROMPT.format(messages=combined_text)
+            mixed_text = await llm_cache.get_or_create(
+                'collector_mix', all_messages, prompt_version(COLLECTOR_MIX_PROMPT),
+                lambda: request_openai_response(prompt)
+            )
             
             logger.info(f"🎭 Сгенерирован миксированный текст: {mixed_text[:100]}...")
             return mixed_text
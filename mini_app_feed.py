@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Лента обновлений для клиентов Mini App
+
+В памяти хранятся последнее админское сообщение и эпоха чата
+(chat_epoch) - время последней очистки истории в миллисекундах: каждая
+следующая очистка дает эпоху больше прежних, в том числе выданных до
+перезапуска процесса (после перезапуска эпоха 0). Любое изменение увеличивает
+номер seq. /api/mini-app/latest-message и /api/check-chat-clear-status
+отвечают из памяти за O(1), а с параметром wait работают как long-poll:
+запрос ждет изменения (seq больше after или эпоха новее epoch).
+
+Сообщения старше MINI_APP_MESSAGE_TTL секунд клиентам не показываются;
+удаление их из базы выполняет фоновая очистка, а не обработчик запроса.
+
+Лента - общий объект сервиса состояния (run_system.py): публикация в app.py,
+очистка из app_admin_only.py и long-poll любого процесса работают с одним
+экземпляром. Без сервиса у каждого процесса своя лента, как раньше.
+"""
+
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import MINI_APP_MESSAGE_TTL
+from state_service import get_shared_object
+
+
+class MiniAppFeed:
+    """Последнее сообщение администратора и эпоха чата с номером версии и ожиданием обновлений"""
+
+    def __init__(self, message_ttl: float = MINI_APP_MESSAGE_TTL):
+        self.message_ttl = message_ttl
+        self._seq = 0
+        self._message = ''
+        self._timestamp = 0.0
+        self._chat_epoch = 0
+        # Очистка, о которой еще не спросил ни один клиент без эпохи (прежний одноразовый флаг)
+        self._unclaimed_clear = False
+        self._cond = threading.Condition()
+
+    def publish_admin_message(self, message: str, timestamp: Optional[float] = None) -> int:
+        """
+        Публикует новое сообщение администратора и будит ожидающих клиентов
+
+        Args:
+            message: Текст сообщения
+            timestamp: Время сообщения (по умолчанию - текущее)
+
+        Returns:
+            int: Номер сообщения (seq)
+        """
+        with self._cond:
+            self._seq += 1
+            self._message = message
+            self._timestamp = timestamp or time.time()
+            self._cond.notify_all()
+            return self._seq
+
+    def clear_chat(self) -> int:
+        """
+        Отмечает очистку истории чата: новая эпоха, админское сообщение сбрасывается
+
+        Returns:
+            int: Новая эпоха чата (время очистки в миллисекундах)
+        """
+        with self._cond:
+            self._seq += 1
+            self._chat_epoch = max(int(time.time() * 1000), self._chat_epoch + 1)
+            self._unclaimed_clear = True
+            self._message = ''
+            self._timestamp = 0.0
+            self._cond.notify_all()
+            return self._chat_epoch
+
+    def claim_chat_clear(self) -> Optional[int]:
+        """
+        Одноразовый сигнал очистки для клиентов, не передающих эпоху
+
+        Прежнее поведение /api/check-chat-clear-status: первый такой запрос
+        после очистки получает ее время, следующие - None.
+
+        Returns:
+            Optional[int]: Эпоха очистки или None, если сигнал уже выдан
+        """
+        with self._cond:
+            if not self._unclaimed_clear:
+                return None
+            self._unclaimed_clear = False
+            return self._chat_epoch
+
+    def seed(self, latest_message: Optional[Dict[str, Any]]):
+        """Восстанавливает последнее сообщение из базы при запуске процесса"""
+        if latest_message and not self._seq:
+            self.publish_admin_message(latest_message.get('message', ''), latest_message.get('timestamp', 0))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Текущее состояние ленты
+
+        Returns:
+            dict: seq, message, timestamp (пустое сообщение, если его нет или оно устарело)
+                  и chat_epoch
+        """
+        with self._cond:
+            state = {'seq': self._seq, 'message': '', 'timestamp': 0, 'chat_epoch': self._chat_epoch}
+            if self._message and time.time() - self._timestamp <= self.message_ttl:
+                state.update(message=self._message, timestamp=self._timestamp)
+            return state
+
+    def wait(self, after_seq: int, timeout: float) -> Dict[str, Any]:
+        """
+        Ждет сообщение новее after_seq (long-poll)
+
+        Args:
+            after_seq: Номер последнего сообщения, известного клиенту
+            timeout: Максимальное время ожидания в секундах
+
+        Returns:
+            dict: Состояние ленты (см. snapshot); seq == after_seq - новых сообщений нет
+        """
+        with self._cond:
+            # Номер больше текущего - процесс перезапущен, отвечаем сразу
+            self._cond.wait_for(lambda: self._seq != after_seq, timeout)
+        return self.snapshot()
+
+    def wait_for_chat_clear(self, epoch: int, timeout: float) -> Dict[str, Any]:
+        """
+        Ждет очистку чата новее эпохи клиента (long-poll)
+
+        Args:
+            epoch: Эпоха чата, известная клиенту
+            timeout: Максимальное время ожидания в секундах
+
+        Returns:
+            dict: Состояние ленты (см. snapshot)
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._chat_epoch > epoch, timeout)
+        return self.snapshot()
+
+
+# Глобальный экземпляр: общий объект сервиса состояния (run_system.py) или локальный
+mini_app_feed = get_shared_object('mini_app_feed')
+if mini_app_feed is None:
+    mini_app_feed = MiniAppFeed()
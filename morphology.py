@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Легкая морфология для фильтра контента
+
+Вместо поиска подстрок текст разбивается на слова, а каждое слово
+проверяется по хэш-таблице словоформ ключевых слов за O(1). Словоформы
+строятся один раз при запуске: к основе слова добавляются окончания его
+типа склонения/спряжения (прилагательные, существительные на -а/-я, -о/-е,
+-ие, -ь, -й, на согласный, глаголы на -ть; для английских слов - -s, -ed,
+-ing и т.п.). Лишние сгенерированные формы безвредны: совпадение требует
+точного равенства слову текста, поэтому невинные слова, внутри которых
+встречается ключевое ("award" и "war"), больше не срабатывают.
+
+Производные слова ("идиотка", "сексуальный") находятся по корню: слово
+текста начинается с ключевого слова или его основы (roots). Короткие корни
+не используются - "кров" из "кровь" совпадает с "кровать".
+"""
+
+import re
+from typing import List, Set
+
+_TOKEN_RE = re.compile(r'\w+')
+_CYRILLIC_RE = re.compile(r'[а-я]')
+
+# Слова короче не генерируются (кроме самого ключевого слова): "сук" из "сука" совпадает с невинными словами
+MIN_FORM_LENGTH = 4
+# Корни короче не используются для поиска по началу слова (основа "войн" из "война" - уже словоформы)
+MIN_ROOT_LENGTH = 5
+
+_ADJECTIVE_ENDINGS = [
+    'ый', 'ий', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ого', 'его', 'ому', 'ему',
+    'ым', 'им', 'ом', 'ем', 'ую', 'юю', 'ых', 'их', 'ыми', 'ими'
+]
+
+# (окончания начальной формы, окончания всех форм); основа - слово без окончания начальной формы
+_RUSSIAN_PARADIGMS = [
+    (('ый', 'ий', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие'), _ADJECTIVE_ENDINGS),
+    (('ие', 'ье'), ['ие', 'ия', 'ию', 'ием', 'ии', 'ий', 'иям', 'иями', 'иях',
+                    'ье', 'ья', 'ью', 'ьем', 'ьи', 'ьям', 'ьями', 'ьях']),
+    (('а', 'я'), ['а', 'ы', 'е', 'у', 'ой', 'ою', 'ам', 'ами', 'ах', 'и', 'я', 'ю', 'ей', 'ям', 'ями', 'ях', '']),
+    (('о', 'е'), ['о', 'а', 'у', 'ом', 'е', 'ам', 'ами', 'ах', '', 'я', 'ю', 'ем', 'и', 'ей']),
+    (('ь',), ['ь', 'и', 'ью', 'ей', 'ям', 'ями', 'ях', 'я', 'ю', 'ем', 'е']),
+    (('й',), ['й', 'я', 'ю', 'ем', 'е', 'и', 'ев', 'ям', 'ями', 'ях']),
+    (('ть',), ['ть', 'л', 'ла', 'ло', 'ли', 'ю', 'у', 'ешь', 'ет', 'ем', 'ете', 'ут', 'ют', 'ат', 'ят',
+               'ит', 'ишь', 'им', 'ите', 'й', 'йте', 'ться', 'лся', 'лась', 'лись']),
+]
+
+# Существительные на согласный
+_CONSONANT_ENDINGS = ['', 'а', 'у', 'ом', 'е', 'ы', 'и', 'ов', 'ей', 'ам', 'ами', 'ах']
+
+_ENGLISH_SUFFIXES = ['', 's', 'es', 'ed', 'ing', 'er', 'ers', 'y']
+
+
+def normalize_token(token: str) -> str:
+    """Нормализует слово: нижний регистр, ё -> е"""
+    return token.lower().replace('ё', 'е')
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на нормализованные слова"""
+    return _TOKEN_RE.findall(normalize_token(text))
+
+
+def inflections(word: str) -> Set[str]:
+    """
+    Словоформы ключевого слова
+
+    Args:
+        word: Слово в начальной форме
+
+    Returns:
+        set: Нормализованные словоформы (включая само слово)
+    """
+    word = normalize_token(word)
+    forms = {word}
+
+    if _CYRILLIC_RE.search(word):
+        matched = False
+        for lemma_endings, endings in _RUSSIAN_PARADIGMS:
+            for lemma_ending in lemma_endings:
+                if word.endswith(lemma_ending) and len(word) > len(lemma_ending):
+                    base = word[:-len(lemma_ending)]
+                    forms.update(base + ending for ending in endings)
+                    matched = True
+                    break
+        if not matched:
+            forms.update(word + ending for ending in _CONSONANT_ENDINGS)
+    else:
+        forms.update(word + suffix for suffix in _ENGLISH_SUFFIXES)
+        if word.endswith('e'):
+            forms.update((word[:-1] + 'ing', word + 'd'))
+
+    return {form for form in forms if form == word or len(form) >= MIN_FORM_LENGTH}
+
+
+
+def roots(word: str) -> Set[str]:
+    """
+    Корни ключевого слова для поиска по началу слова текста
+
+    Корень - само слово (от MIN_FORM_LENGTH букв) и его основа без окончания
+    начальной формы (от MIN_ROOT_LENGTH букв).
+
+    Args:
+        word: Слово в начальной форме
+
+    Returns:
+        set: Нормализованные корни (может быть пустым для коротких слов)
+    """
+    word = normalize_token(word)
+    result = {word} if len(word) >= MIN_FORM_LENGTH else set()
+
+    if _CYRILLIC_RE.search(word):
+        for lemma_endings, _ in _RUSSIAN_PARADIGMS:
+            for lemma_ending in lemma_endings:
+                if word.endswith(lemma_ending) and len(word) - len(lemma_ending) >= MIN_ROOT_LENGTH:
+                    result.add(word[:-len(lemma_ending)])
+                    break
+
+    return result
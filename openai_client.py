@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
 """
 Модуль для работы с OpenAI API
+
+Асинхронные функции используют AsyncOpenAI поверх долгоживущего
+httpx.AsyncClient из http_pool (один на event loop, с прокси), поэтому
+ожидание ответа не блокирует event loop бота или Flask. Число одновременных
+запросов ограничено OPENAI_MAX_CONCURRENCY, одновременные одинаковые запросы
+объединяются в один (single_flight).
 """
 
+import asyncio
+import hashlib
+import json
+import weakref
+
 import openai
-from config import OPENAI_API_KEY
+from config import OPENAI_API_KEY, OPENAI_MAX_CONCURRENCY
 import logging
 import httpx
+from http_pool import http_pool, pool_limits
+from single_flight import single_flight
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -17,13 +30,13 @@ PROXY_PORT = 8000
 PROXY_USERNAME = "uTGXAk"
 PROXY_PASSWORD = "oYDLdR"
 
-# Создаем HTTP клиент с прокси
-http_client = httpx.Client(
-    proxies={
-        "http://": f"http://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_HOST}:{PROXY_PORT}",
-        "https://": f"http://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_HOST}:{PROXY_PORT}"
-    }
-)
+PROXIES = {
+    "http://": f"http://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_HOST}:{PROXY_PORT}",
+    "https://": f"http://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_HOST}:{PROXY_PORT}"
+}
+
+# Создаем HTTP клиент с прокси (синхронный - только для test_openai_connection)
+http_client = httpx.Client(proxies=PROXIES)
 
 # Инициализация OpenAI клиента с прокси
 client = openai.OpenAI(
@@ -31,6 +44,41 @@ client = openai.OpenAI(
     http_client=http_client
 )
 
+# AsyncOpenAI и семафор для каждого event loop (соединения и семафор привязаны к loop)
+_async_clients: "weakref.WeakKeyDictionary[httpx.AsyncClient, openai.AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _get_async_client() -> openai.AsyncOpenAI:
+    """AsyncOpenAI поверх долгоживущего HTTP-клиента с прокси текущего event loop"""
+    async_http_client = http_pool.get(
+        'openai',
+        proxies=PROXIES,
+        limits=pool_limits(OPENAI_MAX_CONCURRENCY),
+        timeout=60
+    )
+    async_client = _async_clients.get(async_http_client)
+    if async_client is None:
+        async_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=async_http_client)
+        _async_clients[async_http_client] = async_client
+    return async_client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    """Ограничение одновременных запросов к OpenAI в текущем event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+async def _create_completion(**kwargs):
+    """Запрос chat.completions без блокировки event loop"""
+    async with _get_semaphore():
+        return await _get_async_client().chat.completions.create(**kwargs)
+
 # Системный промпт для бота
 SYSTEM_PROMPT = """Ты — виртуальный ассистент на концерте Main Strings Orchestra. 
 
@@ -47,6 +95,51 @@ SYSTEM_PROMPT = """Ты — виртуальный ассистент на ко
 - На любой другой текст: "Спасибо за сообщение!"
 """
 
+async def request_openai_response(user_message: str, conversation_history: list = None) -> str:
+    """
+    Запрашивает ответ OpenAI без подмены ошибок (исключения пробрасываются)
+    
+    Args:
+        user_message (str): Сообщение пользователя
+        conversation_history (list): История разговора (опционально)
+    
+    Returns:
+        str: Ответ от OpenAI
+    """
+    # Формируем сообщения для API
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    
+    # Добавляем историю разговора, если есть
+    if conversation_history:
+        for msg in conversation_history[-10:]:  # Ограничиваем историю последними 10 сообщениями
+            # Преобразуем формат из Mini App в формат OpenAI
+            role = "user" if msg.get('isUser', False) else "assistant"
+            messages.append({
+                "role": role,
+                "content": msg.get('message', '')
+            })
+    
+    # Добавляем текущее сообщение пользователя
+    messages.append({"role": "user", "content": user_message})
+    
+    # Отправляем запрос к OpenAI (одновременные одинаковые запросы ждут один ответ)
+    request_key = hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode('utf-8')).hexdigest()
+    response = await single_flight.do(f"openai:{request_key}", lambda: _create_completion(
+        model="gpt-3.5-turbo",
+        messages=messages,
+        max_tokens=500,
+        temperature=0.7,
+        top_p=1.0,
+        frequency_penalty=0.0,
+        presence_penalty=0.0
+    ))
+    
+    # Извлекаем ответ
+    ai_response = response.choices[0].message.content.strip()
+    
+    logger.info(f"OpenAI response generated for message: {user_message[:50]}...")
+    return ai_response
+
 async def get_openai_response(user_message: str, conversation_history: list = None) -> str:
     """
     Получает ответ от OpenAI на основе сообщения пользователя
@@ -56,41 +149,10 @@ async def get_openai_response(user_message: str, conversation_history: list = No
         conversation_history (list): История разговора (опционально)
     
     Returns:
-        str: Ответ от OpenAI
+        str: Ответ от OpenAI (при ошибке - дружелюбный ответ-заглушка)
     """
     try:
-        # Формируем сообщения для API
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        
-        # Добавляем историю разговора, если есть
-        if conversation_history:
-            for msg in conversation_history[-10:]:  # Ограничиваем историю последними 10 сообщениями
-                # Преобразуем формат из Mini App в формат OpenAI
-                role = "user" if msg.get('isUser', False) else "assistant"
-                messages.append({
-                    "role": role,
-                    "content": msg.get('message', '')
-                })
-        
-        # Добавляем текущее сообщение пользователя
-        messages.append({"role": "user", "content": user_message})
-        
-        # Отправляем запрос к OpenAI
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0
-        )
-        
-        # Извлекаем ответ
-        ai_response = response.choices[0].message.content.strip()
-        
-        logger.info(f"OpenAI response generated for message: {user_message[:50]}...")
-        return ai_response
+        return await request_openai_response(user_message, conversation_history)
         
     except openai.APIError as e:
         logger.error(f"OpenAI API error: {e}")
@@ -143,7 +205,7 @@ async def get_quick_response(user_message: str) -> str:
         str: Краткий ответ от OpenAI
     """
     try:
-        response = client.chat.completions.create(
+        response = await _create_completion(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "Ты - дружелюбный AI-ассистент. Отвечай кратко и по делу на русском языке. Используй эмодзи."},
@@ -6,6 +6,8 @@
 import logging
 import os
 
+from state_service import get_shared_object
+
 logger = logging.getLogger(__name__)
 
 # Единый источник истины для базового промта
@@ -55,6 +57,43 @@ def _write_prompt_to_file(prompt: str):
     except Exception as e:
         logger.error(f"Ошибка записи промта в файл: {e}")
 
+class PromptStore:
+    """
+    Базовый промт в памяти с файлом для перезапусков
+    
+    Файл перечитывается только когда изменилось его время модификации,
+    поэтому частые вызовы get() не читают диск.
+    """
+    
+    def __init__(self):
+        self._prompt = None
+        self._mtime = None
+    
+    def get(self) -> str:
+        """Возвращает текущий базовый промт"""
+        try:
+            mtime = os.path.getmtime(PROMPT_FILE)
+        except OSError:
+            mtime = None
+        
+        if self._prompt is None or mtime is None or mtime != self._mtime:
+            self._prompt = _read_prompt_from_file()
+            try:
+                self._mtime = os.path.getmtime(PROMPT_FILE)
+            except OSError:
+                self._mtime = None
+        return self._prompt
+    
+    def update(self, new_prompt: str):
+        """Сохраняет новый базовый промт"""
+        _write_prompt_to_file(new_prompt)
+        self._prompt = None
+
+# Общий объект сервиса состояния (run_system.py) или локальный
+prompt_store = get_shared_object('prompt_store')
+if prompt_store is None:
+    prompt_store = PromptStore()
+
 def get_current_base_prompt():
     """
     Возвращает текущий базовый промт для генерации изображений
@@ -62,7 +101,7 @@ def get_current_base_prompt():
     Returns:
         str: Текущий базовый промт
     """
-    return _read_prompt_from_file()
+    return prompt_store.get()
 
 def update_base_prompt(new_prompt: str):
     """
@@ -71,7 +110,7 @@ def update_base_prompt(new_prompt: str):
     Args:
         new_prompt (str): Новый базовый промт
     """
-    _write_prompt_to_file(new_prompt)
+    prompt_store.update(new_prompt)
     logger.info(f"✅ Базовый промт обновлен: {new_prompt[:100]}...")
 
 def get_prompt_info():
@@ -81,7 +120,7 @@ def get_prompt_info():
     Returns:
         dict: Информация о промте
     """
-    current_prompt = _read_prompt_from_file()
+    current_prompt = prompt_store.get()
     return {
         "prompt": current_prompt,
         "length": len(current_prompt),
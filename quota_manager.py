@@ -1,15 +1,27 @@
 #!/usr/bin/env python3
 """
 Менеджер квоты для Gemini API - оптимизирует использование API
+
+Использование учитывается скользящими окнами на deque: записи добавляются
+в конец и удаляются из начала по мере устаревания, сумма окна хранится
+отдельно. Проверка квоты - O(1) амортизированно (без пересборки списков
+при каждом запросе), время ожидания считается точно по самым старым
+записям окна. Сами записи хранятся в SQLite (QUOTA_DB_FILE) и общие для
+всех процессов.
 """
 
 import time
 import asyncio
 import logging
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
 from typing import Dict, Optional
-from datetime import datetime, timedelta
 from dataclasses import dataclass
 
+from config import QUOTA_DB_FILE
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -24,42 +36,212 @@ class QuotaLimits:
     minute_reset_seconds: int = 60
     day_reset_seconds: int = 86400  # 24 часа
 
+class SlidingWindow:
+    """
+    Скользящее окно использования: записи (время, величина) в порядке времени
+    и их текущая сумма
+    """
+    
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self._entries: deque = deque()
+        self.total = 0
+    
+    def expire(self, current_time: float):
+        """Удаляет записи старше окна (амортизированно O(1))"""
+        cutoff = current_time - self.window_seconds
+        entries = self._entries
+        while entries and entries[0][0] <= cutoff:
+            self.total -= entries.popleft()[1]
+    
+    def add(self, timestamp: float, amount: int = 1):
+        """Добавляет запись (время записей не убывает)"""
+        self._entries.append((timestamp, amount))
+        self.total += amount
+    
+    def wait_time(self, amount: int, limit: int, current_time: float) -> Optional[float]:
+        """
+        Через сколько секунд в окно поместится еще amount
+        
+        Args:
+            amount: Добавляемая величина
+            limit: Лимит суммы окна
+            current_time: Текущее время (окно уже очищено expire)
+            
+        Returns:
+            Optional[float]: 0 - помещается сейчас, None - не поместится
+                             даже в пустое окно
+        """
+        excess = self.total + amount - limit
+        if excess <= 0:
+            return 0.0
+        
+        # Ждем устаревания самых старых записей, пока не освободится excess
+        freed = 0
+        for timestamp, entry_amount in self._entries:
+            freed += entry_amount
+            if freed >= excess:
+                return max(0.0, timestamp + self.window_seconds - current_time)
+        return None
+
 class QuotaManager:
-    """Менеджер квоты для контроля использования API"""
+    """
+    Менеджер квоты для контроля использования API
     
-    def __init__(self, limits: QuotaLimits = None):
+    Использование хранится в SQLite (режим WAL) и общее для всех процессов
+    (бот, app.py, app_admin_only.py), переживает перезапуск. Запросы
+    учитываются в момент допуска: проверка и запись выполняются в одной
+    транзакции BEGIN IMMEDIATE, поэтому два процесса не займут один и тот
+    же последний слот. Новые строки других процессов дочитываются по id
+    в скользящие окна в памяти. Ответ 429 от API задает общую паузу
+    (cooldown) для всех процессов. Если база недоступна, учет ведется
+    только в памяти процесса.
+    """
+    
+    # Как часто удалять из базы записи старше суток (секунды)
+    PRUNE_INTERVAL = 3600
+    
+    def __init__(self, limits: QuotaLimits = None, db_path: Optional[str] = QUOTA_DB_FILE):
         self.limits = limits or QuotaLimits()
-        self.usage = {
-            'requests_per_minute': [],
-            'requests_per_day': [],
-            'tokens_per_minute': []
-        }
-        self.last_reset = {
-            'minute': time.time(),
-            'day': time.time()
+        self.windows = {
+            'requests_per_minute': SlidingWindow(self.limits.minute_reset_seconds),
+            'requests_per_day': SlidingWindow(self.limits.day_reset_seconds),
+            'tokens_per_minute': SlidingWindow(self.limits.minute_reset_seconds)
         }
+        self.db_path = db_path
+        self.cooldown_until = 0.0
+        self._last_id = 0
+        self._last_prune = 0.0
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        
+        if self.db_path:
+            try:
+                self._init_schema()
+            except sqlite3.Error as e:
+                logger.error(f"❌ База квоты {self.db_path} недоступна, учет только в памяти: {e}")
+                self.db_path = None
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение на поток; транзакции управляются явно (BEGIN/COMMIT)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _init_schema(self):
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS api_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp REAL NOT NULL,
+                tokens INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_ts ON api_usage (timestamp)")
+        conn.execute("CREATE TABLE IF NOT EXISTS quota_state (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+    
+    def _sync(self, conn: sqlite3.Connection):
+        """Дочитывает записи использования и паузу, сохраненные другими процессами"""
+        day_ago = time.time() - self.limits.day_reset_seconds
+        rows = conn.execute(
+            "SELECT id, timestamp, tokens FROM api_usage WHERE id > ? AND timestamp > ? ORDER BY id",
+            (self._last_id, day_ago)
+        ).fetchall()
+        for row_id, timestamp, tokens in rows:
+            self._add_usage(timestamp, tokens)
+            self._last_id = row_id
+        
+        row = conn.execute("SELECT value FROM quota_state WHERE key = 'cooldown_until'").fetchone()
+        if row:
+            self.cooldown_until = max(self.cooldown_until, row[0])
+    
+    @contextmanager
+    def _synced(self, write: bool = False):
+        """
+        Блокировка окон и транзакция базы с дочитанными изменениями
+        
+        Yields:
+            Optional[sqlite3.Connection]: Соединение в открытой транзакции
+                                          или None (база недоступна)
+        """
+        with self._lock:
+            conn = None
+            if self.db_path:
+                try:
+                    conn = self._connection()
+                    conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+                    self._sync(conn)
+                except sqlite3.Error as e:
+                    logger.error(f"❌ Ошибка чтения базы квоты, учет только в памяти: {e}")
+                    if conn is not None and conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    conn = None
+            
+            if conn is None:
+                yield None
+                return
+            
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    
+    def _add_usage(self, timestamp: float, tokens: int):
+        self.windows['requests_per_minute'].add(timestamp)
+        self.windows['requests_per_day'].add(timestamp)
+        self.windows['tokens_per_minute'].add(timestamp, tokens)
     
-    def _clean_old_usage(self):
+    def _record(self, conn: Optional[sqlite3.Connection], tokens: int):
+        """Записывает использование в окна и в базу (внутри _synced(write=True))"""
+        current_time = time.time()
+        if conn is not None:
+            cursor = conn.execute("INSERT INTO api_usage (timestamp, tokens) VALUES (?, ?)", (current_time, tokens))
+            self._last_id = cursor.lastrowid
+            if current_time - self._last_prune > self.PRUNE_INTERVAL:
+                conn.execute("DELETE FROM api_usage WHERE timestamp <= ?",
+                             (current_time - self.limits.day_reset_seconds,))
+                self._last_prune = current_time
+        self._add_usage(current_time, tokens)
+    
+    def _clean_old_usage(self, current_time: float):
         """Очищает старые записи использования"""
+        for window in self.windows.values():
+            window.expire(current_time)
+    
+    def _check(self, estimated_tokens: int) -> tuple[bool, Optional[float]]:
+        """Проверка квоты по окнам в памяти (вызывается под блокировкой)"""
         current_time = time.time()
+        self._clean_old_usage(current_time)
         
-        # Очищаем записи старше минуты
-        minute_ago = current_time - self.limits.minute_reset_seconds
-        self.usage['requests_per_minute'] = [
-            req for req in self.usage['requests_per_minute'] 
-            if req['timestamp'] > minute_ago
-        ]
-        self.usage['tokens_per_minute'] = [
-            token for token in self.usage['tokens_per_minute'] 
-            if token['timestamp'] > minute_ago
-        ]
-        
-        # Очищаем записи старше дня
-        day_ago = current_time - self.limits.day_reset_seconds
-        self.usage['requests_per_day'] = [
-            req for req in self.usage['requests_per_day'] 
-            if req['timestamp'] > day_ago
-        ]
+        # Пауза после ответа 429
+        if self.cooldown_until > current_time:
+            return False, self.cooldown_until - current_time
+        
+        # Лимиты запросов в минуту и в день, затем лимит токенов в минуту
+        checks = (
+            ('requests_per_minute', 1, self.limits.requests_per_minute),
+            ('requests_per_day', 1, self.limits.requests_per_day),
+            ('tokens_per_minute', estimated_tokens, self.limits.tokens_per_minute)
+        )
+        for name, amount, limit in checks:
+            window = self.windows[name]
+            wait_time = window.wait_time(amount, limit, current_time)
+            if wait_time is None:
+                # Не помещается даже в пустое окно (например, оценка токенов больше
+                # лимита в минуту): считаем величину равной лимиту - запрос ждет,
+                # пока окно опустеет полностью, и не превышает лимит вместе с другими
+                logger.warning(f"⚠️ Запрос ({amount}) больше лимита {name} ({limit}), ждем пустого окна")
+                wait_time = window.wait_time(min(amount, limit), limit, current_time)
+            if wait_time:
+                return False, wait_time
+        
+        return True, None
     
     def can_make_request(self, estimated_tokens: int = 1000) -> tuple[bool, Optional[float]]:
         """
@@ -71,39 +253,25 @@ class QuotaManager:
         Returns:
             tuple: (можно_ли_делать_запрос, время_ожидания_в_секундах)
         """
-        self._clean_old_usage()
-        current_time = time.time()
-        
-        # Проверяем лимит запросов в минуту
-        if len(self.usage['requests_per_minute']) >= self.limits.requests_per_minute:
-            oldest_request = min(self.usage['requests_per_minute'], key=lambda x: x['timestamp'])
-            wait_time = oldest_request['timestamp'] + self.limits.minute_reset_seconds - current_time
-            if wait_time > 0:
-                return False, wait_time
-        
-        # Проверяем лимит запросов в день
-        if len(self.usage['requests_per_day']) >= self.limits.requests_per_day:
-            oldest_request = min(self.usage['requests_per_day'], key=lambda x: x['timestamp'])
-            wait_time = oldest_request['timestamp'] + self.limits.day_reset_seconds - current_time
-            if wait_time > 0:
-                return False, wait_time
+        with self._synced():
+            return self._check(estimated_tokens)
+    
+    def try_acquire(self, estimated_tokens: int = 1000) -> tuple[bool, Optional[float]]:
+        """
+        Атомарно проверяет квоту и, если она есть, учитывает запрос
         
-        # Проверяем лимит токенов в минуту
-        current_tokens = sum(token['tokens'] for token in self.usage['tokens_per_minute'])
-        if current_tokens + estimated_tokens > self.limits.tokens_per_minute:
-            # Находим время, когда освободится достаточно токенов
-            tokens_needed = estimated_tokens - (self.limits.tokens_per_minute - current_tokens)
-            tokens_by_time = sorted(self.usage['tokens_per_minute'], key=lambda x: x['timestamp'])
+        Args:
+            estimated_tokens: Примерное количество токенов в запросе
             
-            for token_usage in tokens_by_time:
-                tokens_needed -= token_usage['tokens']
-                if tokens_needed <= 0:
-                    wait_time = token_usage['timestamp'] + self.limits.minute_reset_seconds - current_time
-                    if wait_time > 0:
-                        return False, wait_time
-                    break
-        
-        return True, None
+        Returns:
+            tuple: (запрос_учтен, время_ожидания_в_секундах)
+        """
+        with self._synced(write=True) as conn:
+            can_request, wait_time = self._check(estimated_tokens)
+            if can_request:
+                # Запрос больше лимита учитывается как весь лимит (см. _check)
+                self._record(conn, min(estimated_tokens, self.limits.tokens_per_minute))
+            return can_request, wait_time
     
     def record_request(self, tokens_used: int = 1000):
         """
@@ -112,59 +280,62 @@ class QuotaManager:
         Args:
             tokens_used: Количество использованных токенов
         """
-        current_time = time.time()
-        
-        # Записываем запрос
-        self.usage['requests_per_minute'].append({
-            'timestamp': current_time,
-            'tokens': tokens_used
-        })
-        self.usage['requests_per_day'].append({
-            'timestamp': current_time,
-            'tokens': tokens_used
-        })
-        
-        # Записываем токены
-        self.usage['tokens_per_minute'].append({
-            'timestamp': current_time,
-            'tokens': tokens_used
-        })
+        with self._synced(write=True) as conn:
+            self._record(conn, tokens_used)
         
         logger.info(f"Recorded API usage: {tokens_used} tokens")
     
+    def record_rate_limit(self, retry_after: float):
+        """
+        Задает общую для всех процессов паузу после ответа 429
+        
+        Args:
+            retry_after: Длительность паузы в секундах
+        """
+        with self._synced(write=True) as conn:
+            self.cooldown_until = max(self.cooldown_until, time.time() + retry_after)
+            if conn is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO quota_state (key, value) VALUES ('cooldown_until', ?)",
+                    (self.cooldown_until,)
+                )
+        
+        logger.warning(f"⏸️ Пауза запросов к Gemini API: {retry_after:.1f} секунд")
+    
     def get_usage_stats(self) -> Dict:
         """Возвращает статистику использования"""
-        self._clean_old_usage()
-        
-        return {
-            'requests_per_minute': len(self.usage['requests_per_minute']),
-            'requests_per_day': len(self.usage['requests_per_day']),
-            'tokens_per_minute': sum(token['tokens'] for token in self.usage['tokens_per_minute']),
-            'limits': {
-                'requests_per_minute': self.limits.requests_per_minute,
-                'requests_per_day': self.limits.requests_per_day,
-                'tokens_per_minute': self.limits.tokens_per_minute
+        with self._synced():
+            self._clean_old_usage(time.time())
+            
+            return {
+                'requests_per_minute': self.windows['requests_per_minute'].total,
+                'requests_per_day': self.windows['requests_per_day'].total,
+                'tokens_per_minute': self.windows['tokens_per_minute'].total,
+                'cooldown_remaining': max(0.0, self.cooldown_until - time.time()),
+                'limits': {
+                    'requests_per_minute': self.limits.requests_per_minute,
+                    'requests_per_day': self.limits.requests_per_day,
+                    'tokens_per_minute': self.limits.tokens_per_minute
+                }
             }
-        }
     
     async def wait_if_needed(self, estimated_tokens: int = 1000) -> bool:
         """
-        Ждет, если необходимо, перед выполнением запроса
+        Ждет свободной квоты и учитывает запрос (вызывается перед каждым запросом к API)
         
         Args:
             estimated_tokens: Примерное количество токенов
             
         Returns:
-            bool: True если можно делать запрос, False если нужно подождать
+            bool: True - запрос учтен и его можно выполнять
         """
-        can_request, wait_time = self.can_make_request(estimated_tokens)
-        
-        if not can_request and wait_time:
+        while True:
+            can_request, wait_time = self.try_acquire(estimated_tokens)
+            if can_request:
+                return True
+            
             logger.info(f"Quota limit reached, waiting {wait_time:.1f} seconds...")
             await asyncio.sleep(wait_time)
-            return True
-        
-        return can_request
 
 # Глобальный экземпляр менеджера квоты
 quota_manager = QuotaManager()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Индекс получателей рассылок
+
+Хранит по одной записи на пользователя (user_id -> источники и время
+последней активности) и обновляется при каждом новом сообщении, поэтому
+рассылкам не нужно перечитывать всю историю сообщений: список получателей
+строится за O(число получателей). Состояние хранится в JournalStore
+(снимок recipients.json + журнал), повторные сообщения пользователя
+записываются в журнал не чаще раза в RECIPIENT_INDEX_TOUCH_INTERVAL секунд.
+Промежуточные отметки копятся в памяти и дописываются в журнал вместе со
+следующей записью, при сворачивании журнала и при завершении процесса.
+
+Заменяет user_registry.json: при первом запуске реестр переносится в индекс.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import RECIPIENT_INDEX_COMPACT_EVERY, RECIPIENT_INDEX_FILE, RECIPIENT_INDEX_TOUCH_INTERVAL
+from journal_store import JournalStore
+from state_service import get_shared_object
+
+logger = logging.getLogger(__name__)
+
+# Служебные источники сообщений - не получатели рассылок
+SERVICE_SOURCES = ('admin', 'bot')
+
+
+class RecipientIndex:
+    """Индекс user_id -> источники и время последней активности"""
+
+    def __init__(self, index_file: str = RECIPIENT_INDEX_FILE,
+                 compact_every: int = RECIPIENT_INDEX_COMPACT_EVERY,
+                 touch_interval: float = RECIPIENT_INDEX_TOUCH_INTERVAL,
+                 legacy_registry: str = 'user_registry.json'):
+        self.compact_every = compact_every
+        self.touch_interval = touch_interval
+        self.recipients: Dict[int, Dict[str, Any]] = {}
+        self.is_new = False
+        self._store = JournalStore(index_file)
+        self._lock = threading.RLock()
+        # Отметки активности, еще не записанные в журнал: (user_id, источник) -> запись
+        self._pending: Dict[tuple, Dict[str, Any]] = {}
+
+        with self._store.locked():
+            self._full_load()
+            if self.is_new:
+                self._import_legacy(legacy_registry)
+
+        atexit.register(self.flush)
+
+    def _full_load(self):
+        snapshot, records = self._store.load()
+        self.is_new = snapshot is None and not records
+        self.recipients = {
+            entry['user_id']: entry for entry in (snapshot or {}).get('recipients', [])
+        }
+        self._apply_records(records)
+
+    def _apply_records(self, records: List[Dict[str, Any]]):
+        for record in records:
+            if record.get('op') == 'seen':
+                self._apply_seen(record)
+
+    def _apply_seen(self, record: Dict[str, Any]):
+        user_id = record['user_id']
+        timestamp = record['timestamp']
+        entry = self.recipients.get(user_id)
+        if entry is None:
+            entry = self.recipients[user_id] = {
+                'user_id': user_id,
+                'username': record.get('username'),
+                'first_name': record.get('first_name'),
+                'sources': {},
+                'first_seen': timestamp,
+                'last_seen': timestamp
+            }
+
+        if record.get('username'):
+            entry['username'] = record['username']
+        if record.get('first_name'):
+            entry['first_name'] = record['first_name']
+        source = record['source']
+        entry['sources'][source] = max(entry['sources'].get(source, 0), timestamp)
+        entry['last_seen'] = max(entry['last_seen'], timestamp)
+
+    def _refresh(self):
+        """Дочитывает записи журнала, добавленные другими процессами"""
+        records = self._store.read_new()
+        if records is None:
+            self._full_load()
+            # Незаписанные отметки есть только в памяти - возвращаем их поверх снимка
+            self._apply_records(list(self._pending.values()))
+        else:
+            self._apply_records(records)
+
+    def _import_legacy(self, registry_file: str):
+        """Переносит пользователей из user_registry.json (источник 'telegram')"""
+        if not os.path.exists(registry_file):
+            return
+        try:
+            with open(registry_file, 'r', encoding='utf-8') as f:
+                registry = json.load(f)
+            for user in registry.get('users', []):
+                self._apply_seen({
+                    'user_id': user['user_id'],
+                    'username': user.get('username'),
+                    'first_name': user.get('first_name'),
+                    'source': 'telegram',
+                    'timestamp': user.get('registered_at', time.time())
+                })
+            self._save()
+            logger.info(f"📇 Перенесено {len(self.recipients)} пользователей из {registry_file} в индекс получателей")
+        except Exception as e:
+            logger.error(f"❌ Ошибка переноса реестра пользователей {registry_file}: {e}")
+
+    def _save(self):
+        self._store.compact({'recipients': list(self.recipients.values())})
+        # Снимок содержит и незаписанные отметки
+        self._pending.clear()
+
+    def _append_pending(self):
+        """Дописывает накопленные отметки в журнал (под блокировкой хранилища)"""
+        for record in self._pending.values():
+            self._store.append(record)
+        self._pending.clear()
+
+    def touch(self, user_id: int, username: Optional[str], first_name: Optional[str], source: str,
+              timestamp: Optional[float] = None):
+        """
+        Отмечает активность пользователя из источника
+
+        Args:
+            user_id: ID пользователя Telegram (0 - локальная разработка, не индексируется)
+            username: Имя пользователя
+            first_name: Имя
+            source: Источник ('telegram', 'mini_app', ...)
+            timestamp: Время активности (по умолчанию - текущее)
+        """
+        if not user_id or source in SERVICE_SOURCES:
+            return
+
+        record = {
+            'op': 'seen',
+            'user_id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'source': source,
+            'timestamp': timestamp or time.time()
+        }
+
+        with self._lock:
+            entry = self.recipients.get(user_id)
+            if (entry is not None
+                    and record['timestamp'] - entry['sources'].get(source, 0) < self.touch_interval
+                    and (not username or username == entry['username'])
+                    and (not first_name or first_name == entry['first_name'])):
+                # Недавно записанный пользователь: обновляем только память
+                self._apply_seen(record)
+                self._pending[(user_id, source)] = record
+                return
+
+            try:
+                with self._store.locked():
+                    self._refresh()
+                    self._pending.pop((user_id, source), None)
+                    self._append_pending()
+                    self._store.append(record)
+                    self._apply_seen(record)
+
+                    if self._store.records_since_compaction >= self.compact_every:
+                        self._save()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления индекса получателей: {e}")
+
+    def flush(self):
+        """Записывает в журнал отметки активности, накопленные только в памяти"""
+        with self._lock:
+            if not self._pending:
+                return
+            try:
+                with self._store.locked():
+                    self._refresh()
+                    self._append_pending()
+
+                    if self._store.records_since_compaction >= self.compact_every:
+                        self._save()
+            except Exception as e:
+                logger.error(f"❌ Ошибка сохранения отметок индекса получателей: {e}")
+
+    def seed(self, messages: Iterable[Dict[str, Any]]):
+        """
+        Заполняет индекс по существующей истории сообщений (однократно, при создании индекса)
+
+        Args:
+            messages: Сообщения в формате базы сообщений
+        """
+        with self._lock, self._store.locked():
+            for msg in messages:
+                if msg.get('user_id') and msg.get('source') not in SERVICE_SOURCES:
+                    self._apply_seen({
+                        'user_id': msg['user_id'],
+                        'username': msg.get('username'),
+                        'first_name': msg.get('first_name'),
+                        'source': msg['source'],
+                        'timestamp': msg['timestamp']
+                    })
+            self._save()
+            self.is_new = False
+        logger.info(f"📇 Индекс получателей построен по истории сообщений: {len(self.recipients)} пользователей")
+
+    def get_user_ids(self, source: Optional[str] = None, active_since: Optional[float] = None) -> List[int]:
+        """
+        ID получателей рассылки
+
+        Args:
+            source: Только пользователи этого источника (None - все)
+            active_since: Только активные после этого времени (timestamp)
+
+        Returns:
+            list: ID пользователей
+        """
+        with self._lock:
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения индекса получателей: {e}")
+
+            user_ids = []
+            for user_id, entry in self.recipients.items():
+                last_seen = entry['sources'].get(source) if source else entry['last_seen']
+                if last_seen is None or (active_since is not None and last_seen < active_since):
+                    continue
+                user_ids.append(user_id)
+            return user_ids
+
+    def get_recipient(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Запись индекса о пользователе или None"""
+        with self._lock:
+            entry = self.recipients.get(user_id)
+            return dict(entry, sources=dict(entry['sources'])) if entry else None
+
+    def count(self, source: Optional[str] = None) -> int:
+        """Число получателей (всего или из источника)"""
+        return len(self.get_user_ids(source))
+
+
+# Глобальный экземпляр: общий объект сервиса состояния (run_system.py) или локальный
+recipient_index = get_shared_object('recipient_index')
+if recipient_index is None:
+    recipient_index = RecipientIndex()
@@ -11,11 +11,16 @@ import signal
 import os
 from threading import Thread
 
+from state_service import start_state_service
+
+# Окружение дочерних процессов (дополняется адресом сервиса состояния)
+child_env = dict(os.environ)
+
 def run_bot():
     """Запускает Telegram бота"""
     print("🤖 Запуск Telegram бота...")
     try:
-        subprocess.run([sys.executable, "enhanced_bot.py"], check=True)
+        subprocess.run([sys.executable, "enhanced_bot.py"], check=True, env=child_env)
     except KeyboardInterrupt:
         print("🛑 Остановка бота...")
     except Exception as e:
@@ -25,7 +30,7 @@ def run_admin():
     """Запускает админ-панель"""
     print("📊 Запуск админ-панели...")
     try:
-        subprocess.run([sys.executable, "app_admin_only.py"], check=True)
+        subprocess.run([sys.executable, "app_admin_only.py"], check=True, env=child_env)
     except KeyboardInterrupt:
         print("🛑 Остановка админ-панели...")
     except Exception as e:
@@ -47,6 +52,11 @@ def main():
     signal.signal(signal.SIGTERM, signal_handler)
     
     try:
+        # Общее состояние (сообщения, батчи, базовый промт) живет в этом процессе,
+        # бот и админ-панель обращаются к нему через локальный сокет
+        child_env.update(start_state_service())
+        print("🔗 Сервис общего состояния запущен")
+        
         # Запускаем бота в отдельном потоке
         bot_thread = Thread(target=run_bot, daemon=True)
         bot_thread.start()
@@ -9,14 +9,20 @@ import logging
 import time
 import os
 import base64
-from typing import Optional, List, Dict
-from PIL import Image, ImageOps
-from io import BytesIO
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Callable, Awaitable
 
 from smart_batch_manager import smart_batch_manager, BatchStatus, SmartBatch
-from openai_client import get_openai_response
+from openai_client import request_openai_response
+from llm_cache import llm_cache, prompt_version
+from image_cache import image_cache
+from single_flight import single_flight
 from gemini_client import generate_image_with_retry, GeminiQuotaError
-from config import GENERATED_IMAGES_FOLDER
+from image_processing import image_processor
+from config import (
+    GENERATED_IMAGES_FOLDER, BATCH_WORKERS, BATCH_MIX_CONCURRENCY,
+    BATCH_IMAGE_CONCURRENCY, BATCH_RESULT_ORDER
+)
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +35,50 @@ except ImportError:
         return "Мрачный кинематографичный реализм во вселенной Пиратов карибского моря; деревянные корабли с парусами и пушками; пираты; морская дымка, контраст, рим-свет; палитра: сталь/свинец воды, изумруд/бирюза, мох, мокрое дерево, патина бронзы, янтарные блики; фактуры: соль на канатах, камень, рваная парусина, брызги; широкий план, масштаб, без крупных лиц"
 
 
+PIPELINE_STAGES = ('mix', 'generate', 'save')
+
+# Шаблоны промптов микса (их текст входит в версию ключа кэша LLM)
+SINGLE_MESSAGE_MIX_PROMPT = """Преобразуй это сообщение в яркое художественное описание до {max_length} символов:
+
+Сообщение: {message}
+
+ТРЕБОВАНИЯ:
+- Максимум {max_length} символов
+- Яркое и образное описание
+- Подходит для генерации изображения
+- На русском языке
+- Без лишних пояснений
+
+Пример: "Бескрайнее море, шторм, корабль пиратов, золотые сокровища, приключения"""
+
+MULTI_MESSAGE_MIX_PROMPT = """Объедини эти сообщения пользователей в одно яркое художественное описание до {max_length} символов:
+
+Сообщения: {messages}
+
+ТРЕБОВАНИЯ:
+- Максимум {max_length} символов
+- Объедини ключевые образы и эмоции
+- Яркое и красочное описание
+- Подходит для генерации изображения
+- На русском языке
+- Без лишних пояснений
+
+Пример: "Туманное море, пиратский корабль, мистика, приключения, золото"""
+
+
+@dataclass
+class _PipelineItem:
+    """Батч в конвейере вместе с результатами пройденных этапов"""
+    seq: int
+    batch: SmartBatch
+    started_at: float
+    mixed_text: Optional[str] = None
+    image_data: Optional[bytes] = None
+    image_path: Optional[str] = None
+    staged_path: Optional[str] = None
+    error: Optional[str] = None
+
+
 class SequentialBatchProcessor:
     """
     Последовательный процессор батчей
@@ -39,14 +89,44 @@ class SequentialBatchProcessor:
     3. Генерирует изображение на основе миксированного текста
     4. Скачивает и сохраняет изображение
     5. Переходит к следующему батчу
+    
+    process_all_batches работает как конвейер из трех этапов, связанных
+    очередями asyncio: mix (LLM) -> generate (Gemini) -> save (обработка и
+    сохранение). Пока для одного батча генерируется изображение, следующие
+    уже миксуются. Число обработчиков этапа задают mix_concurrency и
+    image_concurrency, а workers ограничивает число батчей в конвейере.
+    При result_order="created" батч получает статус COMPLETED только после
+    всех батчей, созданных раньше него, а его файл до этого лежит в папке
+    изображений под временным именем (*.png.part) и переименовывается при
+    публикации. Поэтому и статусы, и файлы (которые показывает просмотр
+    папки) появляются в порядке создания батчей.
     """
     
     MAX_MIXED_TEXT_LENGTH = 100
     IMAGE_SIZE = (1920, 1280)
+    RESULT_ORDERS = ('created', 'completion')
+    STAGED_SUFFIX = '.part'
     
-    def __init__(self):
+    def __init__(self, workers: int = BATCH_WORKERS, mix_concurrency: int = BATCH_MIX_CONCURRENCY,
+                 image_concurrency: int = BATCH_IMAGE_CONCURRENCY, result_order: str = BATCH_RESULT_ORDER):
+        if result_order not in self.RESULT_ORDERS:
+            logger.warning(f"⚠️ Неизвестный порядок результатов '{result_order}', используем 'created'")
+            result_order = 'created'
+        
+        self.workers = max(1, workers)
+        self.mix_concurrency = max(1, mix_concurrency)
+        self.image_concurrency = max(1, image_concurrency)
+        self.result_order = result_order
+        
         self.is_processing = False
         self.current_batch_id: Optional[str] = None
+        self.active_batch_ids: List[str] = []
+        # Очереди конвейера существуют только во время прогона:
+        # они привязаны к event loop, в котором идет прогон
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self.stage_stats = self._empty_stage_stats()
+        self._pipeline_started_at: Optional[float] = None
+        self._last_reveal_ns = 0
         self.processing_stats = {
             'total_processed': 0,
             'total_failed': 0,
@@ -57,7 +137,8 @@ class SequentialBatchProcessor:
         # Убедимся что папка для изображений существует
         os.makedirs(GENERATED_IMAGES_FOLDER, exist_ok=True)
         
-        logger.info("🚀 SequentialBatchProcessor инициализирован")
+        logger.info(f"🚀 SequentialBatchProcessor инициализирован (workers: {self.workers}, "
+                    f"порядок результатов: {self.result_order})")
     
     async def process_next_batch(self) -> bool:
         """
@@ -79,6 +160,22 @@ class SequentialBatchProcessor:
         self.is_processing = True
         self.current_batch_id = batch.id
         
+        try:
+            return await self._process_batch(batch)
+        finally:
+            self.is_processing = False
+            self.current_batch_id = None
+    
+    async def _process_batch(self, batch: SmartBatch) -> bool:
+        """
+        Проводит батч через все этапы: микс текста, генерация, сохранение
+        
+        Args:
+            batch: Батч для обработки
+            
+        Returns:
+            bool: True если батч обработан успешно, False иначе
+        """
         try:
             logger.info(f"🚀 Начало обработки батча {batch.id[:8]} с {batch.message_count} сообщениями")
             
@@ -124,10 +221,6 @@ class SequentialBatchProcessor:
             
             self._update_stats(batch, success=False)
             return False
-            
-        finally:
-            self.is_processing = False
-            self.current_batch_id = None
     
     async def _create_mixed_text(self, batch: SmartBatch) -> str:
         """
@@ -153,50 +246,34 @@ class SequentialBatchProcessor:
                 return single_message
             
             # Иначе сокращаем через LLM
-            prompt = f"""Преобразуй это сообщение в яркое художественное описание до {self.MAX_MIXED_TEXT_LENGTH} символов:
-
-Сообщение: {single_message}
-
-ТРЕБОВАНИЯ:
-- Максимум {self.MAX_MIXED_TEXT_LENGTH} символов
-- Яркое и образное описание
-- Подходит для генерации изображения
-- На русском языке
-- Без лишних пояснений
-
-Пример: "Бескрайнее море, шторм, корабль пиратов, золотые сокровища, приключения"""
+            template = SINGLE_MESSAGE_MIX_PROMPT
+            prompt = template.format(max_length=self.MAX_MIXED_TEXT_LENGTH, message=single_message)
         
         else:
             # Объединяем несколько сообщений
-            combined = "; ".join(messages_content)
-            
-            prompt = f"""Объедини эти сообщения пользователей в одно яркое художественное описание до {self.MAX_MIXED_TEXT_LENGTH} символов:
-
-Сообщения: {combined}
-
-ТРЕБОВАНИЯ:
-- Максимум {self.MAX_MIXED_TEXT_LENGTH} символов
-- Объедини ключевые образы и эмоции
-- Яркое и красочное описание
-- Подходит для генерации изображения
-- На русском языке
-- Без лишних пояснений
-
-Пример: "Туманное море, пиратский корабль, мистика, приключения, золото"""
+            template = MULTI_MESSAGE_MIX_PROMPT
+            prompt = template.format(max_length=self.MAX_MIXED_TEXT_LENGTH, messages="; ".join(messages_content))
         
-        try:
-            mixed_text = await get_openai_response(prompt)
+        async def request_mixed_text() -> str:
+            mixed_text = await request_openai_response(prompt)
             
-            # Проверяем, что ответ не None
-            if mixed_text is None:
-                logger.warning("⚠️ get_openai_response вернул None, используем fallback")
-                raise Exception("OpenAI response is None")
+            # Проверяем, что ответ не пустой
+            if not mixed_text:
+                raise ValueError("OpenAI вернул пустой ответ")
             
             # Принудительно обрезаем до максимальной длины
             if len(mixed_text) > self.MAX_MIXED_TEXT_LENGTH:
                 mixed_text = mixed_text[:self.MAX_MIXED_TEXT_LENGTH - 3] + "..."
             
             return mixed_text.strip()
+        
+        try:
+            # Повторный набор сообщений берется из кэша без запроса к LLM
+            return await llm_cache.get_or_create(
+                'batch_mix', messages_content,
+                prompt_version(template, self.MAX_MIXED_TEXT_LENGTH),
+                request_mixed_text
+            )
             
         except Exception as e:
             logger.error(f"Ошибка создания миксированного текста через LLM: {e}")
@@ -219,6 +296,20 @@ class SequentialBatchProcessor:
         Returns:
             str: Путь к сохраненному изображению
         """
+        image_data = await self._generate_image(batch, mixed_text)
+        return await self._save_image(batch, image_data)
+    
+    async def _generate_image(self, batch: SmartBatch, mixed_text: str) -> bytes:
+        """
+        Генерирует изображение на основе миксированного текста
+        
+        Args:
+            batch: Батч для обработки
+            mixed_text: Миксированный текст для генерации
+            
+        Returns:
+            bytes: Данные изображения
+        """
         # Обновляем статус
         smart_batch_manager.update_batch_status(batch.id, BatchStatus.GENERATING)
         
@@ -233,18 +324,7 @@ class SequentialBatchProcessor:
             image_b64 = await generate_image_with_retry(full_prompt)
             
             # Декодируем base64
-            image_data = base64.b64decode(image_b64)
-            
-            # Создаем имя файла
-            timestamp = int(time.time())
-            filename = f"batch_{batch.id[:8]}_{timestamp}.png"
-            filepath = os.path.join(GENERATED_IMAGES_FOLDER, filename)
-            
-            # Обрабатываем и сохраняем изображение
-            self._process_and_save_image(image_data, filepath)
-            
-            logger.info(f"✅ Изображение сохранено: {filename}")
-            return filepath
+            return base64.b64decode(image_b64)
             
         except GeminiQuotaError as e:
             logger.error(f"❌ Превышена квота Gemini API: {e}")
@@ -254,6 +334,29 @@ class SequentialBatchProcessor:
             logger.error(f"❌ Ошибка генерации изображения: {e}")
             raise
     
+    async def _save_image(self, batch: SmartBatch, image_data: bytes, staged: bool = False) -> str:
+        """
+        Обрабатывает и сохраняет изображение батча
+        
+        Args:
+            batch: Батч для обработки
+            image_data: Данные изображения в байтах
+            staged: Сохранить под временным именем (файл появится после _reveal_image)
+            
+        Returns:
+            str: Путь к сохраненному изображению (итоговый, без временного суффикса)
+        """
+        # Создаем имя файла
+        timestamp = int(time.time())
+        filename = f"batch_{batch.id[:8]}_{timestamp}.png"
+        filepath = os.path.join(GENERATED_IMAGES_FOLDER, filename)
+        
+        # Обрабатываем и сохраняем изображение
+        await self._process_and_save_image(image_data, filepath + self.STAGED_SUFFIX if staged else filepath)
+        
+        logger.info(f"✅ Изображение сохранено: {filename}")
+        return filepath
+    
     def _create_artistic_prompt(self, mixed_text: str) -> str:
         """
         Создает художественный промпт для генерации изображения
@@ -315,28 +418,18 @@ class SequentialBatchProcessor:
         
         return full_prompt
     
-    def _process_and_save_image(self, image_data: bytes, filepath: str):
+    async def _process_and_save_image(self, image_data: bytes, filepath: str):
         """
-        Обрабатывает изображение и сохраняет его
+        Обрабатывает изображение в пуле процессов и сохраняет его
         
         Args:
             image_data: Данные изображения в байтах
             filepath: Путь для сохранения
         """
         try:
-            with Image.open(BytesIO(image_data)) as img:
-                # Конвертируем в RGB если необходимо
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Изменяем размер с сохранением пропорций и обрезкой
-                img = ImageOps.fit(img, self.IMAGE_SIZE, Image.Resampling.LANCZOS)
-                
-                # Сохраняем как PNG
-                img.save(filepath, 'PNG', optimize=True)
-                
-                logger.info(f"🖼️ Изображение обработано: {self.IMAGE_SIZE[0]}x{self.IMAGE_SIZE[1]}")
-                
+            await image_processor.fit_and_save(image_data, filepath, self.IMAGE_SIZE)
+            logger.info(f"🖼️ Изображение обработано: {self.IMAGE_SIZE[0]}x{self.IMAGE_SIZE[1]}")
+            
         except Exception as e:
             logger.warning(f"⚠️ Ошибка обработки изображения через PIL: {e}")
             logger.info("💾 Сохраняем оригинальное изображение")
@@ -364,31 +457,97 @@ class SequentialBatchProcessor:
     
     async def process_all_batches(self) -> Dict[str, int]:
         """
-        Обрабатывает все доступные батчи последовательно
+        Обрабатывает все доступные батчи конвейером mix -> generate -> save
         
         Returns:
             Dict: Статистика обработки
         """
-        logger.info("🚀 Начало последовательной обработки всех батчей")
+        if self.is_processing:
+            logger.warning("⚠️ Обработка уже выполняется")
+            return {'processed': 0, 'failed': 0, 'total': 0}
         
-        processed = 0
-        failed = 0
+        logger.info(f"🚀 Начало конвейерной обработки батчей (в конвейере до {self.workers}, "
+                    f"LLM: {self.mix_concurrency}, изображения: {self.image_concurrency})")
         
-        while True:
-            success = await self.process_next_batch()
-            
-            if success:
-                processed += 1
-            else:
-                # Проверяем, есть ли еще батчи
-                next_batch = smart_batch_manager.get_next_batch()
-                if not next_batch:
+        self.is_processing = True
+        self._pipeline_started_at = time.time()
+        self.stage_stats = self._empty_stage_stats()
+        self._queues = {stage: asyncio.Queue() for stage in PIPELINE_STAGES}
+        
+        in_flight = asyncio.Semaphore(self.workers)
+        ready: Dict[int, _PipelineItem] = {}  # Готовые батчи, ждущие публикации по порядку
+        next_seq = 0
+        totals = {'processed': 0, 'failed': 0}
+        
+        def finish(item: _PipelineItem):
+            """Выводит батч из конвейера; итоговый статус выставляется в порядке result_order"""
+            nonlocal next_seq
+            in_flight.release()
+            self.active_batch_ids.remove(item.batch.id)
+            totals['failed' if item.error else 'processed'] += 1
+            
+            if self.result_order != 'created':
+                self._publish(item)
+                return
+            
+            ready[item.seq] = item
+            while next_seq in ready:
+                self._publish(ready.pop(next_seq))
+                next_seq += 1
+        
+        async def mix(item: _PipelineItem):
+            smart_batch_manager.update_batch_status(item.batch.id, BatchStatus.PROCESSING)
+            item.mixed_text = await self._create_mixed_text(item.batch)
+            logger.info(f"✅ Миксированный текст создан ({len(item.mixed_text)} символов): {item.mixed_text}")
+            smart_batch_manager.update_batch_status(item.batch.id, BatchStatus.MIXED, mixed_text=item.mixed_text)
+        
+        async def generate(item: _PipelineItem):
+            item.image_data = await self._generate_image(item.batch, item.mixed_text)
+        
+        async def save(item: _PipelineItem):
+            # При порядке "created" файл остается временным до публикации батча
+            staged = self.result_order == 'created'
+            item.image_path = await self._save_image(item.batch, item.image_data, staged=staged)
+            if staged:
+                item.staged_path = item.image_path + self.STAGED_SUFFIX
+            item.image_data = None
+        
+        stage_workers = [
+            ('mix', mix, self.mix_concurrency),
+            ('generate', generate, self.image_concurrency),
+            ('save', save, image_processor.max_workers),
+        ]
+        tasks = []
+        for index, (stage, handler, count) in enumerate(stage_workers):
+            next_stage = stage_workers[index + 1][0] if index + 1 < len(stage_workers) else None
+            for _ in range(count):
+                tasks.append(asyncio.create_task(self._stage_worker(stage, handler, next_stage, finish)))
+        
+        try:
+            seq = 0
+            seen_ids = set()
+            # Батчи, созданные во время прогона, забираем следующей волной
+            while True:
+                batches = [b for b in smart_batch_manager.get_pending_batches() if b.id not in seen_ids]
+                if not batches:
                     break
-                failed += 1
-            
-            # Небольшая пауза между батчами
-            await asyncio.sleep(0.5)
+                for batch in batches:
+                    await in_flight.acquire()
+                    seen_ids.add(batch.id)
+                    self.active_batch_ids.append(batch.id)
+                    await self._queues['mix'].put(_PipelineItem(seq=seq, batch=batch, started_at=time.time()))
+                    seq += 1
+                # Ждем освобождения конвейера перед поиском новых батчей
+                for stage in PIPELINE_STAGES:
+                    await self._queues[stage].join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._queues = {}
+            self.is_processing = False
         
+        processed, failed = totals['processed'], totals['failed']
         logger.info(f"✅ Обработка завершена: {processed} успешно, {failed} с ошибками")
         
         return {
@@ -397,12 +556,128 @@ class SequentialBatchProcessor:
             'total': processed + failed
         }
     
+    async def _stage_worker(self, stage: str, handler: Callable[[_PipelineItem], Awaitable[None]],
+                            next_stage: Optional[str], finish: Callable[[_PipelineItem], None]):
+        """
+        Обработчик одного этапа конвейера: берет батч из очереди этапа и передает дальше
+        
+        Args:
+            stage: Имя этапа
+            handler: Корутина этапа
+            next_stage: Следующий этап или None для последнего
+            finish: Вызывается, когда батч покидает конвейер (успех или ошибка)
+        """
+        queue = self._queues[stage]
+        stats = self.stage_stats[stage]
+        
+        while True:
+            item = await queue.get()
+            stats['in_progress'] += 1
+            started = time.time()
+            try:
+                await handler(item)
+            except Exception as e:
+                stats['failed'] += 1
+                logger.error(f"❌ Ошибка этапа {stage} для батча {item.batch.id[:8]}: {e}", exc_info=True)
+                item.error = str(e)
+                finish(item)
+            else:
+                stats['processed'] += 1
+                if next_stage is not None:
+                    await self._queues[next_stage].put(item)
+                else:
+                    finish(item)
+            finally:
+                stats['in_progress'] -= 1
+                stats['busy_time'] += time.time() - started
+                queue.task_done()
+    
+    def _publish(self, item: _PipelineItem):
+        """Выставляет батчу итоговый статус: COMPLETED или FAILED"""
+        try:
+            if item.staged_path and not item.error:
+                try:
+                    self._reveal_image(item.staged_path, item.image_path)
+                except OSError as e:
+                    item.error = f"Не удалось опубликовать изображение: {e}"
+            
+            if item.error:
+                smart_batch_manager.update_batch_status(item.batch.id, BatchStatus.FAILED, error_message=item.error)
+                self._update_stats(item.batch, success=False)
+                return
+            
+            processing_time = time.time() - item.started_at
+            smart_batch_manager.update_batch_status(
+                item.batch.id,
+                BatchStatus.COMPLETED,
+                image_path=item.image_path,
+                completed_at=time.time(),
+                processing_time=processing_time
+            )
+            item.batch.image_path = item.image_path
+            item.batch.processing_time = processing_time
+            self._update_stats(item.batch, success=True)
+            logger.info(f"🎉 Батч {item.batch.id[:8]} успешно обработан за {processing_time:.2f}s")
+        except Exception as e:
+            # Ошибка публикации не должна останавливать обработчик этапа
+            logger.error(f"❌ Ошибка обновления статуса батча {item.batch.id[:8]}: {e}")
+    
+    def _reveal_image(self, staged_path: str, filepath: str):
+        """
+        Переименовывает временный файл изображения в итоговый
+        
+        Время изменения задается строго возрастающим: просмотр папки
+        сортирует по нему, а батчи часто публикуются в один момент.
+        """
+        os.replace(staged_path, filepath)
+        mtime_ns = max(time.time_ns(), self._last_reveal_ns + 1_000_000)
+        os.utime(filepath, ns=(mtime_ns, mtime_ns))
+        self._last_reveal_ns = mtime_ns
+    
+    @staticmethod
+    def _empty_stage_stats() -> Dict[str, Dict]:
+        return {
+            stage: {'processed': 0, 'failed': 0, 'in_progress': 0, 'busy_time': 0.0}
+            for stage in PIPELINE_STAGES
+        }
+    
+    def get_pipeline_stats(self) -> Dict[str, Dict]:
+        """
+        Статистика этапов конвейера
+        
+        Returns:
+            Dict: Для каждого этапа глубина очереди, число батчей в работе,
+            обработано/ошибок, среднее время и пропускная способность (батчей в минуту)
+        """
+        elapsed = time.time() - self._pipeline_started_at if self._pipeline_started_at else 0.0
+        pipeline = {}
+        for stage in PIPELINE_STAGES:
+            stats = self.stage_stats[stage]
+            queue = self._queues.get(stage)
+            done = stats['processed'] + stats['failed']
+            pipeline[stage] = {
+                'queue_depth': queue.qsize() if queue is not None else 0,
+                'in_progress': stats['in_progress'],
+                'processed': stats['processed'],
+                'failed': stats['failed'],
+                'average_time': stats['busy_time'] / done if done else 0.0,
+                'throughput_per_minute': stats['processed'] * 60 / elapsed if elapsed > 0 else 0.0
+            }
+        return pipeline
+    
     def get_stats(self) -> dict:
         """Получает текущую статистику"""
         return {
             **self.processing_stats,
             'is_processing': self.is_processing,
-            'current_batch_id': self.current_batch_id
+            'current_batch_id': self.current_batch_id,
+            'active_batch_ids': list(self.active_batch_ids),
+            'workers': self.workers,
+            'result_order': self.result_order,
+            'pipeline': self.get_pipeline_stats(),
+            'llm_cache': llm_cache.get_stats(),
+            'image_cache': image_cache.get_stats(),
+            'single_flight': single_flight.get_stats()
         }
     
     def reset_stats(self):
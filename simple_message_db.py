@@ -4,9 +4,17 @@
 """
 import json
 import os
+import sqlite3
+import threading
 import time
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from config import DATABASE_URL, MESSAGE_DB_BACKEND, MESSAGE_DB_COMPACT_EVERY
+from event_bus import event_bus
+from journal_store import JournalStore
+from recipient_index import recipient_index
+from state_service import get_shared_object, is_shared
 
 class SimpleMessageDB:
     def __init__(self, db_file="messages.json"):
@@ -51,8 +59,13 @@ class SimpleMessageDB:
                 'source': safe_encode(source)
             }
             
-            self.messages.append(message_data)
-            self.save_messages()
+            self._append_message(message_data)
+            
+            # Обновляем индекс получателей рассылок
+            recipient_index.touch(user_id, message_data['username'], message_data['first_name'],
+                                  message_data['source'], message_data['timestamp'])
+            # Новое сообщение сразу уходит в открытые админ-панели
+            event_bus.publish('message', message_data)
             
             print(f"✅ Сообщение добавлено в БД: {safe_encode(first_name)} ({source}): {safe_encode(message)[:30]}...")
             
@@ -67,11 +80,15 @@ class SimpleMessageDB:
                 'timestamp': time.time(),
                 'source': source
             }
-            self.messages.append(safe_message_data)
-            self.save_messages()
+            self._append_message(safe_message_data)
         except Exception as e:
             print(f"❌ Ошибка при добавлении сообщения: {e}")
     
+    def _append_message(self, message_data: Dict[str, Any]):
+        """Добавляет сообщение в память и сохраняет изменения"""
+        self.messages.append(message_data)
+        self.save_messages()
+    
     def get_stats(self):
         """Возвращает статистику"""
         current_time = time.time()
@@ -105,6 +122,104 @@ class SimpleMessageDB:
         user_messages = [msg for msg in self.messages if msg.get('source') != 'bot']
         return user_messages[-limit:]
     
+    def get_all_messages(self) -> List[Dict[str, Any]]:
+        """Возвращает копию всех сообщений"""
+        return list(self.messages)
+    
+    def count_messages(self) -> int:
+        """Возвращает общее количество сообщений"""
+        return len(self.messages)
+    
+    def get_messages_by_source(self, sources: List[str], limit: Optional[int] = 50,
+                               since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает последние сообщения из указанных источников
+        
+        Args:
+            sources: Список источников ('mini_app', 'telegram', 'admin', ...)
+            limit: Максимальное количество сообщений (None - без ограничения)
+            since: Только сообщения новее этого времени (unix time)
+            
+        Returns:
+            List: Сообщения в хронологическом порядке
+        """
+        result = [
+            msg for msg in self.messages
+            if msg.get('source') in sources and (since is None or msg.get('timestamp', 0) > since)
+        ]
+        return result[-limit:] if limit is not None else result
+    
+    def get_latest_message(self, source: str) -> Optional[Dict[str, Any]]:
+        """Возвращает самое новое сообщение из источника"""
+        latest = None
+        for msg in self.messages:
+            if msg.get('source') == source and (latest is None or msg.get('timestamp', 0) >= latest.get('timestamp', 0)):
+                latest = msg
+        return latest
+    
+    def find_latest_message(self, source: str, markers: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает последнее сообщение источника, содержащее любой из маркеров
+        
+        Args:
+            source: Источник сообщений
+            markers: Подстроки текста (например, эмодзи вопроса администратора)
+            
+        Returns:
+            Optional[Dict]: Сообщение или None
+        """
+        for msg in reversed(self.messages):
+            text = msg.get('message', '')
+            if msg.get('source') == source and any(marker in text for marker in markers):
+                return msg
+        return None
+    
+    def get_user_ids(self, source: Optional[str] = None) -> List[int]:
+        """Возвращает уникальные user_id (опционально только из одного источника)"""
+        user_ids = []
+        seen = set()
+        for msg in self.messages:
+            user_id = msg.get('user_id')
+            if user_id is None or user_id in seen:
+                continue
+            if source is not None and msg.get('source') != source:
+                continue
+            seen.add(user_id)
+            user_ids.append(user_id)
+        return user_ids
+    
+    def delete_messages(self, source: str, before: Optional[float] = None,
+                        message: Optional[str] = None, exclude_timestamp: Optional[float] = None) -> int:
+        """
+        Удаляет сообщения источника по условиям
+        
+        Args:
+            source: Источник сообщений
+            before: Удалять только сообщения старше этого времени
+            message: Удалять только сообщения с таким текстом
+            exclude_timestamp: Не удалять сообщение с этим timestamp
+            
+        Returns:
+            int: Количество удаленных сообщений
+        """
+        def matches(msg):
+            if msg.get('source') != source:
+                return False
+            if before is not None and msg.get('timestamp', 0) >= before:
+                return False
+            if message is not None and msg.get('message', '').strip() != message.strip():
+                return False
+            if exclude_timestamp is not None and msg.get('timestamp', 0) == exclude_timestamp:
+                return False
+            return True
+        
+        old_count = len(self.messages)
+        self.messages = [msg for msg in self.messages if not matches(msg)]
+        removed = old_count - len(self.messages)
+        if removed:
+            self.save_messages()
+        return removed
+    
     def clean_old_messages(self, max_age_seconds=20):
         """Удаляет сообщения старше указанного времени"""
         current_time = time.time()
@@ -125,6 +240,7 @@ class SimpleMessageDB:
         self.messages = []
         self.save_messages()
         print("🗑️ Статистика сброшена")
+        event_bus.publish('messages_cleared')
         return len(self.messages)
     
     def clear_all_messages(self):
@@ -133,7 +249,325 @@ class SimpleMessageDB:
         self.messages = []
         self.save_messages()
         print(f"🗑️ Очищено {count} сообщений")
+        event_bus.publish('messages_cleared')
+        return count
+
+class JournalMessageDB(SimpleMessageDB):
+    """
+    База сообщений с append-only журналом
+    
+    Новое сообщение дописывается в журнал одной строкой вместо перезаписи
+    всего messages.json. Каждые compact_every записей журнал сворачивается
+    в снимок (messages.json в прежнем формате). load_messages() дочитывает
+    только новые строки журнала, записанные другими процессами.
+    """
+    
+    def __init__(self, db_file="messages.json", compact_every=MESSAGE_DB_COMPACT_EVERY):
+        self.compact_every = compact_every
+        self._store = JournalStore(db_file)
+        super().__init__(db_file)
+    
+    def load_messages(self):
+        """Дочитывает новые записи журнала (полная загрузка только после компактирования)"""
+        try:
+            records = self._store.read_new()
+            if records is None:
+                self._full_load()
+            else:
+                self._apply_records(records)
+        except Exception as e:
+            print(f"Ошибка загрузки сообщений: {e}")
+    
+    def _full_load(self):
+        snapshot, records = self._store.load()
+        self.messages = (snapshot or {}).get('messages', [])
+        self._apply_records(records)
+    
+    def _apply_records(self, records: List[Dict[str, Any]]):
+        for record in records:
+            if record.get('op') == 'add':
+                self.messages.append(record['message'])
+    
+    def save_messages(self):
+        """Сохраняет полное состояние: компактирует журнал в снимок"""
+        try:
+            self._store.compact({'messages': self.messages})
+        except Exception as e:
+            print(f"Ошибка сохранения сообщений: {e}")
+    
+    def _append_message(self, message_data: Dict[str, Any]):
+        """Дописывает сообщение в журнал за O(1)"""
+        with self._store.locked():
+            # Сначала подтягиваем записи других процессов, чтобы сохранить порядок
+            self.load_messages()
+            self._store.append({'op': 'add', 'message': message_data})
+            self.messages.append(message_data)
+            
+            if self._store.records_since_compaction >= self.compact_every:
+                self.save_messages()
+    
+    # Удаление и очистка сворачивают журнал в снимок из списка в памяти: под
+    # блокировкой сначала дочитываем записи других процессов, иначе они потеряются
+    
+    def delete_messages(self, *args, **kwargs) -> int:
+        with self._store.locked():
+            self.load_messages()
+            return super().delete_messages(*args, **kwargs)
+    
+    def clean_old_messages(self, max_age_seconds=20):
+        with self._store.locked():
+            self.load_messages()
+            return super().clean_old_messages(max_age_seconds)
+    
+    def reset_stats(self):
+        with self._store.locked():
+            self.load_messages()
+            return super().reset_stats()
+    
+    def clear_all_messages(self):
+        with self._store.locked():
+            self.load_messages()
+            return super().clear_all_messages()
+
+class SQLiteMessageDB(SimpleMessageDB):
+    """
+    База сообщений в SQLite (режим WAL)
+    
+    Индексы по (source, timestamp) и user_id позволяют админским эндпоинтам
+    выполнять ограниченные запросы вместо перечитывания и фильтрации всего
+    списка. WAL допускает одновременное чтение из нескольких процессов.
+    При первом запуске переносит сообщения из messages.json (и его журнала).
+    """
+    
+    _COLUMNS = ('user_id', 'username', 'first_name', 'message', 'timestamp', 'source')
+    
+    def __init__(self, db_path: str = None, legacy_file: str = "messages.json"):
+        self.db_path = db_path or _sqlite_path_from_url(DATABASE_URL)
+        self.db_file = self.db_path
+        self._local = threading.local()
+        self._init_schema()
+        self._import_legacy(legacy_file)
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение на поток (sqlite3 не разделяет соединения между потоками)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _init_schema(self):
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    username TEXT,
+                    first_name TEXT,
+                    message TEXT,
+                    timestamp REAL NOT NULL,
+                    source TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_source_ts ON messages (source, timestamp)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id)")
+    
+    def _import_legacy(self, legacy_file: str):
+        """Переносит сообщения из файловой базы, если таблица пуста"""
+        if not legacy_file or not os.path.exists(legacy_file) or self.count_messages() > 0:
+            return
+        try:
+            snapshot, records = JournalStore(legacy_file).load()
+            legacy = (snapshot or {}).get('messages', [])
+            legacy += [record['message'] for record in records if record.get('op') == 'add']
+            self._insert_many(legacy)
+            if legacy:
+                print(f"📦 Перенесено {len(legacy)} сообщений из {legacy_file} в {self.db_path}")
+        except Exception as e:
+            print(f"Ошибка переноса сообщений из {legacy_file}: {e}")
+    
+    def _insert_many(self, messages: List[Dict[str, Any]], conn: Optional[sqlite3.Connection] = None):
+        """Вставляет сообщения; с conn - в уже открытой транзакции вызывающего"""
+        rows = [tuple(msg.get(col) for col in self._COLUMNS) for msg in messages]
+        sql = "INSERT INTO messages (user_id, username, first_name, message, timestamp, source) VALUES (?, ?, ?, ?, ?, ?)"
+        if conn is not None:
+            conn.executemany(sql, rows)
+            return
+        with self._connection() as conn:
+            conn.executemany(sql, rows)
+    
+    def _query(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        rows = self._connection().execute(sql, params).fetchall()
+        return [{col: row[col] for col in self._COLUMNS} for row in rows]
+    
+    @property
+    def messages(self) -> List[Dict[str, Any]]:
+        """Все сообщения (совместимость со старым кодом; полный запрос к базе)"""
+        return self.get_all_messages()
+    
+    @messages.setter
+    def messages(self, value: List[Dict[str, Any]]):
+        # Одна транзакция: читатели не увидят пустую таблицу между удалением и вставкой
+        with self._connection() as conn:
+            conn.execute("DELETE FROM messages")
+            self._insert_many(value, conn)
+    
+    def load_messages(self):
+        """Данные читаются из базы при каждом запросе - загружать нечего"""
+    
+    def save_messages(self):
+        """Каждая операция фиксируется сразу - сохранять нечего"""
+    
+    def _append_message(self, message_data: Dict[str, Any]):
+        self._insert_many([message_data])
+    
+    def get_stats(self):
+        """Возвращает статистику"""
+        conn = self._connection()
+        current_time = time.time()
+        total, unique_users = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT user_id) FROM messages"
+        ).fetchone()
+        recent = conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE timestamp > ?", (current_time - 15,)
+        ).fetchone()[0]
+        messages_by_hour = {
+            int(hour): count for hour, count in conn.execute(
+                "SELECT strftime('%H', timestamp, 'unixepoch', 'localtime') AS hour, COUNT(*) "
+                "FROM messages GROUP BY hour"
+            )
+        }
+        
+        return {
+            'total_messages': total,
+            'unique_users_count': unique_users,
+            'recent_messages_count': recent,
+            'messages_by_hour': messages_by_hour,
+            'last_reset': current_time,
+            'uptime_hours': 0.1  # Примерное время работы
+        }
+    
+    def get_all_messages(self) -> List[Dict[str, Any]]:
+        return self._query("SELECT * FROM messages ORDER BY id")
+    
+    def count_messages(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    
+    def get_messages(self, limit=50):
+        rows = self._query("SELECT * FROM messages ORDER BY id DESC LIMIT ?", (limit,))
+        return rows[::-1]
+    
+    def get_user_messages_only(self, limit=50):
+        rows = self._query("SELECT * FROM messages WHERE source != 'bot' ORDER BY id DESC LIMIT ?", (limit,))
+        return rows[::-1]
+    
+    def get_messages_by_source(self, sources: List[str], limit: Optional[int] = 50,
+                               since: Optional[float] = None) -> List[Dict[str, Any]]:
+        placeholders = ', '.join('?' for _ in sources)
+        sql = f"SELECT * FROM messages WHERE source IN ({placeholders})"
+        params = list(sources)
+        if since is not None:
+            sql += " AND timestamp > ?"
+            params.append(since)
+        sql += " ORDER BY timestamp DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._query(sql, tuple(params))[::-1]
+    
+    def get_latest_message(self, source: str) -> Optional[Dict[str, Any]]:
+        rows = self._query(
+            "SELECT * FROM messages WHERE source = ? ORDER BY timestamp DESC, id DESC LIMIT 1", (source,)
+        )
+        return rows[0] if rows else None
+    
+    def find_latest_message(self, source: str, markers: List[str]) -> Optional[Dict[str, Any]]:
+        if not markers:
+            return None
+        conditions = ' OR '.join('instr(message, ?) > 0' for _ in markers)
+        rows = self._query(
+            f"SELECT * FROM messages WHERE source = ? AND ({conditions}) ORDER BY id DESC LIMIT 1",
+            (source, *markers)
+        )
+        return rows[0] if rows else None
+    
+    def get_user_ids(self, source: Optional[str] = None) -> List[int]:
+        if source is None:
+            rows = self._connection().execute(
+                "SELECT user_id FROM messages WHERE user_id IS NOT NULL GROUP BY user_id ORDER BY MIN(id)"
+            )
+        else:
+            rows = self._connection().execute(
+                "SELECT user_id FROM messages WHERE source = ? AND user_id IS NOT NULL GROUP BY user_id ORDER BY MIN(id)",
+                (source,)
+            )
+        return [row[0] for row in rows]
+    
+    def delete_messages(self, source: str, before: Optional[float] = None,
+                        message: Optional[str] = None, exclude_timestamp: Optional[float] = None) -> int:
+        sql = "DELETE FROM messages WHERE source = ?"
+        params = [source]
+        if before is not None:
+            sql += " AND timestamp < ?"
+            params.append(before)
+        if message is not None:
+            sql += " AND TRIM(message) = ?"
+            params.append(message.strip())
+        if exclude_timestamp is not None:
+            sql += " AND timestamp != ?"
+            params.append(exclude_timestamp)
+        with self._connection() as conn:
+            return conn.execute(sql, tuple(params)).rowcount
+    
+    def clean_old_messages(self, max_age_seconds=20):
+        """Удаляет сообщения старше указанного времени"""
+        cutoff_time = time.time() - max_age_seconds
+        with self._connection() as conn:
+            removed = conn.execute("DELETE FROM messages WHERE timestamp <= ?", (cutoff_time,)).rowcount
+        if removed:
+            print(f"🧹 Очищено старых сообщений: {removed} (осталось: {self.count_messages()})")
+        return removed
+    
+    def reset_stats(self):
+        """Сбрасывает статистику"""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM messages")
+        print("🗑️ Статистика сброшена")
+        event_bus.publish('messages_cleared')
+        return 0
+    
+    def clear_all_messages(self):
+        """Удаляет все сообщения из базы данных"""
+        with self._connection() as conn:
+            count = conn.execute("DELETE FROM messages").rowcount
+        print(f"🗑️ Очищено {count} сообщений")
+        event_bus.publish('messages_cleared')
         return count
 
-# Глобальный экземпляр
-message_db = SimpleMessageDB()
+def _sqlite_path_from_url(url: str) -> str:
+    """Преобразует DATABASE_URL вида sqlite:///bot.db в путь к файлу"""
+    prefix = "sqlite:///"
+    if not url.startswith(prefix):
+        raise ValueError(f"Ожидался URL SQLite ({prefix}...), получено: {url}")
+    return url[len(prefix):]
+
+def create_message_db(backend: str = MESSAGE_DB_BACKEND) -> SimpleMessageDB:
+    """Создает базу сообщений с выбранным механизмом хранения"""
+    if backend == 'json':
+        return SimpleMessageDB()
+    if backend == 'journal':
+        return JournalMessageDB()
+    if backend == 'sqlite':
+        return SQLiteMessageDB()
+    raise ValueError(f"Неизвестный тип хранилища сообщений: {backend}")
+
+# Глобальный экземпляр: общий объект сервиса состояния (run_system.py) или локальный
+message_db = get_shared_object('message_db')
+if message_db is None:
+    message_db = create_message_db()
+    # Индекс получателей создан впервые - строим его по накопленной истории
+    if not is_shared(recipient_index) and recipient_index.is_new:
+        recipient_index.seed(message_db.get_all_messages())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Объединение одновременных одинаковых запросов (single-flight)
+
+Две вкладки админ-панели, одновременно запросившие микс, или батч и
+админский запрос с тем же промптом изображения раньше платили за два
+одинаковых вызова OpenAI/Gemini. SingleFlight.do() запускает вызов
+один раз на ключ: остальные вызывающие с тем же ключом ждут тот же
+future и получают тот же результат (или то же исключение). После
+завершения ключ освобождается - следующий вызов снова идет в API.
+
+Объединяются только вызовы в одном event loop (future привязан к loop).
+"""
+
+import asyncio
+import logging
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Общий in-flight future для одновременных вызовов с одинаковым ключом"""
+
+    def __init__(self):
+        # Выполняющиеся вызовы для каждого event loop: ключ -> задача
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Task]]" = \
+            weakref.WeakKeyDictionary()
+        self.stats = {'calls': 0, 'shared': 0}
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет factory() один раз для всех одновременных вызовов с ключом key
+
+        Args:
+            key: Ключ запроса (например, хэш промпта)
+            factory: Корутина-функция, выполняющая запрос
+
+        Returns:
+            Any: Результат factory()
+        """
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+
+        task = calls.get(key)
+        if task is None:
+            self.stats['calls'] += 1
+            task = loop.create_task(factory())
+            calls[key] = task
+            task.add_done_callback(lambda _: calls.pop(key, None))
+        else:
+            self.stats['shared'] += 1
+            logger.info(f"🔗 Запрос объединен с выполняющимся ({key!r:.60})")
+
+        # shield: отмена одного из ожидающих не отменяет общий запрос для остальных
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Метрики: запущенные вызовы и объединенные с ними запросы"""
+        return dict(self.stats, in_flight=sum(len(calls) for calls in self._calls.values()))
+
+
+# Глобальный экземпляр
+single_flight = SingleFlight()
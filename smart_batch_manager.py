@@ -10,6 +10,13 @@ from dataclasses import dataclass
 from enum import Enum
 from typing import List, Dict, Optional
 
+from batching_policy import batching_policy
+from config import SMART_BATCH_SNAPSHOT_EVERY
+from content_filter import content_filter
+from event_bus import event_bus
+from journal_store import JournalStore
+from state_service import get_shared_object
+
 logger = logging.getLogger(__name__)
 
 class BatchStatus(Enum):
@@ -47,49 +54,66 @@ class SmartBatch:
         return len(self.messages)
 
 class SmartBatchManager:
-    def __init__(self, data_file='smart_batch_data.json'):
+    """
+    Менеджер батчей с журналом событий
+    
+    Каждое изменение (новое сообщение, создание батчей, смена статуса)
+    дописывается в журнал одной записью, а полный снимок состояния
+    (smart_batch_data.json) пишется раз в snapshot_every событий.
+    При загрузке снимок восстанавливается и журнал проигрывается поверх него.
+    """
+    
+    def __init__(self, data_file='smart_batch_data.json', snapshot_every: int = SMART_BATCH_SNAPSHOT_EVERY):
         self.data_file = data_file
+        self.snapshot_every = snapshot_every
         self.messages: List[Message] = []
         self.batches: List[SmartBatch] = []
         self.current_batch_index = 0
         self.is_processing = False
         self.processed_message_ids: set = set()  # NEW: Отслеживание обработанных сообщений
+        self._store = JournalStore(data_file)
         
         # Загружаем данные из файла при инициализации
         self._load_from_file()
         
         logger.info("🚀 SmartBatchManager инициализирован")
     
+    @staticmethod
+    def _message_to_dict(msg: Message) -> Dict:
+        return {
+            'id': msg.id,
+            'user_id': msg.user_id,
+            'username': msg.username,
+            'first_name': msg.first_name,
+            'content': msg.content,
+            'timestamp': msg.timestamp
+        }
+    
+    @staticmethod
+    def _message_from_dict(data: Dict) -> Message:
+        return Message(
+            id=data['id'],
+            user_id=data['user_id'],
+            username=data['username'],
+            first_name=data['first_name'],
+            content=data['content'],
+            timestamp=data['timestamp']
+        )
+    
     def _save_to_file(self):
-        """Сохранить данные в файл"""
+        """
+        Сохранить полный снимок данных (журнал начинается заново)
+        
+        Вызывается под блокировкой хранилища после reload(): иначе события,
+        дописанные другими процессами, потеряются при сворачивании журнала.
+        """
         try:
-            import json
             data = {
-                'messages': [
-                    {
-                        'id': msg.id,
-                        'user_id': msg.user_id,
-                        'username': msg.username,
-                        'first_name': msg.first_name,
-                        'content': msg.content,
-                        'timestamp': msg.timestamp
-                    }
-                    for msg in self.messages
-                ],
+                'messages': [self._message_to_dict(msg) for msg in self.messages],
                 'batches': [
                     {
                         'id': batch.id,
-                        'messages': [
-                            {
-                                'id': msg.id,
-                                'user_id': msg.user_id,
-                                'username': msg.username,
-                                'first_name': msg.first_name,
-                                'content': msg.content,
-                                'timestamp': msg.timestamp
-                            }
-                            for msg in batch.messages
-                        ],
+                        'messages': [self._message_to_dict(msg) for msg in batch.messages],
                         'status': batch.status.value,
                         'created_at': batch.created_at,
                         'mixed_text': batch.mixed_text,
@@ -103,52 +127,25 @@ class SmartBatchManager:
                 'processed_message_ids': list(self.processed_message_ids)
             }
             
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self._store.compact(data)
                 
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения данных: {e}")
     
     def _load_from_file(self):
-        """Загрузить данные из файла"""
+        """Загрузить снимок из файла и проиграть журнал событий"""
         try:
-            import json
-            import os
-            
-            if not os.path.exists(self.data_file):
-                return
-            
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data, events = self._store.load()
+            data = data or {}
             
             # Загружаем сообщения
-            self.messages = [
-                Message(
-                    id=msg['id'],
-                    user_id=msg['user_id'],
-                    username=msg['username'],
-                    first_name=msg['first_name'],
-                    content=msg['content'],
-                    timestamp=msg['timestamp']
-                )
-                for msg in data.get('messages', [])
-            ]
+            self.messages = [self._message_from_dict(msg) for msg in data.get('messages', [])]
             
             # Загружаем батчи
             self.batches = [
                 SmartBatch(
                     id=batch['id'],
-                    messages=[
-                        Message(
-                            id=msg['id'],
-                            user_id=msg['user_id'],
-                            username=msg['username'],
-                            first_name=msg['first_name'],
-                            content=msg['content'],
-                            timestamp=msg['timestamp']
-                        )
-                        for msg in batch['messages']
-                    ],
+                    messages=[self._message_from_dict(msg) for msg in batch['messages']],
                     status=BatchStatus(batch['status']),
                     created_at=batch['created_at'],
                     mixed_text=batch.get('mixed_text'),
@@ -163,14 +160,93 @@ class SmartBatchManager:
             # Загружаем обработанные ID
             self.processed_message_ids = set(data.get('processed_message_ids', []))
             
-            logger.info(f"📂 Загружено из файла: {len(self.messages)} сообщений, {len(self.batches)} батчей")
+            # Проигрываем события журнала поверх снимка
+            for event in events:
+                self._apply_event(event)
+            
+            logger.info(f"📂 Загружено из файла: {len(self.messages)} сообщений, {len(self.batches)} батчей "
+                        f"({len(events)} событий журнала)")
             
         except Exception as e:
             logger.error(f"❌ Ошибка загрузки данных: {e}")
     
     def reload(self):
-        """Перезагрузить данные из файла (для синхронизации между процессами)"""
-        self._load_from_file()
+        """Дочитать изменения других процессов (для синхронизации между процессами)"""
+        try:
+            events = self._store.read_new()
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения журнала: {e}")
+            return
+        
+        if events is None:
+            # Журнал свернут в новый снимок - загружаем полностью
+            self._load_from_file()
+            return
+        for event in events:
+            self._apply_event(event)
+    
+    def _apply_event(self, event: Dict):
+        """Применить событие журнала к состоянию в памяти"""
+        op = event.get('op')
+        
+        if op == 'add_message':
+            self.messages.append(self._message_from_dict(event['message']))
+        
+        elif op == 'create_batches':
+            pending = {msg.id: msg for msg in self.messages}
+            for batch_data in event['batches']:
+                self.batches.append(SmartBatch(
+                    id=batch_data['id'],
+                    messages=[pending[msg_id] for msg_id in batch_data['message_ids'] if msg_id in pending],
+                    status=BatchStatus.PENDING,
+                    created_at=batch_data['created_at']
+                ))
+            consumed_ids = set(event['consumed_ids'])
+            self.messages = [msg for msg in self.messages if msg.id not in consumed_ids]
+            self.processed_message_ids.update(consumed_ids)
+        
+        elif op == 'status':
+            for batch in self.batches:
+                if batch.id == event['batch_id']:
+                    batch.status = BatchStatus(event['status'])
+                    for key, value in event.get('fields', {}).items():
+                        setattr(batch, key, value)
+                    break
+        
+        else:
+            logger.warning(f"⚠️ Неизвестное событие журнала: {op}")
+    
+    def _record(self, event: Dict):
+        """Записать событие в журнал и применить его; снимок - раз в snapshot_every событий"""
+        try:
+            self._store.append(event)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи в журнал: {e}")
+        
+        self._apply_event(event)
+        
+        if self._store.records_since_compaction >= self.snapshot_every:
+            self._save_to_file()
+        
+        self._publish_event(event)
+    
+    def _publish_event(self, event: Dict):
+        """Сообщает админ-панели об изменении: событие шины с затронутыми батчами"""
+        op = event['op']
+        if op == 'create_batches':
+            batch_ids = {batch['id'] for batch in event['batches']}
+        elif op == 'status':
+            batch_ids = {event['batch_id']}
+        else:
+            batch_ids = set()
+        
+        try:
+            event_bus.publish('batches', {
+                'op': op,
+                'batches': [self._batch_info(batch) for batch in self.batches if batch.id in batch_ids]
+            })
+        except Exception as e:
+            logger.error(f"❌ Ошибка публикации события батчей: {e}")
 
     def add_message(self, user_id: int, username: str, first_name: str, content: str) -> str:
         """Добавить новое сообщение"""
@@ -188,84 +264,65 @@ class SmartBatchManager:
             logger.warning(f"⚠️ Попытка добавить уже обработанное сообщение: {message.id}")
             return message.id
 
-        self.messages.append(message)
-        logger.info(f"✅ Сообщение добавлено: {message.id} от {first_name} ({len(self.messages)} всего)")
+        with self._store.locked():
+            # Подтягиваем изменения других процессов, чтобы журнал оставался упорядоченным
+            self.reload()
+            self._record({'op': 'add_message', 'message': self._message_to_dict(message)})
         
-        # Сохраняем данные в файл
-        self._save_to_file()
+        logger.info(f"✅ Сообщение добавлено: {message.id} от {first_name} ({len(self.messages)} всего)")
 
         return message.id
 
     def create_batches(self) -> List[SmartBatch]:
         """Создать батчи из накопленных сообщений"""
+        with self._store.locked():
+            # Учитываем сообщения, добавленные другими процессами
+            self.reload()
+            return self._create_batches()
+
+    def _create_batches(self) -> List[SmartBatch]:
         if not self.messages:
             logger.info("📝 Нет сообщений для создания батчей")
             return []
 
         # Создаем снимок сообщений для обработки
         messages_snapshot = self.messages.copy()
-        total_messages = len(messages_snapshot)
         
-        logger.info(f"📊 Создание батчей из {total_messages} сообщений")
-
-        created_batches = []
+        # Небезопасные сообщения отбрасываем до батчинга, чтобы они не попали в микс LLM
+        verdicts = content_filter.check_many([msg.content for msg in messages_snapshot])
+        safe_messages = [msg for msg, (is_safe, _) in zip(messages_snapshot, verdicts) if is_safe]
+        rejected = len(messages_snapshot) - len(safe_messages)
+        if rejected:
+            logger.warning(f"🚫 Отфильтровано {rejected} небезопасных сообщений")
+        total_messages = len(safe_messages)
         
-        if total_messages >= 10:
-            # Создаем 10 пропорциональных батчей
-            batch_size = total_messages // 10
-            remainder = total_messages % 10
-            
-            logger.info(f"📊 Создание 10 пропорциональных батчей (размер: {batch_size}, остаток: {remainder})")
-            
-            start_idx = 0
-            for i in range(10):
-                # Добавляем остаток к первым батчам
-                current_batch_size = batch_size + (1 if i < remainder else 0)
-                end_idx = start_idx + current_batch_size
-                
-                batch_messages = messages_snapshot[start_idx:end_idx]
-                
-                batch = SmartBatch(
-                    id=str(uuid.uuid4()),
-                    messages=batch_messages,
-                    status=BatchStatus.PENDING,
-                    created_at=time.time()
-                )
-                
-                created_batches.append(batch)
-                logger.info(f"  ✅ Батч {i+1}/10: {len(batch_messages)} сообщений от {batch_messages[0].first_name}")
-                start_idx = end_idx
-        else:
-            # Создаем батчи по 1 сообщению
-            logger.info(f"📊 Создание {total_messages} батчей по 1 сообщению")
-            
-            for i, message in enumerate(messages_snapshot):
-                batch = SmartBatch(
-                    id=str(uuid.uuid4()),
-                    messages=[message],
-                    status=BatchStatus.PENDING,
-                    created_at=time.time()
-                )
-                
-                created_batches.append(batch)
-                logger.info(f"  ✅ Батч {i+1}/{total_messages}: 1 сообщение от {message.first_name}")
-
-        # Добавляем созданные батчи в очередь
-        self.batches.extend(created_batches)
+        logger.info(f"📊 Создание батчей из {total_messages} сообщений")
 
-        # Отмечаем все сообщения из батчей как обработанные
-        for message in messages_snapshot:
-            self.processed_message_ids.add(message.id)
+        # Размер и число батчей выбирает политика батчинга (BATCHING_STRATEGY)
+        batch_groups = batching_policy.create_groups(safe_messages)
+        for i, group in enumerate(batch_groups):
+            logger.info(f"  ✅ Батч {i+1}/{len(batch_groups)}: {len(group)} сообщений от {group[0].first_name}")
 
-        # ВАЖНО: Очищаем использованные сообщения СРАЗУ после создания батчей
-        # Это предотвращает повторное использование тех же сообщений
-        self.messages.clear()
-        logger.info(f"🗑️ Очищено {total_messages} обработанных сообщений из очереди")
+        # Одно событие журнала: батчи добавляются в очередь, их сообщения
+        # отмечаются обработанными и СРАЗУ удаляются из очереди сообщений
+        # (это предотвращает повторное использование тех же сообщений);
+        # отфильтрованные сообщения тоже удаляются
+        self._record({
+            'op': 'create_batches',
+            'batches': [
+                {
+                    'id': str(uuid.uuid4()),
+                    'message_ids': [msg.id for msg in group],
+                    'created_at': time.time()
+                }
+                for group in batch_groups
+            ],
+            'consumed_ids': [msg.id for msg in messages_snapshot]
+        })
+        created_batches = self.batches[-len(batch_groups):] if batch_groups else []
+        logger.info(f"🗑️ Очищено {len(messages_snapshot)} обработанных сообщений из очереди")
         logger.info(f"📝 Всего отслеживается {len(self.processed_message_ids)} обработанных сообщений")
 
-        # Сохраняем данные в файл после создания батчей
-        self._save_to_file()
-
         logger.info(f"🎉 Создано {len(created_batches)} батчей для обработки")
         return created_batches
 
@@ -279,22 +336,22 @@ class SmartBatchManager:
         # Возвращаем первый ожидающий батч
         return pending_batches[0]
 
+    def get_pending_batches(self) -> List[SmartBatch]:
+        """Получить все ожидающие батчи в порядке создания"""
+        return [b for b in self.batches if b.status == BatchStatus.PENDING]
+
     def update_batch_status(self, batch_id: str, status: BatchStatus, **kwargs):
         """Обновить статус батча"""
-        for batch in self.batches:
-            if batch.id == batch_id:
-                batch.status = status
-                
-                # Обновляем дополнительные поля
-                for key, value in kwargs.items():
-                    if hasattr(batch, key):
-                        setattr(batch, key, value)
-                
-                logger.info(f"📝 Батч {batch_id} обновлен: {status.value}")
-                
-                # Сохраняем данные в файл после обновления
-                self._save_to_file()
-                break
+        with self._store.locked():
+            self.reload()
+            for batch in self.batches:
+                if batch.id == batch_id:
+                    # Дополнительные поля, которые есть у батча
+                    fields = {key: value for key, value in kwargs.items() if hasattr(batch, key)}
+                    self._record({'op': 'status', 'batch_id': batch_id, 'status': status.value, 'fields': fields})
+                    
+                    logger.info(f"📝 Батч {batch_id} обновлен: {status.value}")
+                    break
 
     def get_statistics(self) -> Dict:
         """Получить статистику"""
@@ -312,73 +369,89 @@ class SmartBatchManager:
         }
         return stats
 
+    @staticmethod
+    def _batch_info(batch: SmartBatch) -> Dict:
+        return {
+            'id': batch.id,
+            'status': batch.status.value,
+            'message_count': len(batch.messages),
+            'created_at': batch.created_at,
+            'mixed_text': batch.mixed_text,
+            'image_path': batch.image_path,
+            'completed_at': batch.completed_at,
+            'processing_time': batch.processing_time,
+            'error_message': batch.error_message
+        }
+
     def get_all_batches_info(self) -> List[Dict]:
         """Получить информацию о всех батчах"""
-        batches_info = []
-        
-        for batch in self.batches:
-            batch_info = {
-                'id': batch.id,
-                'status': batch.status.value,
-                'message_count': len(batch.messages),
-                'created_at': batch.created_at,
-                'mixed_text': batch.mixed_text,
-                'image_path': batch.image_path,
-                'completed_at': batch.completed_at,
-                'processing_time': batch.processing_time,
-                'error_message': batch.error_message
-            }
-            batches_info.append(batch_info)
-        
-        return batches_info
+        return [self._batch_info(batch) for batch in self.batches]
 
     def clear_all_batches(self) -> int:
         """Очистить все батчи"""
-        before_count = len(self.batches)
-        self.batches = []
-        self.current_batch_index = 0
-        self.processed_message_ids.clear()
+        with self._store.locked():
+            # Подтягиваем изменения других процессов до сворачивания журнала
+            self.reload()
+            before_count = len(self.batches)
+            self.batches = []
+            self.current_batch_index = 0
+            self.processed_message_ids.clear()
+            self._save_to_file()
         logger.info(f"🗑️ Очищено {before_count} батчей")
+        event_bus.publish('batches_cleared')
         return before_count
 
     def clear_completed_batches(self, older_than_hours: int = 1) -> int:
         """Очистить старые завершенные батчи"""
         cutoff_time = time.time() - (older_than_hours * 3600)
-        before_count = len(self.batches)
         
-        # Собираем ID сообщений из удаляемых батчей для очистки
-        removed_message_ids = set()
-        for batch in self.batches:
-            if batch.status in [BatchStatus.COMPLETED, BatchStatus.FAILED] and batch.created_at < cutoff_time:
-                for message in batch.messages:
-                    removed_message_ids.add(message.id)
-
-        self.batches = [
-            batch for batch in self.batches
-            if not (batch.status in [BatchStatus.COMPLETED, BatchStatus.FAILED]
-                   and batch.created_at < cutoff_time)
-        ]
-        after_count = len(self.batches)
-
-        # Очищаем ID старых обработанных сообщений
-        if removed_message_ids:
-            self.processed_message_ids -= removed_message_ids
-            logger.info(f"🧹 Очищено {len(removed_message_ids)} ID старых обработанных сообщений")
-
-        removed_count = before_count - after_count
+        with self._store.locked():
+            self.reload()
+            before_count = len(self.batches)
+            
+            # Собираем ID сообщений из удаляемых батчей для очистки
+            removed_message_ids = set()
+            for batch in self.batches:
+                if batch.status in [BatchStatus.COMPLETED, BatchStatus.FAILED] and batch.created_at < cutoff_time:
+                    for message in batch.messages:
+                        removed_message_ids.add(message.id)
+
+            self.batches = [
+                batch for batch in self.batches
+                if not (batch.status in [BatchStatus.COMPLETED, BatchStatus.FAILED]
+                       and batch.created_at < cutoff_time)
+            ]
+            after_count = len(self.batches)
+
+            # Очищаем ID старых обработанных сообщений
+            if removed_message_ids:
+                self.processed_message_ids -= removed_message_ids
+                logger.info(f"🧹 Очищено {len(removed_message_ids)} ID старых обработанных сообщений")
+
+            removed_count = before_count - after_count
+            if removed_count > 0:
+                self._save_to_file()
+
         if removed_count > 0:
             logger.info(f"🧹 Удалено {removed_count} старых батчей")
+            event_bus.publish('batches_cleared')
 
         return removed_count
 
     def reset(self):
         """Полный сброс менеджера"""
-        self.messages.clear()
-        self.batches.clear()
-        self.processed_message_ids.clear()  # NEW: Clear processed message IDs
-        self.current_batch_index = 0
-        self.is_processing = False
+        with self._store.locked():
+            self.reload()
+            self.messages.clear()
+            self.batches.clear()
+            self.processed_message_ids.clear()  # NEW: Clear processed message IDs
+            self.current_batch_index = 0
+            self.is_processing = False
+            self._save_to_file()
         logger.info("🔄 SmartBatchManager сброшен")
+        event_bus.publish('batches_cleared')
 
-# Создаем глобальный экземпляр
-smart_batch_manager = SmartBatchManager()
\ No newline at end of file
+# Глобальный экземпляр: общий объект сервиса состояния (run_system.py) или локальный
+smart_batch_manager = get_shared_object('smart_batch_manager')
+if smart_batch_manager is None:
+    smart_batch_manager = SmartBatchManager()
\ No newline at end of file
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Сервис общего состояния для процессов бота и админ-панели
+
+run_system.py поднимает сервер (multiprocessing manager на Unix-сокете) и
+передает его адрес дочерним процессам через переменные окружения. Модули
+message_db / smart_batch_manager / prompt_manager / mini_app_feed при импорте подключаются к
+сервису и получают прокси на единственный экземпляр объекта вместо
+собственной копии, синхронизируемой через JSON-файлы.
+
+Если сервис не запущен (например, app.py стартует отдельно), модули
+создают локальные объекты, как раньше.
+"""
+
+import importlib
+import logging
+import os
+import socket
+import threading
+from multiprocessing.managers import BaseManager, BaseProxy
+from typing import Any, Dict, Optional
+
+from config import STATE_SERVICE_SOCKET
+
+logger = logging.getLogger(__name__)
+
+# Переменные окружения, через которые дочерние процессы находят сервис
+ADDRESS_ENV = "STATE_SERVICE_ADDRESS"
+AUTHKEY_ENV = "STATE_SERVICE_AUTHKEY"
+
+# Общие объекты: имя -> (модуль, глобальная переменная, сериализовать ли вызовы)
+SHARED_OBJECTS = {
+    'message_db': ('simple_message_db', 'message_db', True),
+    'recipient_index': ('recipient_index', 'recipient_index', True),
+    'smart_batch_manager': ('smart_batch_manager', 'smart_batch_manager', True),
+    'prompt_store': ('prompt_manager', 'prompt_store', True),
+    # Шина событий синхронизирована сама: ожидание в get_events() не должно держать общую блокировку
+    'event_bus': ('event_bus', 'event_bus', False),
+    # Лента Mini App тоже: long-poll ждет на собственном Condition ленты
+    'mini_app_feed': ('mini_app_feed', 'mini_app_feed', False),
+}
+
+
+class StateServiceManager(BaseManager):
+    """Менеджер общего состояния"""
+
+
+class _Synchronized:
+    """Сериализует вызовы к объекту: сервер обслуживает каждого клиента в своем потоке"""
+
+    def __init__(self, target: Any, lock: threading.RLock):
+        self._target = target
+        self._lock = lock
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+
+def _public_methods(obj: Any) -> tuple:
+    return tuple(
+        name for name in dir(type(obj))
+        if not name.startswith('_') and callable(getattr(obj, name, None))
+    )
+
+
+def _parse_address(address: str):
+    """'/path/to.sock' -> путь Unix-сокета, 'host:port' -> TCP-адрес"""
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+def start_state_service(address: Optional[str] = None) -> Dict[str, str]:
+    """
+    Запускает сервер общего состояния в фоновом потоке текущего процесса
+
+    Args:
+        address: Путь Unix-сокета или 'host:port' (по умолчанию STATE_SERVICE_SOCKET)
+
+    Returns:
+        dict: Переменные окружения для дочерних процессов
+    """
+    if address is None:
+        address = STATE_SERVICE_SOCKET if hasattr(socket, 'AF_UNIX') else "127.0.0.1:50055"
+    parsed_address = _parse_address(address)
+    if isinstance(parsed_address, str) and os.path.exists(parsed_address):
+        os.remove(parsed_address)  # Сокет от предыдущего запуска
+
+    authkey = os.urandom(16)
+
+    for name, (module_name, attr_name, synchronized) in SHARED_OBJECTS.items():
+        target = getattr(importlib.import_module(module_name), attr_name)
+        exposed = _public_methods(target)
+        if synchronized:
+            target = _Synchronized(target, threading.RLock())
+        StateServiceManager.register(name, callable=lambda obj=target: obj, exposed=exposed)
+
+    manager = StateServiceManager(address=parsed_address, authkey=authkey)
+    server = manager.get_server()
+    thread = threading.Thread(target=server.serve_forever, name="state-service", daemon=True)
+    thread.start()
+
+    logger.info(f"🔗 Сервис общего состояния запущен: {address}")
+    return {ADDRESS_ENV: address, AUTHKEY_ENV: authkey.hex()}
+
+
+_client_manager: Optional[StateServiceManager] = None
+_client_lock = threading.Lock()
+
+
+def _connect() -> Optional[StateServiceManager]:
+    global _client_manager
+
+    address = os.getenv(ADDRESS_ENV)
+    if not address:
+        return None
+
+    with _client_lock:
+        if _client_manager is not None:
+            return _client_manager
+
+        for name in SHARED_OBJECTS:
+            StateServiceManager.register(name)
+
+        manager = StateServiceManager(
+            address=_parse_address(address),
+            authkey=bytes.fromhex(os.getenv(AUTHKEY_ENV, ''))
+        )
+        try:
+            manager.connect()
+        except Exception as e:
+            logger.error(f"❌ Не удалось подключиться к сервису состояния {address}: {e}")
+            return None
+
+        logger.info(f"🔗 Подключено к сервису общего состояния: {address}")
+        _client_manager = manager
+        return manager
+
+
+def get_shared_object(name: str) -> Optional[Any]:
+    """
+    Возвращает прокси на общий объект или None, если сервис не запущен
+
+    Args:
+        name: Имя объекта из SHARED_OBJECTS
+    """
+    manager = _connect()
+    if manager is None:
+        return None
+    return getattr(manager, name)()
+
+
+def is_shared(obj: Any) -> bool:
+    """True если объект - прокси на общий объект сервиса"""
+    return isinstance(obj, BaseProxy)
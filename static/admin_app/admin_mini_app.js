@@ -2,6 +2,14 @@
 const downloadedImageUrls = new Set();
 let tg = null;
 let updateInterval = null;
+let smartBatchInterval = null;
+
+// Поток событий админ-панели (SSE) и данные, которые он обновляет
+let eventSource = null;
+let adminMessages = [];
+let smartBatches = [];
+let generatedImages = [];
+let dashboardReloadTimer = null;
 
 // Переменные для системы очереди промтов
 let legacyPromptIndex = 0;
@@ -21,17 +29,12 @@ document.addEventListener('DOMContentLoaded', function() {
         document.body.style.backgroundColor = tg.backgroundColor || '#ffffff';
         document.body.style.color = tg.textColor || '#000000';
         
-        
-        // Запускаем автообновление
-        startAutoUpdate();
-        
-        // Загружаем начальные данные
+        // Загружаем начальные данные (там же подключаются push-обновления)
         loadInitialData();
         
     } else {
         console.error('Telegram WebApp API не инициализирован');
         // Для тестирования в браузере
-        startAutoUpdate();
         loadInitialData();
     }
 });
@@ -59,6 +62,11 @@ async function loadInitialData() {
             return;
         }
         
+        // Подключаемся к потоку событий до загрузки данных, чтобы не пропустить изменения
+        if (!connectEventStream()) {
+            startAutoUpdate();
+        }
+        
         await refreshMessages();
         initializePromptQueue();
         
@@ -99,7 +107,11 @@ function initializePromptQueue() {
     }
 }
 
+// Периодический опрос сообщений (если поток событий недоступен)
 function startAutoUpdate() {
+    if (updateInterval) {
+        return;
+    }
     updateInterval = setInterval(async () => {
         try {
             await refreshMessages();
@@ -110,6 +122,79 @@ function startAutoUpdate() {
     
 }
 
+// Push-обновления: одно SSE-соединение вместо нескольких циклов опроса
+function connectEventStream() {
+    if (!window.EventSource) {
+        console.warn('⚠️ EventSource не поддерживается, используем периодический опрос');
+        return false;
+    }
+    
+    eventSource = new EventSource('/api/admin/events');
+    
+    eventSource.addEventListener('audience_message', (event) => {
+        const data = JSON.parse(event.data);
+        adminMessages.push(data.message);
+        if (data.limit && adminMessages.length > data.limit) {
+            adminMessages = adminMessages.slice(-data.limit);
+        }
+        updateMessagesDisplay(adminMessages);
+    });
+    
+    eventSource.addEventListener('batches', (event) => {
+        const data = JSON.parse(event.data);
+        data.batches.forEach(batch => {
+            const index = smartBatches.findIndex(b => (b.batch_id || b.id) === batch.id);
+            if (index >= 0) {
+                smartBatches[index] = batch;
+            } else {
+                smartBatches.push(batch);
+            }
+            if (batch.mixed_text) {
+                showCurrentMixedText(batch.mixed_text);
+            }
+        });
+        updateSmartBatchListDisplay(smartBatches);
+    });
+    
+    eventSource.addEventListener('stats', (event) => {
+        const data = JSON.parse(event.data);
+        updateSmartBatchStatsDisplay(data.batch_stats, data.processor_stats);
+    });
+    
+    eventSource.addEventListener('image', (event) => {
+        const image = JSON.parse(event.data);
+        generatedImages = [image, ...generatedImages.filter(img => img.batch_id !== image.batch_id)];
+        showGeneratedImages(generatedImages);
+    });
+    
+    // Данные очищены или соединение пропустило слишком много событий
+    eventSource.addEventListener('reset', () => reloadDashboard());
+    
+    eventSource.onerror = () => {
+        // При обрыве браузер переподключается сам (с Last-Event-ID); CLOSED - сервер отказал
+        if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+            console.warn('⚠️ Поток событий закрыт, переключаемся на периодический опрос');
+            eventSource = null;
+            startAutoUpdate();
+            startSmartBatchPolling();
+        }
+    };
+    
+    return true;
+}
+
+// Полная перезагрузка данных панели (с объединением повторных запросов)
+function reloadDashboard() {
+    clearTimeout(dashboardReloadTimer);
+    dashboardReloadTimer = setTimeout(() => {
+        refreshMessages();
+        loadSmartBatchStats();
+        loadSmartBatchList();
+        loadCurrentMixedText();
+        loadGeneratedImages();
+    }, 300);
+}
+
 // Остановка автообновления
 function stopAutoUpdate() {
     if (updateInterval) {
@@ -131,7 +216,8 @@ async function refreshMessages() {
         const data = await response.json();
         
         if (data.success) {
-            updateMessagesDisplay(data.messages);
+            adminMessages = data.messages || [];
+            updateMessagesDisplay(adminMessages);
         } else {
             throw new Error(data.error || 'Ошибка получения сообщений');
         }
@@ -276,6 +362,32 @@ function showNotification(message, type = 'info') {
     }, 3000);
 }
 
+// Отслеживание фоновой рассылки Telegram: опрашиваем прогресс до завершения
+async function watchBroadcast(jobId, label = 'Рассылка') {
+    if (!jobId) return;
+    
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        try {
+            const response = await fetch(`/api/admin/broadcasts/${jobId}`);
+            const data = await response.json();
+            if (!data.success) return;
+            
+            const job = data.job;
+            console.log(`📣 ${label}: ${job.sent + job.failed + job.skipped}/${job.total}`, job);
+            if (job.status === 'done') {
+                const type = job.failed > 0 ? 'warning' : 'success';
+                showNotification(`${label}: доставлено ${job.sent} из ${job.total}` +
+                    (job.failed ? `, ошибок ${job.failed}` : ''), type);
+                return;
+            }
+        } catch (error) {
+            console.error('Ошибка получения прогресса рассылки:', error);
+            return;
+        }
+    }
+}
+
 // Обработка закрытия приложения
 if (Telegram.WebApp) {
     Telegram.WebApp.onEvent('viewport_changed', function() {
@@ -1126,6 +1238,7 @@ ${descriptionValue}
         if (data.success) {
             showNotification('Сообщение перед треком отправлено!', 'success');
             console.log('✅ Сообщение успешно отправлено');
+            watchBroadcast(data.broadcast_job_id, 'Сообщение перед треком');
         } else {
             showNotification(data.message || 'Ошибка отправки сообщения', 'error');
             console.error('❌ Ошибка отправки:', data.message);
@@ -1176,6 +1289,7 @@ async function sendAudienceResponse() {
         
         if (data.success) {
             showNotification('Ответ зрителям отправлен!', 'success');
+            watchBroadcast(data.broadcast_job_id, 'Ответ зрителям');
             // Очищаем поле
             document.getElementById('ai-comment').value = '';
         } else {
@@ -1221,6 +1335,7 @@ async function sendConcertEnd() {
         
         if (data.success) {
             showNotification('Финальное сообщение отправлено!', 'success');
+            watchBroadcast(data.broadcast_job_id, 'Финальное сообщение');
         } else {
             showNotification(data.message || 'Ошибка отправки финального сообщения', 'error');
         }
@@ -1398,7 +1513,8 @@ async function loadSmartBatchList() {
         const data = await response.json();
         
         if (data.success) {
-            updateSmartBatchListDisplay(data.batches);
+            smartBatches = data.batches;
+            updateSmartBatchListDisplay(smartBatches);
         }
     } catch (error) {
         console.error('Ошибка загрузки списка батчей:', error);
@@ -1534,16 +1650,21 @@ async function loadCurrentMixedText() {
         const data = await response.json();
         
         if (data.success) {
-            const mixedTextElement = document.getElementById('current-mixed-text');
-            if (mixedTextElement) {
-                mixedTextElement.textContent = data.mixed_text;
-            }
+            showCurrentMixedText(data.mixed_text);
         }
     } catch (error) {
         console.error('Ошибка загрузки миксированного текста:', error);
     }
 }
 
+// Отображение текущего миксированного текста
+function showCurrentMixedText(mixedText) {
+    const mixedTextElement = document.getElementById('current-mixed-text');
+    if (mixedTextElement) {
+        mixedTextElement.textContent = mixedText;
+    }
+}
+
 // Автообновление для умных батчей
 function startSmartBatchAutoUpdate() {
     // Загружаем данные сразу
@@ -1552,8 +1673,20 @@ function startSmartBatchAutoUpdate() {
     loadCurrentMixedText();
     loadGeneratedImages();
     
+    // Изменения приходят через поток событий; опрос - только без него
+    if (!eventSource) {
+        startSmartBatchPolling();
+    }
+}
+
+// Периодический опрос умных батчей (если поток событий недоступен)
+function startSmartBatchPolling() {
+    if (smartBatchInterval) {
+        return;
+    }
+    
     // Обновляем каждые 5 секунд
-    setInterval(async () => {
+    smartBatchInterval = setInterval(async () => {
         await loadSmartBatchStats();
         await loadSmartBatchList();
         await loadCurrentMixedText();
@@ -1582,15 +1715,8 @@ async function loadGeneratedImages() {
             if (data.images.length === 0) {
                 console.log('📭 Нет изображений для отображения');
             }
-            updateImagesGridDisplay(data.images);
-            // Автоскачивание новых сгенерированных изображений
-            data.images.forEach(img => {
-                if (!downloadedImageUrls.has(img.image_url)) {
-                    downloadedImageUrls.add(img.image_url);
-                    console.log('📥 Автоскачиваем новое изображение:', img.image_url);
-                    downloadImage(img.image_url, img.mixed_text);
-                }
-            });
+            generatedImages = data.images;
+            showGeneratedImages(generatedImages);
         } else {
             console.error('Ошибка загрузки изображений:', data.error);
         }
@@ -1599,6 +1725,18 @@ async function loadGeneratedImages() {
     }
 }
 
+// Отображение изображений и автоскачивание новых
+function showGeneratedImages(images) {
+    updateImagesGridDisplay(images);
+    images.forEach(img => {
+        if (!downloadedImageUrls.has(img.image_url)) {
+            downloadedImageUrls.add(img.image_url);
+            console.log('📥 Автоскачиваем новое изображение:', img.image_url);
+            downloadImage(img.image_url, img.mixed_text);
+        }
+    });
+}
+
 // Обновление отображения сетки изображений
 function updateImagesGridDisplay(images) {
     console.log('🎨 Обновляем отображение изображений:', images);
@@ -2646,6 +2784,7 @@ async function clearAllChats() {
         if (data.success) {
             // Показываем уведомление об успехе
             alert('✅ Вся история чатов успешно очищена!\n\nУдалено:\n• Все сообщения\n• Все батчи\n• Все изображения');
+            watchBroadcast(data.broadcast_job_id, 'Уведомление об очистке');
             
             // Обновляем все данные
             await loadSmartBatchStats();
@@ -2758,6 +2897,7 @@ function previewFullPrompt() {
 // Генерация изображения
 async function generateCustomImage() {
     const customPrompt = document.getElementById('custom-prompt').value.trim();
+    const newVariation = document.getElementById('image-new-variation');
     
     if (!customPrompt) {
         showNotification('Пожалуйста, введите промт для генерации изображения', 'warning');
@@ -2780,7 +2920,8 @@ async function generateCustomImage() {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({
-                custom_prompt: customPrompt
+                custom_prompt: customPrompt,
+                use_cache: !(newVariation && newVariation.checked)
             })
         });
         
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Асинхронная массовая рассылка сообщений через Telegram Bot API
+
+Рассылка запускается фоновой задачей в общем event loop (async_bridge) и
+сразу возвращает ID задачи, по которому админ-панель получает прогресс.
+Сообщения отправляют несколько воркеров через долгоживущий HTTP-клиент;
+общий token bucket держит темп в пределах лимитов Telegram (около 30
+сообщений в секунду на бота), а ответ 429 приостанавливает всю рассылку на
+retry_after секунд с повторной отправкой сообщения.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+from async_bridge import async_bridge
+from config import TELEGRAM_BROADCAST_RATE, TELEGRAM_BROADCAST_WORKERS
+from http_pool import http_pool, pool_limits
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket для event loop: rate токенов в секунду, не больше capacity
+
+    Проверка и списание токена происходят без await, поэтому в одном loop
+    блокировка не нужна.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    async def acquire(self):
+        """Ждет свободный токен (и окончание паузы после 429)"""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу токенов (Telegram вернул 429 с retry_after)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+@dataclass
+class BroadcastJob:
+    """Состояние задачи рассылки"""
+    id: str
+    name: str
+    total: int
+    status: str = 'queued'  # queued -> running -> done
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0
+    retries: int = 0
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    errors: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'retries': self.retries,
+            'progress': (self.sent + self.failed + self.skipped) / self.total if self.total else 1.0,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'errors': self.errors[-10:]
+        }
+
+
+class TelegramBroadcaster:
+    """Рассылка одного сообщения списку пользователей с ограничением темпа"""
+
+    MAX_JOBS = 50
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, rate: float = TELEGRAM_BROADCAST_RATE, workers: int = TELEGRAM_BROADCAST_WORKERS):
+        self.rate = rate
+        self.workers = max(1, workers)
+        self._bucket = TokenBucket(rate)
+        self._jobs: Dict[str, BroadcastJob] = {}
+        self._lock = threading.Lock()
+
+    def start_broadcast(self, bot_token: str, user_ids: Iterable[int], text: str,
+                        reply_markup: Optional[Dict] = None, parse_mode: str = 'Markdown',
+                        name: str = 'broadcast') -> str:
+        """
+        Ставит рассылку в очередь и сразу возвращает ID задачи
+
+        Args:
+            bot_token: Токен бота, от имени которого идет рассылка
+            user_ids: ID получателей (user_id = 0 - локальная разработка, пропускается)
+            text: Текст сообщения
+            reply_markup: Клавиатура сообщения (опционально)
+            parse_mode: Режим разметки
+            name: Название рассылки для логов и админ-панели
+
+        Returns:
+            str: ID задачи рассылки
+        """
+        recipients = list(dict.fromkeys(user_ids))
+        job = BroadcastJob(id=uuid.uuid4().hex[:12], name=name, total=len(recipients))
+
+        with self._lock:
+            self._jobs[job.id] = job
+            # Храним только последние задачи
+            for old_id in list(self._jobs)[:-self.MAX_JOBS]:
+                del self._jobs[old_id]
+
+        payload = {'text': text, 'parse_mode': parse_mode}
+        if reply_markup:
+            payload['reply_markup'] = reply_markup
+
+        async_bridge.submit(self._run_job(job, bot_token, recipients, payload))
+        logger.info(f"📣 Рассылка {job.id} ({name}) поставлена в очередь: {job.total} получателей")
+        return job.id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Прогресс задачи рассылки или None, если задача не найдена"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Последние задачи рассылки, новые первыми"""
+        with self._lock:
+            return [job.to_dict() for job in reversed(list(self._jobs.values()))]
+
+    async def _run_job(self, job: BroadcastJob, bot_token: str, recipients: List[int], payload: Dict):
+        job.status = 'running'
+        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        queue: asyncio.Queue = asyncio.Queue()
+        for user_id in recipients:
+            queue.put_nowait((user_id, 1))
+
+        async def worker():
+            while True:
+                user_id, attempt = await queue.get()
+                try:
+                    await self._send_one(job, url, user_id, attempt, payload, queue)
+                except Exception as e:
+                    job.failed += 1
+                    job.errors.append(f"{user_id}: {e}")
+                    logger.error(f"❌ Рассылка {job.id}: ошибка отправки пользователю {user_id}: {e}")
+                finally:
+                    queue.task_done()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(min(self.workers, len(recipients)) or 1)]
+        try:
+            await queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            job.status = 'done'
+            job.finished_at = time.time()
+
+        logger.info(f"📣 Рассылка {job.id} завершена: отправлено {job.sent}, ошибок {job.failed}, "
+                    f"пропущено {job.skipped} из {job.total} за {job.finished_at - job.created_at:.1f}s")
+
+    async def _send_one(self, job: BroadcastJob, url: str, user_id: int, attempt: int,
+                        payload: Dict, queue: asyncio.Queue):
+        # user_id = 0 - локальная разработка, отправлять некуда
+        if user_id == 0:
+            job.skipped += 1
+            return
+
+        await self._bucket.acquire()
+        client = http_pool.get('telegram', limits=pool_limits(self.workers), timeout=10)
+        try:
+            response = await client.post(url, content=json.dumps({'chat_id': user_id, **payload}),
+                                         headers={'Content-Type': 'application/json'})
+        except httpx.TransportError as e:
+            self._retry_or_fail(job, user_id, attempt, queue, f"сетевая ошибка: {e}")
+            return
+
+        if response.status_code == 429:
+            retry_after = self._retry_after(response)
+            logger.warning(f"⏳ Рассылка {job.id}: Telegram ограничил частоту, пауза {retry_after}s")
+            self._bucket.pause(retry_after)
+            self._retry_or_fail(job, user_id, attempt, queue, f"429, retry_after={retry_after}")
+            return
+
+        result = self._json(response)
+        if response.status_code == 200 and result.get('ok'):
+            job.sent += 1
+            return
+
+        # 400/403 (бот заблокирован, чат не найден) повторять бессмысленно
+        if response.status_code >= 500:
+            self._retry_or_fail(job, user_id, attempt, queue, f"HTTP {response.status_code}")
+            return
+        job.failed += 1
+        job.errors.append(f"{user_id}: {result.get('description') or f'HTTP {response.status_code}'}")
+        logger.warning(f"⚠️ Рассылка {job.id}: не удалось отправить пользователю {user_id}: "
+                       f"{result.get('description') or response.status_code}")
+
+    def _retry_or_fail(self, job: BroadcastJob, user_id: int, attempt: int, queue: asyncio.Queue, reason: str):
+        if attempt < self.MAX_ATTEMPTS:
+            job.retries += 1
+            queue.put_nowait((user_id, attempt + 1))
+        else:
+            job.failed += 1
+            job.errors.append(f"{user_id}: {reason}")
+
+    @staticmethod
+    def _json(response: httpx.Response) -> Dict:
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+    def _retry_after(self, response: httpx.Response) -> float:
+        retry_after = self._json(response).get('parameters', {}).get('retry_after')
+        if retry_after is None:
+            retry_after = response.headers.get('Retry-After', 1)
+        try:
+            return max(float(retry_after), 1.0)
+        except (TypeError, ValueError):
+            return 1.0
+
+
+# Глобальный экземпляр рассыльщика
+telegram_broadcaster = TelegramBroadcaster()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Тесты фильтра контента в режиме морфологии (вердикты на типичных сообщениях)
+
+Запуск: python -m pytest test_content_filter.py
+"""
+
+import logging
+import unittest
+
+from content_filter import ContentFilter
+
+# Предупреждения о блокировке не нужны в выводе тестов
+logging.getLogger('content_filter').setLevel(logging.ERROR)
+
+
+class MorphologyFilterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.filter = ContentFilter(morphology=True)
+
+    def assertBlocked(self, text):
+        self.assertFalse(self.filter.is_safe_content(text)[0], text)
+
+    def assertAllowed(self, text):
+        self.assertEqual(self.filter.is_safe_content(text), (True, ""), text)
+
+    def test_obscene_words_match_as_substring(self):
+        for text in ("хуйня", "bullshit", "dickhead", "fuck this weather"):
+            self.assertBlocked(text)
+
+    def test_obscene_word_forms(self):
+        self.assertBlocked("суки")
+
+    def test_derived_words_match_by_root(self):
+        for text in ("идиотка", "сексуальный", "террористы", "убийства в городе"):
+            self.assertBlocked(text)
+
+    def test_innocent_words_containing_keywords(self):
+        for text in ("award ceremony", "Sussex", "кровать у окна", "убили время"):
+            self.assertAllowed(text)
+
+    def test_word_forms_allowed_in_cultural_context(self):
+        self.assertBlocked("войны")
+        self.assertAllowed("лекция про войну 1812 года")
+        self.assertAllowed("кровь и война в фильме про историю")
+        self.assertAllowed("в музее кровь")
+
+    def test_allowed_phrases(self):
+        for text in ("Звездные войны", "Звёздные Войны: Новая надежда", "Война и мир", "star wars"):
+            self.assertAllowed(text)
+        self.assertBlocked("звездные войны и террористы")
+
+    def test_sample_verdicts_match_substring_mode(self):
+        substring_filter = ContentFilter(morphology=False)
+        for text in ("море", "это было тупой фильм", "голый король из сказки",
+                     "Спасибо за концерт, было очень красиво!", "музей искусства ночью"):
+            self.assertEqual(self.filter.is_safe_content(text)[0], substring_filter.is_safe_content(text)[0], text)
+
+
+if __name__ == '__main__':
+    unittest.main()
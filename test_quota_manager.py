@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Тесты учета квоты Gemini (QuotaManager без базы, только окна в памяти)
+
+Запуск: python -m pytest test_quota_manager.py
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Глобальный QuotaManager создается при импорте модуля: база - во временной папке, а не в текущей
+_TMP_DIR = tempfile.mkdtemp(prefix='quota_test_')
+os.environ['QUOTA_DB_FILE'] = os.path.join(_TMP_DIR, 'gemini_quota.db')
+
+from quota_manager import QuotaLimits, QuotaManager, SlidingWindow  # noqa: E402
+
+
+def tearDownModule():
+    shutil.rmtree(_TMP_DIR, ignore_errors=True)
+
+
+class SlidingWindowTest(unittest.TestCase):
+    def test_wait_time_none_when_amount_exceeds_limit(self):
+        window = SlidingWindow(60)
+        self.assertIsNone(window.wait_time(amount=50, limit=10, current_time=time.time()))
+
+    def test_wait_time_until_oldest_entry_expires(self):
+        window = SlidingWindow(60)
+        window.add(1000.0, 8)
+        self.assertEqual(window.wait_time(amount=5, limit=10, current_time=1010.0), 50.0)
+
+
+class OversizedRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = QuotaManager(QuotaLimits(tokens_per_minute=100), db_path=None)
+
+    def test_oversized_request_is_not_admitted_over_limit(self):
+        # В пустом окне запрос допускается и учитывается как весь лимит
+        can_request, _ = self.manager.try_acquire(estimated_tokens=500)
+        self.assertTrue(can_request)
+        self.assertEqual(self.manager.windows['tokens_per_minute'].total, 100)
+
+        can_request, wait_time = self.manager.try_acquire(estimated_tokens=500)
+        self.assertFalse(can_request)
+        self.assertGreater(wait_time, 0)
+        self.assertEqual(self.manager.windows['tokens_per_minute'].total, 100)
+
+    def test_oversized_request_waits_for_empty_window(self):
+        self.manager.try_acquire(estimated_tokens=10)
+
+        can_request, wait_time = self.manager.try_acquire(estimated_tokens=500)
+        self.assertFalse(can_request)
+        self.assertGreater(wait_time, 0)
+        self.assertEqual(self.manager.windows['tokens_per_minute'].total, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()